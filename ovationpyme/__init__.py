@@ -1,3 +1,11 @@
 from . import ovation_prime
 from . import ovation_utilities
 from . import ovation_plotting
+from . import ovation_profiling
+from . import ovation_indices
+from . import ovation_geographic
+from . import ovation_timeseries
+from . import ovation_dataset
+from . import ovation_reanalysis
+from . import ovation_golden
+from . import ovation_boundaries
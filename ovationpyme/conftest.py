@@ -0,0 +1,37 @@
+import pytest
+
+import numpy as np
+from numpy import testing as nptest
+
+from ovationpyme import ovation_utilities
+from ovationpyme.ovation_indices import IndexArchive
+"""
+Fixtures shared by the unit tests
+"""
+
+@pytest.fixture()
+def archive(request):
+    """
+    Drivers for a test module's times (its startdt and step) without
+    reading solar wind data, set as the index archive for the test.
+    Parametrize indirectly with (dF, f107) arrays to use other values:
+
+        @pytest.mark.parametrize('archive', [(dF, f107)], indirect=True)
+    """
+    dF, f107 = getattr(request, 'param', (np.linspace(1500., 9000., 8), np.full(8, 120.)))
+    archive = IndexArchive(request.module.startdt, request.module.step, dF, f107)
+    ovation_utilities.set_index_archive(archive)
+    def fin():
+        ovation_utilities.set_index_archive(None)
+    request.addfinalizer(fin)
+    return archive
+
+@pytest.fixture()
+def assert_conductance_close():
+    """
+    Compare conductance computed for different chunks of times, whose
+    AACGM conversions round differently
+    """
+    def assert_close(actual, desired):
+        nptest.assert_allclose(actual, desired, rtol=1e-4)
+    return assert_close
@@ -0,0 +1,152 @@
+"""
+Auroral oval boundaries
+
+The equatorward and poleward boundaries of the oval in each MLT sector
+are the magnetic latitudes where the flux crosses a threshold, found by
+linear interpolation between the latitude bins on either side. They are
+computed for many times at once (vectorized over the latitude, local
+time and time axes), and over long time ranges in chunks, so only the
+compact (time, mlt) boundary arrays are kept:
+
+    dts, mlts, boundaries = boundary_timeseries(datetime(2015,1,1),
+                                                datetime(2015,2,1),
+                                                timedelta(minutes=15),
+                                                hemis=['N','S'])
+    equatorward, poleward = boundaries['N']   #(ntime, nmlt)
+"""
+from collections import OrderedDict
+
+import numpy as np
+
+from ovationpyme.ovation_prime import FluxEstimator
+from ovationpyme.ovation_timeseries import time_chunks, iter_drivers, _flux_hemis
+
+from logbook import Logger
+log = Logger('OvationPyme.ovation_boundaries')
+
+#Default threshold (erg/cm^2/s for energy flux)
+default_threshold = 0.2
+
+def _crossing_mlats(abs_mlats, fluxes, i_inside, i_outside, threshold):
+    """
+    Latitude where the flux crosses threshold between bin i_inside
+    (above the threshold) and its neighbour i_outside, the latitude of
+    i_inside where there is no neighbour or it is not finite
+    """
+    n_mlat = len(abs_mlats)
+    has_outside = (i_outside >= 0) & (i_outside < n_mlat)
+    i_outside = np.clip(i_outside, 0, n_mlat-1)
+    flux_inside = np.take_along_axis(fluxes, i_inside[:, np.newaxis, :], axis=1)[:, 0, :]
+    flux_outside = np.take_along_axis(fluxes, i_outside[:, np.newaxis, :], axis=1)[:, 0, :]
+    mlat_inside, mlat_outside = abs_mlats[i_inside], abs_mlats[i_outside]
+    has_outside &= np.isfinite(flux_outside)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        fraction = (flux_inside-threshold)/(flux_inside-flux_outside)
+        return np.where(has_outside, mlat_inside+fraction*(mlat_outside-mlat_inside), mlat_inside)
+
+def flux_boundaries(mlat_grid, fluxgrids, threshold=default_threshold):
+    """
+    Equatorward and poleward oval boundaries of flux grids
+
+    mlat_grid - np.ndarray (nmlat, nmlt)
+        magnetic latitudes of the grids (negative in the south)
+
+    fluxgrids - np.ndarray (ntime, nmlat, nmlt) or (nmlat, nmlt)
+
+    threshold - float
+        flux level of the boundaries
+
+    Returns equatorward, poleward (ntime, nmlt) (or (nmlt,)) magnetic
+    latitudes (with the sign of mlat_grid), the lowest and highest
+    latitudes where the flux of each MLT sector crosses the threshold.
+    NaN in sectors where no flux reaches the threshold. Where the flux
+    is above it at the edge of the grid the boundary is that edge.
+    """
+    fluxgrids = np.asarray(fluxgrids, dtype=float)
+    single = fluxgrids.ndim == 2
+    if single:
+        fluxgrids = fluxgrids[np.newaxis]
+    mlats = mlat_grid[:, 0]
+    #Bins ordered from the equator to the pole
+    order = np.argsort(np.abs(mlats))
+    abs_mlats = np.abs(mlats[order])
+    sign = -1. if np.all(mlats <= 0.) else 1.
+    fluxes = fluxgrids[:, order, :]
+    n_mlat = len(abs_mlats)
+
+    above = fluxes >= threshold
+    any_above = np.any(above, axis=1)
+    i_equatorward = np.argmax(above, axis=1)
+    i_poleward = n_mlat-1-np.argmax(above[:, ::-1, :], axis=1)
+
+    equatorward = _crossing_mlats(abs_mlats, fluxes, i_equatorward, i_equatorward-1, threshold)
+    poleward = _crossing_mlats(abs_mlats, fluxes, i_poleward, i_poleward+1, threshold)
+    equatorward[~any_above] = np.nan
+    poleward[~any_above] = np.nan
+    equatorward *= sign
+    poleward *= sign
+    if single:
+        return equatorward[0], poleward[0]
+    return equatorward, poleward
+
+def get_boundaries_for_times(estimator, dts, hemi='N', threshold=default_threshold, dFs=None):
+    """
+    Oval boundaries of a FluxEstimator for each of dts (evaluated
+    together with get_flux_for_times)
+
+    Returns mlts (nmlt,), equatorward, poleward (ntime, nmlt) (see
+    flux_boundaries), for each hemisphere if hemi is 'both'
+    """
+    outs = estimator.get_flux_for_times(dts, hemi=hemi, dFs=dFs)
+    boundaries = []
+    for i_hemi in range(len(outs)//3):
+        mlat_grid, mlt_grid, gridfluxes = outs[3*i_hemi:3*i_hemi+3]
+        boundaries.append(mlt_grid[0, :])
+        boundaries.extend(flux_boundaries(mlat_grid, gridfluxes, threshold))
+    return tuple(boundaries)
+
+def boundary_timeseries(startdt, enddt, step, atype='diff', energy_or_number='energy', hemis=['N'],
+                        threshold=default_threshold, chunk_size=24, readahead=True, solarwind_cadence='1min',
+                        estimator=None):
+    """
+    Oval boundaries for each time of
+    ovation_timeseries.time_range(startdt, enddt, step)
+
+    The flux grids are computed chunk_size times at a time and reduced
+    to boundaries, so memory use does not grow with the number of times
+    beyond the boundary arrays (see iter_flux for readahead and
+    solarwind_cadence)
+
+    estimator - FluxEstimator, optional
+        one which is already loaded (for atype and energy_or_number)
+
+    Returns dts (list), mlts (nmlt,) and an OrderedDict of equatorward,
+    poleward (ntime, nmlt) (see flux_boundaries) with the hemispheres as
+    keys
+    """
+    if estimator is None:
+        estimator = FluxEstimator(atype, energy_or_number, solarwind_cadence=solarwind_cadence).preload()
+    flux_hemis = _flux_hemis(hemis)
+
+    all_dts, mlts = [], None
+    chunk_boundaries = OrderedDict([(hemi, ([], [])) for hemi_arg, hemi_names in flux_hemis
+                                    for hemi in hemi_names])
+    chunks = time_chunks(startdt, enddt, step, chunk_size)
+    for dts, dFs, _ in iter_drivers(chunks, solarwind_cadence=solarwind_cadence, readahead=readahead):
+        all_dts.extend(dts)
+        for hemi_arg, hemi_names in flux_hemis:
+            outs = get_boundaries_for_times(estimator, dts, hemi=hemi_arg, threshold=threshold, dFs=dFs)
+            for i_hemi, hemi in enumerate(hemi_names):
+                mlts, equatorward, poleward = outs[3*i_hemi:3*i_hemi+3]
+                chunk_boundaries[hemi][0].append(equatorward)
+                chunk_boundaries[hemi][1].append(poleward)
+
+    if mlts is None:
+        mlts = estimator.get_flux_for_times([], hemi='N', dFs=[])[1][0, :]
+    n_mlt = len(mlts)
+    boundaries = OrderedDict()
+    for hemi, (equatorwards, polewards) in chunk_boundaries.items():
+        boundaries[hemi] = (np.concatenate(equatorwards) if equatorwards else np.zeros((0, n_mlt)),
+                            np.concatenate(polewards) if polewards else np.zeros((0, n_mlt)))
+    log.info('Boundaries for {0} times'.format(len(all_dts)))
+    return all_dts, mlts, boundaries
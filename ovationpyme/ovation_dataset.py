@@ -0,0 +1,160 @@
+"""
+Model output as a lazily evaluated xarray Dataset
+
+model_dataset returns an xarray Dataset with (time, mlat, mlt) variables
+for the requested products, and the Newell coupling (dF) and F10.7 for
+each time, backed by Dask arrays. Nothing is evaluated when it is
+created; each chunk of times is computed with the batched estimator
+methods only when (and if) it is needed, so years of model output can be
+sliced, resampled and reduced without holding all of it in memory:
+
+    ds = model_dataset(datetime(2010,1,1), datetime(2020,1,1),
+                       timedelta(hours=1), fluxes=[('diff','energy')],
+                       conductance=True)
+    ds['sigp'].sel(time='2015-03').mean('time').compute()
+    ds['diff_energy_flux'].resample(time='1D').max().compute()
+
+Needs the optional xarray and dask packages
+(pip install ovationpyme[dataset]).
+"""
+import numpy as np
+
+from ovationpyme.ovation_prime import FluxEstimator, AverageEnergyEstimator, ConductanceEstimator
+from ovationpyme.ovation_timeseries import time_chunks, _chunk_drivers
+
+from logbook import Logger
+log = Logger('OvationPyme.ovation_dataset')
+
+try:
+    import xarray
+    import dask
+    import dask.array
+except ImportError:
+    xarray = None
+    dask = None
+
+_units = {'energy': 'erg/cm^2/s', 'number': '1/cm^2/s'}
+
+def _drivers(dts, solarwind_cadence):
+    return _chunk_drivers(dts, solarwind_cadence, True)
+
+def _flux_chunk(estimator, dts, drivers, hemi):
+    return estimator.get_flux_for_times(dts, hemi=hemi, dFs=drivers[0])[2]
+
+def _eavg_chunk(estimator, dts, drivers, hemi):
+    return estimator.get_eavg_for_times(dts, hemi=hemi, dFs=drivers[0])[2]
+
+def _conductance_chunk(estimator, dts, drivers, hemi, fluxtypes):
+    #AACGM conversions hold ovation_prime's AACGM lock, so conductance
+    #chunks can run at the same time in dask's threads
+    outs = estimator.get_conductance_for_times(dts, hemi=hemi, conductance_fluxtypes=fluxtypes,
+                                               dFs=drivers[0], f107s=drivers[1])
+    return np.stack(outs[2:4], axis=1)
+
+def model_dataset(startdt, enddt, step, hemi='N', fluxes=[('diff', 'energy')], eavg=[], conductance=False,
+                  conductance_fluxtypes=['diff'], chunk_size=24, solarwind_cadence='1min', coarsen=None):
+    """
+    Lazily evaluated model output for the times of
+    ovation_timeseries.time_range(startdt, enddt, step)
+
+    fluxes - list of (atype, energy_or_number)
+        flux variables, named e.g. 'diff_energy_flux'
+
+    eavg - list of str
+        auroral types of average energy variables, named e.g. 'diff_eavg'
+
+    conductance - bool
+        include the Pedersen and Hall conductance ('sigp', 'sigh')
+        from the auroral types conductance_fluxtypes
+
+    chunk_size - int
+        number of times in each Dask chunk (evaluated together)
+
+    coarsen - tuple, optional
+        use the coarse grid (see SeasonalFluxEstimator)
+
+    Returns an xarray.Dataset with coordinates time, mlat (negative for
+    hemi='S') and mlt, and dF and f107 variables along time. The
+    coefficient tables are loaded when it is created and shared between
+    the products.
+    """
+    if xarray is None:
+        raise ImportError('model_dataset needs the xarray and dask packages')
+    if hemi not in ['N', 'S']:
+        raise ValueError('Invalid hemisphere {0} (use N or S)'.format(hemi))
+
+    #One estimator per auroral type and flux, shared by all of the products
+    flux_estimators = {}
+    def flux_estimator(atype, energy_or_number):
+        if (atype, energy_or_number) not in flux_estimators:
+            estimator = FluxEstimator(atype, energy_or_number, coarsen=coarsen,
+                                      solarwind_cadence=solarwind_cadence)
+            flux_estimators[(atype, energy_or_number)] = estimator.preload()
+        return flux_estimators[(atype, energy_or_number)]
+
+    eavg_atypes = list(eavg)+(list(conductance_fluxtypes) if conductance else [])
+    eavg_estimators = {}
+    for atype in eavg_atypes:
+        if atype not in eavg_estimators:
+            eavg_estimators[atype] = AverageEnergyEstimator(atype,
+                                                            numflux_estimator=flux_estimator(atype, 'number'),
+                                                            energyflux_estimator=flux_estimator(atype, 'energy'))
+    for atype, energy_or_number in fluxes:
+        flux_estimator(atype, energy_or_number)
+    conductance_estimator = None
+    if conductance:
+        conductance_estimator = ConductanceEstimator(fluxtypes=conductance_fluxtypes,
+                                                     numflux_estimators={atype: flux_estimator(atype, 'number')
+                                                                         for atype in conductance_fluxtypes},
+                                                     eavg_estimators=eavg_estimators)
+
+    #The grid is the same for every time (and product)
+    any_estimator = list(flux_estimators.values())[0] if flux_estimators else flux_estimator('diff', 'energy')
+    grid_mlats, grid_mlts = any_estimator.get_flux_for_times([], hemi=hemi, dFs=[])[:2]
+    grid_shape = grid_mlats.shape
+
+    chunks = list(time_chunks(startdt, enddt, step, chunk_size))
+    dts = [dt for chunk in chunks for dt in chunk]
+    log.info('Dataset of {0} times in {1} chunks'.format(len(dts), len(chunks)))
+
+    delayed = lambda func: dask.delayed(func, pure=False)
+    chunk_drivers = [delayed(_drivers)(chunk, solarwind_cadence) for chunk in chunks]
+
+    def lazy(chunk_tasks, shape):
+        if not chunk_tasks:
+            return dask.array.zeros((0,)+shape, chunks=(1,)+shape)
+        return dask.array.concatenate([dask.array.from_delayed(task, shape=(len(chunk),)+shape, dtype=float)
+                                       for chunk, task in zip(chunks, chunk_tasks)], axis=0)
+
+    data_vars = {}
+    data_vars['dF'] = (('time',), lazy([drivers[0] for drivers in chunk_drivers], ()),
+                       {'long_name': 'Newell solar wind coupling'})
+    data_vars['f107'] = (('time',), lazy([drivers[1] for drivers in chunk_drivers], ()),
+                         {'long_name': 'F10.7', 'units': 'sfu'})
+
+    grid_dims = ('time', 'mlat', 'mlt')
+    for atype, energy_or_number in fluxes:
+        tasks = [delayed(_flux_chunk)(flux_estimator(atype, energy_or_number), chunk, drivers, hemi)
+                 for chunk, drivers in zip(chunks, chunk_drivers)]
+        data_vars['{0}_{1}_flux'.format(atype, energy_or_number)] = (
+            grid_dims, lazy(tasks, grid_shape),
+            {'long_name': '{0} {1} flux'.format(atype, energy_or_number), 'units': _units[energy_or_number]})
+
+    for atype in eavg:
+        tasks = [delayed(_eavg_chunk)(eavg_estimators[atype], chunk, drivers, hemi)
+                 for chunk, drivers in zip(chunks, chunk_drivers)]
+        data_vars['{0}_eavg'.format(atype)] = (grid_dims, lazy(tasks, grid_shape),
+                                               {'long_name': '{0} average energy'.format(atype), 'units': 'keV'})
+
+    if conductance:
+        tasks = [delayed(_conductance_chunk)(conductance_estimator, chunk, drivers, hemi, conductance_fluxtypes)
+                 for chunk, drivers in zip(chunks, chunk_drivers)]
+        sigs = lazy(tasks, (2,)+grid_shape)
+        data_vars['sigp'] = (grid_dims, sigs[:, 0], {'long_name': 'Pedersen conductance', 'units': 'mho'})
+        data_vars['sigh'] = (grid_dims, sigs[:, 1], {'long_name': 'Hall conductance', 'units': 'mho'})
+
+    coords = {'time': np.array(dts, dtype='datetime64[ns]'),
+              'mlat': grid_mlats[:, 0],
+              'mlt': grid_mlts[0, :]}
+    attrs = {'hemisphere': hemi, 'solarwind_cadence': solarwind_cadence}
+    return xarray.Dataset(data_vars, coords=coords, attrs=attrs)
@@ -0,0 +1,251 @@
+"""
+Model output on a geographic latitude/longitude grid
+
+The model grids are in magnetic latitude and local time. Where each
+point of a geographic grid falls on them depends on the AACGM
+coefficients (the date) for the magnetic latitude and longitude, and on
+the UT for the magnetic local time. GeographicRemapper converts the
+geographic grid to AACGM once per UT day (AACGM epoch), and keeps the
+bilinear interpolation from the model grid to the geographic points as
+a sparse matrix for each UT bin, so that remapping each time step is a
+single sparse matrix-vector product.
+
+    remapper = GeographicRemapper(glats=np.arange(-89.5, 90., 1.),
+                                  glons=np.arange(-179.5, 180., 1.))
+    glats, glons, energyflux = remapper.flux_for_time(estimator, dt)
+    glats, glons, sigp, sigh = remapper.conductance_for_time(conductance_estimator, dt)
+
+Geographic points outside of the model grid (magnetic latitudes
+equatorward of 50 degrees) are set to fill_value.
+"""
+import datetime
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from scipy import sparse
+
+from ovationpyme.ovation_prime import _geo_to_aacgm, _mlt_to_mlon
+from ovationpyme.ovation_profiling import stage
+
+from logbook import Logger
+log = Logger('OvationPyme.ovation_geographic')
+
+class GeographicRemapper(object):
+    """
+    Bilinear remapping of model grids (magnetic latitude and local
+    time) onto a fixed geographic grid, with the interpolation weights
+    cached per AACGM epoch (UT day) and UT bin
+    """
+    def __init__(self, glats=np.arange(-89.5, 90., 1.), glons=np.arange(-179.5, 180., 1.),
+                 height=110., ut_bin_minutes=1., cache_size=64, fill_value=np.nan,
+                 mlats=np.linspace(50., 90., 80), mlts=np.linspace(0., 24., 96)):
+        """
+        glats, glons - np.ndarray
+            geographic (geodetic) latitudes and longitudes, 1D axes of a
+            rectangular grid or 2D arrays of the same shape
+
+        height - float
+            height (km) of the AACGM conversion
+
+        ut_bin_minutes - float
+            the magnetic local time of the geographic points is computed
+            at the start of each UT bin of this length (one degree of
+            longitude is four minutes of local time)
+
+        cache_size - int
+            number of UT bin remapping matrices to keep
+
+        fill_value - float
+            value of geographic points outside of the model grid
+
+        mlats, mlts - np.ndarray
+            absolute magnetic latitudes and magnetic local times of the
+            rows and columns of the model grids (the ovation_prime grid)
+        """
+        glats, glons = np.asarray(glats, dtype=float), np.asarray(glons, dtype=float)
+        if glats.ndim == 1 and glons.ndim == 1:
+            glats, glons = np.meshgrid(glats, glons, indexing='ij')
+        if glats.shape != glons.shape:
+            raise ValueError('Latitude and longitude grids must have the same shape')
+        if ut_bin_minutes <= 0.:
+            raise ValueError('UT bin length must be positive, got {0}'.format(ut_bin_minutes))
+
+        self.glats = glats
+        self.glons = glons
+        self.shape = glats.shape
+        self.height = height
+        self.ut_bin = datetime.timedelta(minutes=ut_bin_minutes)
+        self.cache_size = cache_size
+        self.fill_value = fill_value
+        self.mlats = np.asarray(mlats, dtype=float)
+        self.mlts = np.asarray(mlts, dtype=float)
+
+        self._epochs = OrderedDict()
+        self._operators = OrderedDict()
+        self._cache_lock = threading.Lock()
+
+    def _bin_start(self, dt):
+        day = datetime.datetime(dt.year, dt.month, dt.day)
+        return day+((dt-day)//self.ut_bin)*self.ut_bin
+
+    def _epoch(self, day):
+        """
+        AACGM coordinates of the geographic points for a UT day and the
+        magnetic latitude part of the interpolation (for each hemisphere)
+        """
+        if day not in self._epochs:
+            with stage('aacgm_conversion'):
+                flatmlats, flatmlons = _geo_to_aacgm(self.glats.flatten(), self.glons.flatten(),
+                                                     day, height=self.height)
+            flatmlats, flatmlons = np.asarray(flatmlats, dtype=float), np.asarray(flatmlons, dtype=float)
+            absmlats = np.abs(flatmlats)
+            on_grid = np.logical_and(np.isfinite(flatmlons), np.isfinite(absmlats))
+            on_grid[on_grid] = np.logical_and(absmlats[on_grid] >= self.mlats[0],
+                                              absmlats[on_grid] <= self.mlats[-1])
+            hemispheres = {}
+            for hemi in ['N', 'S']:
+                inds = np.flatnonzero(np.logical_and(on_grid, flatmlats > 0. if hemi == 'N' else flatmlats < 0.))
+                i_mlat, w_mlat = _interval_weights(self.mlats, absmlats[inds])
+                hemispheres[hemi] = (inds, flatmlons[inds], i_mlat, w_mlat)
+            self._epochs[day] = hemispheres
+            while len(self._epochs) > 2:
+                self._epochs.popitem(last=False)
+        return self._epochs[day]
+
+    def operator(self, dt, hemi):
+        """
+        Sparse matrix which interpolates a flattened model grid of hemi
+        ('N' or 'S') to the geographic points at dt, and the (flat)
+        indices of the geographic points it gives values for
+        """
+        if hemi not in ['N', 'S']:
+            raise ValueError('Invalid hemisphere {0} (use N or S)'.format(hemi))
+        bin_dt = self._bin_start(dt)
+        key = (bin_dt, hemi)
+        with self._cache_lock:
+            if key in self._operators:
+                self._operators.move_to_end(key)
+                return self._operators[key]
+
+            day = datetime.datetime(bin_dt.year, bin_dt.month, bin_dt.day)
+            inds, mlons, i_mlat, w_mlat = self._epoch(day)[hemi]
+
+            #Magnetic longitude is linear in MLT
+            with stage('aacgm_conversion'):
+                midnight_mlon = _mlt_to_mlon(np.zeros(1), bin_dt)[0]
+            mlts = np.mod((mlons-midnight_mlon)/15., 24.)
+            i_mlt, w_mlt = _interval_weights(self.mlts, mlts)
+
+            n_mlt = self.mlts.size
+            rows = np.tile(np.arange(inds.size), 4)
+            cols = np.concatenate([(i_mlat+di)*n_mlt+i_mlt+dj for di, dj in [(0, 0), (0, 1), (1, 0), (1, 1)]])
+            weights = np.concatenate([(1.-w_mlat)*(1.-w_mlt), (1.-w_mlat)*w_mlt,
+                                      w_mlat*(1.-w_mlt), w_mlat*w_mlt])
+            matrix = sparse.csr_matrix((weights, (rows, cols)), shape=(inds.size, self.mlats.size*n_mlt))
+            matrix.eliminate_zeros()
+
+            self._operators[key] = (matrix, inds)
+            while len(self._operators) > self.cache_size:
+                self._operators.popitem(last=False)
+            return self._operators[key]
+
+    def remap(self, dt, mlat_grid, mlt_grid, values, out=None):
+        """
+        Interpolate one hemisphere's model grid (e.g. from
+        get_flux_for_time) to the geographic grid at dt. Only the
+        geographic points in that hemisphere are written to out
+        (a new grid of fill_value if out is None)
+        """
+        hemi = self._hemisphere(mlat_grid, mlt_grid)
+        if out is None:
+            out = np.full(self.shape, self.fill_value)
+        matrix, inds = self.operator(dt, hemi)
+        with stage('geographic_remap'):
+            np.put(out, inds, matrix.dot(np.asarray(values, dtype=float).ravel()))
+        return out
+
+    def remap_for_times(self, dts, mlat_grid, mlt_grid, values, out=None):
+        """
+        remap for model grids with a leading time axis (e.g. from
+        get_flux_for_times), returns (ntime,)+shape
+        """
+        if out is None:
+            out = np.full((len(dts),)+self.shape, self.fill_value)
+        for i_time, dt in enumerate(dts):
+            self.remap(dt, mlat_grid, mlt_grid, values[i_time], out=out[i_time])
+        return out
+
+    def _hemisphere(self, mlat_grid, mlt_grid):
+        if mlat_grid.shape != (self.mlats.size, self.mlts.size) or mlt_grid.shape != mlat_grid.shape:
+            raise ValueError('Model grid shape {0} is not ({1},{2})'.format(mlat_grid.shape,
+                                                                         self.mlats.size, self.mlts.size))
+        if not (np.allclose(np.abs(mlat_grid[:, 0]), self.mlats) and np.allclose(mlt_grid[0, :], self.mlts)):
+            raise ValueError('Model grid does not match the remapper magnetic latitudes and local times')
+        return 'N' if np.all(mlat_grid > 0.) else 'S'
+
+    def flux_for_time(self, flux_estimator, dt, return_dF=False, **kwargs):
+        """
+        FluxEstimator.get_flux_for_time (both hemispheres from one
+        evaluation) on the geographic grid
+
+        Returns glats, glons, gridflux (and dF if return_dF)
+        """
+        outs = flux_estimator.get_flux_for_time(dt, hemi='both', return_dF=True, **kwargs)
+        gridflux = np.full(self.shape, self.fill_value)
+        self.remap(dt, *outs[0:3], out=gridflux)
+        self.remap(dt, *outs[3:6], out=gridflux)
+        if return_dF:
+            return self.glats, self.glons, gridflux, outs[6]
+        return self.glats, self.glons, gridflux
+
+    def flux_for_times(self, flux_estimator, dts, **kwargs):
+        """
+        FluxEstimator.get_flux_for_times on the geographic grid
+
+        Returns glats, glons, gridfluxes (ntime,)+shape
+        """
+        outs = flux_estimator.get_flux_for_times(dts, hemi='both', **kwargs)
+        gridfluxes = np.full((len(dts),)+self.shape, self.fill_value)
+        self.remap_for_times(dts, *outs[0:3], out=gridfluxes)
+        self.remap_for_times(dts, *outs[3:6], out=gridfluxes)
+        return self.glats, self.glons, gridfluxes
+
+    def conductance_for_time(self, conductance_estimator, dt, **kwargs):
+        """
+        ConductanceEstimator.get_conductance for both hemispheres on the
+        geographic grid
+
+        Returns glats, glons, sigp, sigh
+        """
+        sigp, sigh = np.full(self.shape, self.fill_value), np.full(self.shape, self.fill_value)
+        for hemi in ['N', 'S']:
+            mlat_grid, mlt_grid, hemi_sigp, hemi_sigh = conductance_estimator.get_conductance(dt, hemi=hemi,
+                                                                                             **kwargs)
+            self.remap(dt, mlat_grid, mlt_grid, hemi_sigp, out=sigp)
+            self.remap(dt, mlat_grid, mlt_grid, hemi_sigh, out=sigh)
+        return self.glats, self.glons, sigp, sigh
+
+    def conductance_for_times(self, conductance_estimator, dts, **kwargs):
+        """
+        ConductanceEstimator.get_conductance_for_times for both
+        hemispheres on the geographic grid
+
+        Returns glats, glons, sigp, sigh (ntime,)+shape
+        """
+        sigp = np.full((len(dts),)+self.shape, self.fill_value)
+        sigh = np.full((len(dts),)+self.shape, self.fill_value)
+        for hemi in ['N', 'S']:
+            mlat_grid, mlt_grid, hemi_sigp, hemi_sigh = conductance_estimator.get_conductance_for_times(dts,
+                                                                                    hemi=hemi, **kwargs)
+            self.remap_for_times(dts, mlat_grid, mlt_grid, hemi_sigp, out=sigp)
+            self.remap_for_times(dts, mlat_grid, mlt_grid, hemi_sigh, out=sigh)
+        return self.glats, self.glons, sigp, sigh
+
+def _interval_weights(axis, x):
+    """
+    Index of the axis interval containing each x (axis increasing) and
+    the fractional position of x in it (for linear interpolation)
+    """
+    i = np.clip(np.searchsorted(axis, x, side='right')-1, 0, axis.size-2)
+    return i, (x-axis[i])/(axis[i+1]-axis[i])
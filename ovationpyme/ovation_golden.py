@@ -0,0 +1,245 @@
+"""
+Reference ("golden") outputs for checking optimized code paths
+
+The reference file (data/golden/reference.npz) holds full model grids
+computed with the per-bin 'python' backend, the scalar translation of
+the IDL code:
+
+    flux/{season}/{atype}/{energy_or_number}
+        (n_dF, 2, nmlat, nmlt) northern and southern wedge interpolated
+        seasonal flux grids for each of reference_dFs, for one season of
+        each type of flux (see reference_season)
+    eavg/{atype}
+        (ntime, 2, nmlat, nmlt) average energy of both hemispheres
+    conductance/sigp, conductance/sigh
+        (ntime, 2, nmlat, nmlt) conductance (diffuse aurora and solar)
+        of both hemispheres
+
+The eavg and conductance are for the times of reference_solarwind, with
+the Newell coupling from a synthetic solar wind held constant over the
+averaging window (and a fixed F10.7), so no OMNI data is needed, and
+they use the flux of every season. The grids are stored as float32 to
+keep the file small (about 2 MB). It is only in the source tree (for
+the tests and the check command), it is not installed with the package.
+
+Any alternative engine (a backend, batched methods, caching, float32 or
+table lookups) can be checked by computing the same named arrays and
+comparing them with explicit tolerances:
+
+    outputs = compute_outputs(backend='numba', batched=True)
+    check_against_reference(outputs, tolerances={'flux': (1e-6, 0.)})
+
+    python -m ovationpyme.ovation_golden check --backend numba --batched
+    python -m ovationpyme.ovation_golden generate   #after a deliberate change
+"""
+import os
+import argparse
+import datetime
+from collections import OrderedDict
+
+import numpy as np
+
+from ovationpyme import ovation_utilities
+from ovationpyme.ovation_prime import (SeasonalFluxEstimator, FluxEstimator, AverageEnergyEstimator,
+                                       ConductanceEstimator)
+
+from logbook import Logger
+log = Logger('OvationPyme.ovation_golden')
+
+reference_filename = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'golden', 'reference.npz')
+
+seasons = ['winter', 'spring', 'summer', 'fall']
+atypes = ['diff', 'mono', 'wave', 'ions']
+energy_or_numbers = ['energy', 'number']
+
+#Zero coupling, the IDL test value, and values in and beyond the last
+#probability table dF bin
+reference_dFs = np.array([0., 3134.17, 6500., 15000.])
+
+#Synthetic solar wind (Bx, By, Bz [nT], V [km/s]) and F10.7, one time in
+#each season
+reference_solarwind = OrderedDict([
+    (datetime.datetime(2011, 3, 20, 12), (2., -3., -6., 450., 95.)),
+    (datetime.datetime(2011, 6, 21, 3), (-1., 5., -2., 380., 110.)),
+    (datetime.datetime(2011, 9, 22, 18), (0., 2., -12., 650., 140.)),
+    (datetime.datetime(2011, 12, 21, 6), (4., -1., 3., 520., 80.)),
+])
+
+#(rtol, atol) for each group of outputs, the float32 reference agrees
+#with itself to ~6e-8 relative. The solar conductance depends on the
+#AACGM version and the AACGM epoch used (see get_conductance_for_times).
+default_tolerances = OrderedDict([('flux', (1e-6, 0.)),
+                                  ('eavg', (1e-6, 0.)),
+                                  ('conductance', (1e-4, 1e-3))])
+
+def reference_season(atype, energy_or_number):
+    """
+    The season of the flux reference of an auroral type and flux. The
+    seasons only differ in the coefficients read, so one season of each
+    type (cycling so each auroral type has two seasons) is enough
+    """
+    return seasons[(atypes.index(atype)+2*energy_or_numbers.index(energy_or_number)) % len(seasons)]
+
+def reference_drivers():
+    """Times, Newell coupling and F10.7 of the eavg and conductance outputs"""
+    dts = list(reference_solarwind.keys())
+    Bx, By, Bz, V, f107s = [np.array(values) for values in zip(*reference_solarwind.values())]
+    #The weighted average of a constant hourly coupling is that value
+    dFs = ovation_utilities.calc_coupling(Bx, By, Bz, V)
+    return dts, dFs, f107s
+
+def load_seasonal_estimators():
+    """
+    SeasonalFluxEstimators for every auroral type and flux, keyed by
+    (atype, energy_or_number) then season, to reuse (and not read the
+    coefficients again) in several compute_outputs calls
+    """
+    return OrderedDict([((atype, energy_or_number),
+                         OrderedDict([(season, SeasonalFluxEstimator(season, atype, energy_or_number))
+                                      for season in seasons]))
+                        for atype in atypes for energy_or_number in energy_or_numbers])
+
+def compute_outputs(backend=None, batched=False, seasonal_estimators=None):
+    """
+    The outputs of the reference file computed with the current code
+
+    backend - str, optional
+        see ovation_kernels ('python' is what the reference is made with)
+
+    batched - bool
+        use get_gridded_flux_for_dFs and the _for_times methods instead of
+        one call per dF or time
+
+    seasonal_estimators - dict, optional
+        from load_seasonal_estimators
+    """
+    if seasonal_estimators is None:
+        seasonal_estimators = load_seasonal_estimators()
+    outputs = OrderedDict()
+    for (atype, energy_or_number), estimators in seasonal_estimators.items():
+        season = reference_season(atype, energy_or_number)
+        estimator = estimators[season]
+        if batched:
+            outs = estimator.get_gridded_flux_for_dFs(reference_dFs, backend=backend)
+            grids = np.stack([outs[2], outs[5]], axis=1)
+        else:
+            grids = []
+            for dF in reference_dFs:
+                outs = estimator.get_gridded_flux(dF, backend=backend)
+                grids.append([outs[2], outs[5]])
+            grids = np.array(grids)
+        outputs['flux/{0}/{1}/{2}'.format(season, atype, energy_or_number)] = grids
+
+    dts, dFs, f107s = reference_drivers()
+    flux_estimators = {key: FluxEstimator(key[0], key[1], seasonal_estimators=estimators, backend=backend)
+                       for key, estimators in seasonal_estimators.items()}
+    eavg_estimators = {atype: AverageEnergyEstimator(atype, numflux_estimator=flux_estimators[(atype, 'number')],
+                                                     energyflux_estimator=flux_estimators[(atype, 'energy')])
+                       for atype in atypes}
+    for atype in atypes:
+        if batched:
+            outs = eavg_estimators[atype].get_eavg_for_times(dts, hemi='both', dFs=dFs)
+            grids = np.stack([outs[2], outs[5]], axis=1)
+        else:
+            grids = []
+            for dt, dF in zip(dts, dFs):
+                outs = eavg_estimators[atype].get_eavg_for_time(dt, hemi='both', dF=dF)
+                grids.append([outs[2], outs[5]])
+            grids = np.array(grids)
+        outputs['eavg/{0}'.format(atype)] = grids
+
+    conductance_estimator = ConductanceEstimator(fluxtypes=['diff'],
+                                                 numflux_estimators={'diff': flux_estimators[('diff', 'number')]},
+                                                 eavg_estimators={'diff': eavg_estimators['diff']})
+    sigps, sighs = [], []
+    for hemi in ['N', 'S']:
+        if batched:
+            outs = conductance_estimator.get_conductance_for_times(dts, hemi=hemi, dFs=dFs, f107s=f107s)
+            sigps.append(outs[2])
+            sighs.append(outs[3])
+        else:
+            outs = [conductance_estimator.get_conductance(dt, hemi=hemi, dF=dF, f107=f107)
+                    for dt, dF, f107 in zip(dts, dFs, f107s)]
+            sigps.append([out[2] for out in outs])
+            sighs.append([out[3] for out in outs])
+    outputs['conductance/sigp'] = np.stack(sigps, axis=1)
+    outputs['conductance/sigh'] = np.stack(sighs, axis=1)
+    return outputs
+
+def generate_reference(filename=reference_filename):
+    """Writes the reference file from the 'python' backend"""
+    outputs = compute_outputs(backend='python')
+    directory = os.path.dirname(filename)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory)
+    np.savez_compressed(filename, **OrderedDict([(name, values.astype(np.float32))
+                                                 for name, values in outputs.items()]))
+    log.notice('Wrote {0} reference outputs to {1}'.format(len(outputs), filename))
+
+def load_reference(filename=reference_filename):
+    with np.load(filename) as npz:
+        return OrderedDict([(name, npz[name].astype(np.float64)) for name in npz.files])
+
+def compare_outputs(outputs, reference, tolerances=None):
+    """
+    Compares outputs with the reference, returns an OrderedDict of
+    (max absolute error, max relative error, passed) for each reference
+    output. tolerances is a dict of (rtol, atol) by group ('flux',
+    'eavg', 'conductance'), missing groups use default_tolerances. An
+    output passes if |output-reference| <= atol+rtol*|reference|
+    everywhere (as numpy.allclose).
+    """
+    tolerances = OrderedDict(default_tolerances, **(tolerances or {}))
+    results = OrderedDict()
+    for name, expected in reference.items():
+        if name not in outputs:
+            results[name] = (np.inf, np.inf, False)
+            continue
+        actual = np.asarray(outputs[name], dtype=np.float64)
+        if actual.shape != expected.shape:
+            results[name] = (np.inf, np.inf, False)
+            continue
+        rtol, atol = tolerances[name.split('/')[0]]
+        abs_err = np.abs(actual-expected)
+        nonzero = expected != 0.
+        max_abs_err = np.max(abs_err) if abs_err.size else 0.
+        max_rel_err = np.max(abs_err[nonzero]/np.abs(expected[nonzero])) if np.any(nonzero) else 0.
+        passed = bool(np.all(abs_err <= atol+rtol*np.abs(expected)))
+        results[name] = (max_abs_err, max_rel_err, passed)
+    return results
+
+def check_against_reference(outputs=None, filename=reference_filename, tolerances=None, **compute_kwargs):
+    """
+    Raises AssertionError naming the outputs which differ from the
+    reference by more than the tolerances (see compare_outputs).
+    outputs defaults to compute_outputs(**compute_kwargs). Returns the
+    comparison results.
+    """
+    if outputs is None:
+        outputs = compute_outputs(**compute_kwargs)
+    results = compare_outputs(outputs, load_reference(filename), tolerances=tolerances)
+    failed = [name for name, (max_abs_err, max_rel_err, passed) in results.items() if not passed]
+    if failed:
+        raise AssertionError('{0} of {1} outputs differ from the reference: '.format(len(failed), len(results))
+                             +', '.join('{0} (max abs err {1:.3g}, max rel err {2:.3g})'.format(name, *results[name][:2])
+                                        for name in failed))
+    return results
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Ovation Prime reference outputs')
+    parser.add_argument('command', choices=['generate', 'check'])
+    parser.add_argument('--filename', default=reference_filename)
+    parser.add_argument('--backend', default=None)
+    parser.add_argument('--batched', action='store_true')
+    args = parser.parse_args(argv)
+    if args.command == 'generate':
+        generate_reference(args.filename)
+    else:
+        results = compare_outputs(compute_outputs(backend=args.backend, batched=args.batched),
+                                  load_reference(args.filename))
+        for name, (max_abs_err, max_rel_err, passed) in results.items():
+            print('{0:<30} {1:10.3g} {2:10.3g} {3}'.format(name, max_abs_err, max_rel_err,
+                                                         'ok' if passed else 'FAILED'))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,253 @@
+"""
+Archive of precomputed model drivers
+
+The Newell coupling (dF, the 4 hour weighted average of
+ovation_utilities.calc_avg_solarwind) and the F10.7 used for the solar
+conductance are computed once for a whole period from OMNI data, at a
+fixed time step, and stored as a small indexed table. Model runs then
+look the values up by index instead of reading and averaging solar wind
+data for every call.
+
+    archive = IndexArchive.build(datetime(2015,1,1), datetime(2016,1,1))
+    archive.save('drivers_2015.npz')
+
+    archive = IndexArchive.load('drivers_2015.npz')
+    archive.extend(datetime(2016,2,1)) #as new OMNI data arrives
+    ovation_utilities.set_index_archive(archive)
+
+After set_index_archive, ovation_utilities.calc_dF and get_daily_f107
+(and so every estimator) use the archive for times it covers, taking
+the value at the nearest archive time.
+
+The archive only extends to the last time with OMNI data, so its values
+are never averages of data which had not arrived yet.
+"""
+import datetime
+
+import numpy as np
+
+from geospacepy import special_datetime
+from nasaomnireader.omnireader import omni_interval
+from ovationpyme import ovation_utilities
+
+from logbook import Logger
+log = Logger('OvationPyme.ovation_indices')
+
+def newell_coupling_for_times(target_jds, jd, Ec, n_hours=4, prev_hour_weight=0.65, chunk_size=2048):
+    """
+    The weighted average Newell coupling of calc_avg_solarwind for many
+    times at once. For each target time the samples in each of the
+    n_hours hours before it are averaged (ignoring NaN) and the hourly
+    means are weighted by prev_hour_weight**hours_back.
+
+    INPUTS
+    ------
+        target_jds, np.ndarray (n,)
+            Julian dates to compute the coupling for
+        jd, np.ndarray (m,)
+            Sorted Julian dates of the solar wind samples
+        Ec, np.ndarray (m,)
+            Newell coupling of each sample (see calc_coupling)
+
+    RETURNS
+    -------
+        dF, np.ndarray (n,)
+    """
+    target_jds = np.asarray(target_jds, dtype=float)
+    jd = np.asarray(jd, dtype=float)
+    Ec = np.asarray(Ec, dtype=float)
+    weights = np.array([prev_hour_weight**n_hours_back for n_hours_back in range(n_hours)[::-1]])
+
+    #Samples which can be in a target's window, with an hour of margin
+    #so that the binning below decides membership exactly as
+    #hourly_solarwind_for_average does
+    lo = np.searchsorted(jd, target_jds-(n_hours+1)/24., side='left')
+    hi = np.searchsorted(jd, target_jds+1./24., side='right')
+
+    hourly = np.full((target_jds.size, n_hours), np.nan)
+    for start in range(0, target_jds.size, chunk_size):
+        stop = min(start+chunk_size, target_jds.size)
+        width = int(np.max(hi[start:stop]-lo[start:stop], initial=0))
+        inds = lo[start:stop, np.newaxis]+np.arange(width)
+        in_window = inds < hi[start:stop, np.newaxis]
+        inds[~in_window] = 0
+        hours_before_target = -1*(jd[inds]-target_jds[start:stop, np.newaxis])*24.
+        window_Ec = Ec[inds]
+        has_Ec = np.logical_and(in_window, np.isfinite(window_Ec))
+        for i_hour, hour in enumerate(range(n_hours)[::-1]):
+            hourmask = np.logical_and(hours_before_target>=hour,
+                                      hours_before_target<(hour+1))
+            hourmask = np.logical_and(hourmask, has_Ec)
+            count = np.count_nonzero(hourmask, axis=1)
+            total = np.sum(np.where(hourmask, window_Ec, 0.), axis=1)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                hourly[start:stop, i_hour] = np.where(count > 0, total/count, np.nan)
+
+    return np.nansum(hourly*weights, axis=1)/np.sum(weights)
+
+def nearest_sample_values(target_jds, jd, values):
+    """
+    The value of the sample nearest in time to each target (the
+    first one on a tie, as get_daily_f107 does with nanargmin)
+    """
+    target_jds = np.asarray(target_jds, dtype=float)
+    right = np.clip(np.searchsorted(jd, target_jds, side='left'), 0, jd.size-1)
+    left = np.clip(right-1, 0, jd.size-1)
+    use_left = np.abs(jd[left]-target_jds) <= np.abs(jd[right]-target_jds)
+    return np.asarray(values)[np.where(use_left, left, right)]
+
+def compute_indices(dts, cadence='1min', return_data_enddt=False):
+    """
+    Newell coupling and F10.7 for a list of datetimes (covering at most
+    a few weeks, all of the OMNI data for the period is read at once),
+    the coupling from solar wind data of cadence ('1min', '5min' or
+    'hourly')
+
+    Returns dF, f107 arrays, and if return_data_enddt is True the time of
+    the last solar wind or F10.7 sample with data (whichever is earlier,
+    None if there is none), after which the values are computed from
+    incomplete data
+    """
+    startdt, enddt = min(dts), max(dts)
+    target_jds = np.array([special_datetime.datetime2jd(dt) for dt in dts])
+
+    #Same data and definitions as calc_avg_solarwind and get_daily_f107
+    oi = omni_interval(startdt-datetime.timedelta(hours=6), enddt+datetime.timedelta(hours=2),
+                       cadence, silent=True)
+    velvar = 'V' if cadence == 'hourly' else 'flow_speed'
+    jd = ovation_utilities.sample_center_jds(special_datetime.datetimearr2jd(oi['Epoch']).flatten(), cadence)
+    Ec = ovation_utilities.calc_coupling(oi['BX_GSE'], oi['BY_GSM'], oi['BZ_GSM'], oi[velvar])
+    dF = newell_coupling_for_times(target_jds, jd, Ec)
+
+    oi_hourly = omni_interval(startdt-datetime.timedelta(days=1), enddt+datetime.timedelta(days=1),
+                              'hourly', silent=True)
+    hourly_jd = special_datetime.datetimearr2jd(oi_hourly['Epoch']).flatten()
+    hourly_f107 = np.asarray(oi_hourly['F10_INDEX'], dtype=float).flatten()
+    f107 = nearest_sample_values(target_jds, hourly_jd, hourly_f107)
+    if not return_data_enddt:
+        return dF, f107
+
+    Ec = np.asarray(Ec, dtype=float).flatten()
+    if np.any(np.isfinite(Ec)) and np.any(np.isfinite(hourly_f107)):
+        data_end_jd = min(jd[np.isfinite(Ec)][-1], hourly_jd[np.isfinite(hourly_f107)][-1])
+        data_enddt = special_datetime.jd2datetime(data_end_jd)
+    else:
+        data_enddt = None
+    return dF, f107, data_enddt
+
+class IndexArchive(object):
+    """
+    Newell coupling (dF) and F10.7 at regularly spaced times
+    startdt, startdt+step, ... The value for any time in the
+    archive's range is found by index arithmetic.
+    """
+    def __init__(self, startdt, step, dF, f107, cadence='1min'):
+        """
+        startdt - datetime.datetime
+            time of the first values
+
+        step - datetime.timedelta
+            time between values
+
+        dF, f107 - np.ndarray
+            values at each time (same length)
+
+        cadence - str
+            cadence of the solar wind data dF was computed from,
+            calc_dF only uses the archive for the same cadence
+        """
+        if step <= datetime.timedelta(0):
+            raise ValueError('Archive time step must be positive, got {0}'.format(step))
+        dF, f107 = np.asarray(dF, dtype=float), np.asarray(f107, dtype=float)
+        if dF.shape != f107.shape or dF.ndim != 1:
+            raise ValueError('dF and f107 must be 1D arrays of the same length')
+        self.startdt = startdt
+        self.step = step
+        self.dF = dF
+        self.f107 = f107
+        self.cadence = cadence
+
+    def __len__(self):
+        return self.dF.size
+
+    @property
+    def enddt(self):
+        """Time of the last values"""
+        return self.startdt+(len(self)-1)*self.step
+
+    def times(self):
+        return [self.startdt+i*self.step for i in range(len(self))]
+
+    def index(self, dt):
+        """Index of the archive time nearest dt"""
+        i = int(round((dt-self.startdt)/self.step))
+        if i < 0 or i >= len(self):
+            raise ValueError('{0} is outside of the archive ({1} to {2})'.format(dt, self.startdt,
+                                                                              self.enddt))
+        return i
+
+    def covers(self, dt):
+        """True if dt is within half a step of the archive's times"""
+        half_step = self.step/2
+        return len(self) > 0 and self.startdt-half_step <= dt < self.enddt+half_step
+
+    def get_dF(self, dt):
+        return self.dF[self.index(dt)]
+
+    def get_f107(self, dt):
+        return self.f107[self.index(dt)]
+
+    @classmethod
+    def build(cls, startdt, enddt, step=datetime.timedelta(hours=1), block_days=14, cadence='1min'):
+        """
+        Compute the archive for startdt to enddt (inclusive) from OMNI
+        data (solar wind of cadence), reading block_days of data at a time
+        """
+        archive = cls(startdt, step, np.zeros(0), np.zeros(0), cadence=cadence)
+        archive._append_until(enddt, block_days)
+        return archive
+
+    def extend(self, enddt, block_days=14):
+        """
+        Compute and append the values for the times after the current
+        end of the archive up to enddt (e.g. as new data arrives)
+        """
+        self._append_until(enddt, block_days)
+        return self
+
+    def _append_until(self, enddt, block_days):
+        """
+        Append values up to enddt, stopping at the last time with OMNI
+        data. Values after it would be averages of whatever partial data
+        there was and would never be recomputed by extend.
+        """
+        n_total = int((enddt-self.startdt)//self.step)+1
+        n_per_block = max(1, int(datetime.timedelta(days=block_days)//self.step))
+        dFs, f107s = [self.dF], [self.f107]
+        for block_start in range(len(self), n_total, n_per_block):
+            block_dts = [self.startdt+i*self.step for i in range(block_start,
+                                                                 min(block_start+n_per_block, n_total))]
+            log.info('Computing indices for {0} to {1}'.format(block_dts[0], block_dts[-1]))
+            dF, f107, data_enddt = compute_indices(block_dts, cadence=self.cadence, return_data_enddt=True)
+            n_complete = 0 if data_enddt is None else sum(1 for dt in block_dts if dt <= data_enddt)
+            dFs.append(dF[:n_complete])
+            f107s.append(f107[:n_complete])
+            if n_complete < len(block_dts):
+                log.notice('No OMNI data after {0}, stopping the archive there'.format(data_enddt))
+                break
+        self.dF = np.concatenate(dFs)
+        self.f107 = np.concatenate(f107s)
+
+    def save(self, filename):
+        np.savez(filename, startdt=self.startdt.strftime('%Y-%m-%dT%H:%M:%S'),
+                 step_seconds=self.step.total_seconds(), dF=self.dF, f107=self.f107,
+                 cadence=self.cadence)
+
+    @classmethod
+    def load(cls, filename):
+        with np.load(filename) as npz:
+            startdt = datetime.datetime.strptime(str(npz['startdt']), '%Y-%m-%dT%H:%M:%S')
+            step = datetime.timedelta(seconds=float(npz['step_seconds']))
+            #Archives saved before the cadence was stored are 1 minute
+            cadence = str(npz['cadence']) if 'cadence' in npz.files else '1min'
+            return cls(startdt, step, npz['dF'], npz['f107'], cadence=cadence)
@@ -0,0 +1,664 @@
+"""
+Array kernels which evaluate the Ovation Prime seasonal regressions
+over the whole grid, with several interchangeable backends:
+
+    'python' - the per-bin reference implementation
+               (SeasonalFluxEstimator.estimate_auroral_flux in a loop)
+    'numpy'  - vectorized NumPy
+    'numba'  - compiled with Numba, the regression, probability fallback,
+               flux correction and north/south split are done in one pass
+               over the coefficient tables writing straight into the
+               output grids (needs the optional numba package)
+
+The default backend is 'numba' if numba can be imported and 'numpy'
+otherwise. It can be set with the OVATIONPYME_BACKEND environment
+variable or set_default_backend, and overridden per estimator or per call.
+
+Many bins of the coefficient tables (8% to 40% depending on the type of
+aurora) can never have any flux. For the tables where enough bins are
+inactive (see min_inactive_fraction), ActiveBins packs the coefficients
+of the other bins, and the 'numpy' and 'numba' backends only evaluate
+those.
+"""
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from logbook import Logger
+log = Logger('OvationPyme.ovation_kernels')
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+_valid_backends = ['python', 'numpy', 'numba']
+_default_backend = os.environ.get('OVATIONPYME_BACKEND', None)
+
+#dF bins of the tabulated probabilities (see SeasonalFluxEstimator.which_dF_bin)
+_dFave = 4421.
+_dFstep = _dFave/8.
+
+#Wedge interpolation region (constants from the IDL code,
+#see SeasonalFluxEstimator.interp_wedge)
+_wedge_mlt_min, _wedge_mlt_max = -1.0, 4.0
+_wedge_mlat_min, _wedge_mlat_max = 49.0, 75.0
+_wedge_nedge = 6
+
+def available_backends():
+    """Backends which can be used in this Python environment"""
+    return [backend for backend in _valid_backends if backend != 'numba' or numba is not None]
+
+def set_default_backend(backend):
+    """Set the backend used when an estimator or call does not choose one"""
+    global _default_backend
+    if backend is not None and backend not in _valid_backends:
+        raise ValueError('Invalid backend {0}, valid values {1}'.format(backend, _valid_backends))
+    _default_backend = backend
+
+def resolve_backend(backend=None):
+    """
+    Turn a requested backend (or None for the default) into the name of
+    a backend that can be used, falling back from numba to numpy if numba
+    is not installed
+    """
+    if backend is None:
+        backend = _default_backend
+    if backend is None:
+        backend = 'numba' if numba is not None else 'numpy'
+    if backend not in _valid_backends:
+        raise ValueError('Invalid backend {0}, valid values {1}'.format(backend, _valid_backends))
+    if backend == 'numba' and numba is None:
+        log.warning('numba backend requested but numba is not installed, using numpy')
+        backend = 'numpy'
+    return backend
+
+def correction_limits(atype, energy_or_number):
+    """
+    The corrections of SeasonalFluxEstimator.correct_flux as thresholds,
+    flux > hi is replaced by value_hi, otherwise flux > mid is replaced by
+    value_mid (negative flux is always set to zero). Branches of the
+    original which can never be reached are left out.
+
+    Returns (hi, value_hi, mid, value_mid)
+    """
+    if atype != 'ions':
+        if energy_or_number == 'energy':
+            return 10., 0.5, 5., 5.
+        return 2.0e9, 1.0e9, np.inf, 0.
+    if energy_or_number == 'energy':
+        return 2., 2., np.inf, 0.
+    return 1.0e8, 1.0e8, np.inf, 0.
+
+def which_dF_bins(dF, n_dF_bins=12):
+    """
+    Vectorized SeasonalFluxEstimator.which_dF_bin. Also returns the two
+    adjacent bins which are averaged when the tabulated probability is zero.
+
+    Returns (i_dFbin, i_dFbin_1, i_dFbin_2) as integer arrays shaped like dF
+    """
+    i_dFbin = np.clip(np.floor(np.asarray(dF, dtype=float)/_dFstep), 0, n_dF_bins-1).astype(int)
+    i_dFbin_1 = np.where(i_dFbin > 0, i_dFbin-1, i_dFbin+2)
+    i_dFbin_2 = np.where(i_dFbin < n_dF_bins-1, i_dFbin+1, i_dFbin-2)
+    return i_dFbin, i_dFbin_1, i_dFbin_2
+
+def correct_flux_numpy(flux, limits):
+    """Vectorized SeasonalFluxEstimator.correct_flux"""
+    hi, value_hi, mid, value_mid = limits
+    corrected = np.where(flux < 0., 0., flux)
+    return np.where(corrected > hi, value_hi, np.where(corrected > mid, value_mid, corrected))
+
+def regression_flux_numpy(dF, b1a, b2a, b1p, b2p, prob, use_prob, limits):
+    """
+    Corrected flux for every bin of the (nmlt, nmlat) coefficient tables.
+    dF can be a scalar or an array of shape (..., 1, 1), the result then has
+    shape (..., nmlt, nmlat).
+    """
+    dF = np.asarray(dF, dtype=float)
+    flux = b1a + b2a*dF
+    if use_prob:
+        p = np.clip(b1p + b2p*dF, 0., 1.)
+
+        #Bins with no probability regression use the tabulated probability
+        #of the dF bin (or the average of the adjacent bins if it is zero)
+        i_dFbin, i_dFbin_1, i_dFbin_2 = [np.asarray(i_bins).reshape(-1)
+                                        for i_bins in which_dF_bins(dF, prob.shape[-1])]
+        shape = dF.shape[:-2]+b1a.shape
+        p_tab = np.moveaxis(prob[:, :, i_dFbin], -1, 0).reshape(shape)
+        p_adjacent = np.moveaxis((prob[:, :, i_dFbin_1]+prob[:, :, i_dFbin_2])/2., -1, 0).reshape(shape)
+        p_tab = np.where(p_tab == 0., p_adjacent, p_tab)
+        p = np.where(np.logical_and(b1p == 0., b2p == 0.), p_tab, p)
+        flux = flux*p
+    return correct_flux_numpy(flux, limits)
+
+def active_bins_mask(b1a, b2a, b1p, b2p, prob, use_prob):
+    """
+    Bins of the (nmlt, nmlat) coefficient tables which can have nonzero
+    (or NaN) corrected flux for some dF >= 0. A bin is inactive if its
+    flux regression is never positive with a probability that is never
+    negative, or if its probability is always zero. Bins with any
+    coefficient which is not finite are active.
+    """
+    finite = np.logical_and(np.isfinite(b1a), np.isfinite(b2a))
+    flux_never_positive = np.logical_and(b1a <= 0., b2a <= 0.)
+    if not use_prob:
+        return ~np.logical_and(flux_never_positive, finite)
+    for coeffs in [b1p, b2p, np.all(np.isfinite(prob), axis=-1)]:
+        finite = np.logical_and(finite, np.isfinite(coeffs))
+    use_table = np.logical_and(b1p == 0., b2p == 0.)
+    #The regression probability is clipped to [0, 1]
+    p_never_negative = np.where(use_table, np.all(prob >= 0., axis=-1), True)
+    p_always_zero = np.where(use_table, np.all(prob == 0., axis=-1), np.logical_and(b1p <= 0., b2p <= 0.))
+    inactive = np.logical_or(np.logical_and(flux_never_positive, p_never_negative), p_always_zero)
+    return ~np.logical_and(inactive, finite)
+
+#Tables with a smaller fraction of inactive bins than this are evaluated
+#densely, since packing them costs memory without being noticeably faster
+min_inactive_fraction = .2
+
+def packing_pays_off(mask):
+    """Whether the inactive fraction of an active_bins_mask is large enough to pack the tables"""
+    return 1.-np.count_nonzero(mask)/mask.size >= min_inactive_fraction
+
+class ActiveBins(object):
+    """
+    The coefficients of the active bins (see active_bins_mask) of one set
+    of seasonal coefficient tables, packed into 1D arrays in the order of
+    the output grids, so evaluating the flux only reads and computes the
+    bins which can have any. Only the bins without a probability
+    regression keep their row of the probability table.
+
+    grid_index - np.ndarray (2, nmlat//2, nmlt)
+        which active bin is at each point of the northern (0) and
+        southern (1) grids, -1 for inactive bins
+
+    prob_index - np.ndarray (n_active,)
+        row of prob of each bin, -1 for bins with a probability regression
+    """
+    table_names = ['b1a', 'b2a', 'b1p', 'b2p', 'prob', 'prob_index', 'grid_index']
+
+    def __init__(self, tables, use_prob):
+        """
+        tables - dict
+            the packed arrays by name (table_names), from pack or
+            already packed (e.g. views of shared memory, see
+            ovation_sharedmem)
+        """
+        self.use_prob = use_prob
+        for name in self.table_names:
+            setattr(self, name, tables[name])
+        self._buffers = threading.local()
+
+    @classmethod
+    def pack(cls, b1a, b2a, b1p, b2p, prob, use_prob, mask=None):
+        """
+        Pack the active bins of (nmlt, nmlat) coefficient tables, mask is
+        their active_bins_mask if it has already been computed
+        """
+        n_mlt, n_mlat = b1a.shape
+        n_half = n_mlat//2
+        if mask is None:
+            mask = active_bins_mask(b1a, b2a, b1p, b2p, prob, use_prob)
+
+        #The mlat bins are orgainized like -50:-dlat:-90,50:dlat:90
+        masks = [mask[:, n_half:].T, mask[:, :n_half].T]
+        tables = OrderedDict()
+        grid_index = np.full((2, n_half, n_mlt), -1, dtype=np.int32)
+        i_mlt, j_mlat = [], []
+        for i_hemi, hemi_mask in enumerate(masks):
+            rows, cols = np.nonzero(hemi_mask)
+            grid_index[i_hemi][rows, cols] = np.arange(len(i_mlt), len(i_mlt)+rows.size)
+            i_mlt.extend(cols)
+            j_mlat.extend(rows+n_half if i_hemi == 0 else rows)
+        i_mlt, j_mlat = np.array(i_mlt, dtype=int), np.array(j_mlat, dtype=int)
+
+        for name, coeffs in zip(['b1a', 'b2a', 'b1p', 'b2p'], [b1a, b2a, b1p, b2p]):
+            tables[name] = np.ascontiguousarray(coeffs[i_mlt, j_mlat])
+        use_table = np.logical_and(tables['b1p'] == 0., tables['b2p'] == 0.)
+        if not use_prob:
+            use_table[:] = False
+        tables['prob'] = np.ascontiguousarray(prob[i_mlt[use_table], j_mlat[use_table]])
+        tables['prob_index'] = np.where(use_table, np.cumsum(use_table)-1, -1).astype(np.int32)
+        tables['grid_index'] = grid_index
+        for array in tables.values():
+            array.flags.writeable = False
+        return cls(tables, use_prob)
+
+    def flux_buffer(self):
+        """A (1, n_active) array for the flux of one dF, one for each thread, reused between calls"""
+        buffer = getattr(self._buffers, 'flux', None)
+        if buffer is None:
+            buffer = self._buffers.flux = np.empty((1, self.n_active))
+        return buffer
+
+    @property
+    def n_active(self):
+        return self.b1a.size
+
+    def tables(self):
+        """The packed arrays, by attribute name"""
+        return OrderedDict([(name, getattr(self, name)) for name in self.table_names])
+
+    def scatter(self, flux, out=None):
+        """
+        Northern and southern grids (..., nmlat//2, nmlt) from the flux
+        of the active bins (..., n_active), zero in the inactive bins.
+        out is an optional tuple of (fluxgridN, fluxgridS) arrays to
+        write into.
+        """
+        flux = np.asarray(flux)
+        #Inactive bins (index -1) take the zero at the end
+        padded = np.concatenate([flux, np.zeros(flux.shape[:-1]+(1,))], axis=-1)
+        if out is None:
+            return padded[..., self.grid_index[0]], padded[..., self.grid_index[1]]
+        fluxgridN, fluxgridS = out
+        fluxgridN[...] = padded[..., self.grid_index[0]]
+        fluxgridS[...] = padded[..., self.grid_index[1]]
+        return fluxgridN, fluxgridS
+
+def active_regression_flux_numpy(dF, active, limits):
+    """
+    Corrected flux of the active bins, dF can be a scalar or an array of
+    shape (..., 1), the result then has shape (..., n_active)
+    """
+    dF = np.asarray(dF, dtype=float)
+    flux = active.b1a + active.b2a*dF
+    if active.use_prob:
+        p = np.clip(active.b1p + active.b2p*dF, 0., 1.)
+        use_table = active.prob_index >= 0
+        if np.any(use_table):
+            i_dFbin, i_dFbin_1, i_dFbin_2 = [np.asarray(i_bins).reshape(-1)
+                                            for i_bins in which_dF_bins(dF, active.prob.shape[-1])]
+            shape = dF.shape[:-1]+active.prob.shape[:1]
+            p_tab = active.prob[:, i_dFbin].T.reshape(shape)
+            p_adjacent = ((active.prob[:, i_dFbin_1]+active.prob[:, i_dFbin_2])/2.).T.reshape(shape)
+            p_tab = np.where(p_tab == 0., p_adjacent, p_tab)
+            p[..., use_table] = p_tab
+        flux = flux*p
+    return correct_flux_numpy(flux, limits)
+
+def _wedge_mlts(mlts):
+    """MLT from -12 to 12 so that there is no discontinuity at midnight"""
+    wedge_mlts = np.array(mlts, dtype=float)
+    wedge_mlts[wedge_mlts > 12.] -= 24.
+    return wedge_mlts
+
+def interp_wedge_numpy(row_mlats, mlts, fluxgridN, nedge=_wedge_nedge):
+    """
+    Vectorized SeasonalFluxEstimator.interp_wedge for one grid, fluxgridN
+    (nmlat, nmlt) is modified in place. Returns the inwedge boolean grid.
+    """
+    wedge_mlts = _wedge_mlts(mlts)
+    n_mlt = wedge_mlts.size
+    #interp1d sorts its inputs with a stable sort before using np.interp
+    order = np.argsort(wedge_mlts, kind='mergesort')
+    sorted_mlts = wedge_mlts[order]
+
+    valid_mlt_bins = np.logical_and(wedge_mlts >= _wedge_mlt_min, wedge_mlts <= _wedge_mlt_max)
+    valid_rows = np.logical_and(row_mlats >= _wedge_mlat_min, row_mlats <= _wedge_mlat_max)
+    inwedge = np.zeros(fluxgridN.shape, dtype=bool)
+    inwedge[valid_rows, :] = np.logical_and(valid_mlt_bins, np.logical_not(fluxgridN[valid_rows, :] > 0.))
+
+    for i_row in np.flatnonzero(inwedge.any(axis=1)):
+        missing = inwedge[i_row, :].copy()
+        missing_inds = np.flatnonzero(missing)
+        #Bins right next to the wedge have bad statistics, interpolate over them too
+        edge_offsets = np.arange(1, nedge+1)
+        missing[np.mod(missing_inds[0]-edge_offsets, n_mlt)] = True
+        missing[np.mod(missing_inds[-1]+edge_offsets, n_mlt)] = True
+
+        sorted_missing = missing[order]
+        source_mlts = sorted_mlts[~sorted_missing]
+        source_flux = fluxgridN[i_row, order][~sorted_missing]
+        fluxgridN[i_row, missing] = np.interp(wedge_mlts[missing], source_mlts, source_flux)
+    return inwedge
+
+if numba is not None:
+
+    @numba.njit(cache=True)
+    def _regression_flux_numba(dF, b1a, b2a, b1p, b2p, prob, use_prob, i_dFbin, i_dFbin_1,
+                               i_dFbin_2, hi, value_hi, mid, value_mid, fluxgridN, fluxgridS):
+        n_mlt, n_mlat = b1a.shape
+        n_half = n_mlat//2
+        for i_mlt in range(n_mlt):
+            for j_mlat in range(n_mlat):
+                flux = b1a[i_mlt, j_mlat]+b2a[i_mlt, j_mlat]*dF
+                if use_prob:
+                    b1, b2 = b1p[i_mlt, j_mlat], b2p[i_mlt, j_mlat]
+                    p = b1+b2*dF
+                    if p < 0.:
+                        p = 0.
+                    elif p > 1.:
+                        p = 1.
+                    if b1 == 0. and b2 == 0.:
+                        p = prob[i_mlt, j_mlat, i_dFbin]
+                        if p == 0.:
+                            p = (prob[i_mlt, j_mlat, i_dFbin_1]+prob[i_mlt, j_mlat, i_dFbin_2])/2.
+                    flux = flux*p
+                if flux < 0.:
+                    flux = 0.
+                if flux > hi:
+                    flux = value_hi
+                elif flux > mid:
+                    flux = value_mid
+                #The mlat bins are orgainized like -50:-dlat:-90,50:dlat:90
+                if j_mlat < n_half:
+                    fluxgridS[j_mlat, i_mlt] = flux
+                else:
+                    fluxgridN[j_mlat-n_half, i_mlt] = flux
+
+    @numba.njit(cache=True)
+    def _interp_wedge_numba(row_mlats, wedge_mlts, order, fluxgridN, inwedge, nedge,
+                            mlat_min, mlat_max, mlt_min, mlt_max):
+        n_row, n_mlt = fluxgridN.shape
+        missing = np.zeros(n_mlt, dtype=np.bool_)
+        source_mlts = np.empty(n_mlt)
+        source_flux = np.empty(n_mlt)
+        missing_inds = np.empty(n_mlt, dtype=np.int64)
+        missing_mlts = np.empty(n_mlt)
+        for i_row in range(n_row):
+            if not (row_mlats[i_row] >= mlat_min and row_mlats[i_row] <= mlat_max):
+                continue
+            first, last = -1, -1
+            for i_mlt in range(n_mlt):
+                in_mlt_range = wedge_mlts[i_mlt] >= mlt_min and wedge_mlts[i_mlt] <= mlt_max
+                missing[i_mlt] = in_mlt_range and not (fluxgridN[i_row, i_mlt] > 0.)
+                inwedge[i_row, i_mlt] = missing[i_mlt]
+                if missing[i_mlt]:
+                    if first < 0:
+                        first = i_mlt
+                    last = i_mlt
+            if first < 0:
+                continue
+            for edge_offset in range(1, nedge+1):
+                missing[(first-edge_offset) % n_mlt] = True
+                missing[(last+edge_offset) % n_mlt] = True
+            n_source = 0
+            for i_sorted in range(n_mlt):
+                i_mlt = order[i_sorted]
+                if not missing[i_mlt]:
+                    source_mlts[n_source] = wedge_mlts[i_mlt]
+                    source_flux[n_source] = fluxgridN[i_row, i_mlt]
+                    n_source += 1
+            #One interpolation for all of the missing bins of the ring
+            n_missing = 0
+            for i_mlt in range(n_mlt):
+                if missing[i_mlt]:
+                    missing_inds[n_missing] = i_mlt
+                    missing_mlts[n_missing] = wedge_mlts[i_mlt]
+                    n_missing += 1
+            interpd_flux = np.interp(missing_mlts[:n_missing], source_mlts[:n_source], source_flux[:n_source])
+            for i_missing in range(n_missing):
+                fluxgridN[i_row, missing_inds[i_missing]] = interpd_flux[i_missing]
+
+    @numba.njit(cache=True)
+    def _regression_flux_for_dFs_numba(dFs, b1a, b2a, b1p, b2p, prob, use_prob, i_dFbins, i_dFbins_1,
+                                       i_dFbins_2, hi, value_hi, mid, value_mid, fluxgridsN, fluxgridsS):
+        for i_dF in range(dFs.size):
+            _regression_flux_numba(dFs[i_dF], b1a, b2a, b1p, b2p, prob, use_prob, i_dFbins[i_dF],
+                                   i_dFbins_1[i_dF], i_dFbins_2[i_dF], hi, value_hi, mid, value_mid,
+                                   fluxgridsN[i_dF], fluxgridsS[i_dF])
+
+    @numba.njit(cache=True)
+    def _active_regression_flux_numba(dFs, b1a, b2a, b1p, b2p, prob_index, prob, use_prob, i_dFbins,
+                                      i_dFbins_1, i_dFbins_2, hi, value_hi, mid, value_mid, flux):
+        for i_dF in range(dFs.size):
+            dF = dFs[i_dF]
+            for k in range(b1a.size):
+                bin_flux = b1a[k]+b2a[k]*dF
+                if use_prob:
+                    p = b1p[k]+b2p[k]*dF
+                    if p < 0.:
+                        p = 0.
+                    elif p > 1.:
+                        p = 1.
+                    i_prob = prob_index[k]
+                    if i_prob >= 0:
+                        p = prob[i_prob, i_dFbins[i_dF]]
+                        if p == 0.:
+                            p = (prob[i_prob, i_dFbins_1[i_dF]]+prob[i_prob, i_dFbins_2[i_dF]])/2.
+                    bin_flux = bin_flux*p
+                if bin_flux < 0.:
+                    bin_flux = 0.
+                if bin_flux > hi:
+                    bin_flux = value_hi
+                elif bin_flux > mid:
+                    bin_flux = value_mid
+                flux[i_dF, k] = bin_flux
+
+    @numba.njit(cache=True)
+    def _scatter_active_numba(flux, grid_index, fluxgridsN, fluxgridsS):
+        n_row, n_col = grid_index.shape[1:]
+        for i_grid in range(flux.shape[0]):
+            for i in range(n_row):
+                for j in range(n_col):
+                    k = grid_index[0, i, j]
+                    fluxgridsN[i_grid, i, j] = flux[i_grid, k] if k >= 0 else 0.
+                    k = grid_index[1, i, j]
+                    fluxgridsS[i_grid, i, j] = flux[i_grid, k] if k >= 0 else 0.
+
+    @numba.njit(cache=True)
+    def _active_regression_flux_grids_numba(dFs, b1a, b2a, b1p, b2p, prob_index, prob, use_prob, i_dFbins,
+                                            i_dFbins_1, i_dFbins_2, hi, value_hi, mid, value_mid, grid_index,
+                                            flux, fluxgridsN, fluxgridsS):
+        #One dF at a time so the active bins' flux stays in cache until it is scattered
+        for i_dF in range(dFs.size):
+            _active_regression_flux_numba(dFs[i_dF:i_dF+1], b1a, b2a, b1p, b2p, prob_index, prob, use_prob,
+                                          i_dFbins[i_dF:i_dF+1], i_dFbins_1[i_dF:i_dF+1],
+                                          i_dFbins_2[i_dF:i_dF+1], hi, value_hi, mid, value_mid, flux)
+            _scatter_active_numba(flux, grid_index, fluxgridsN[i_dF:i_dF+1], fluxgridsS[i_dF:i_dF+1])
+
+    @numba.njit(cache=True)
+    def _interp_wedge_for_grids_numba(row_mlats, wedge_mlts, order, fluxgridsN, inwedges, nedge,
+                                      mlat_min, mlat_max, mlt_min, mlt_max):
+        for i_grid in range(fluxgridsN.shape[0]):
+            _interp_wedge_numba(row_mlats, wedge_mlts, order, fluxgridsN[i_grid], inwedges[i_grid], nedge,
+                                mlat_min, mlat_max, mlt_min, mlt_max)
+
+    @numba.njit(cache=True)
+    def _accumulate_hemispheres_numba(gridflux, weight, fluxgridN, fluxgridS, hemi_code):
+        n_row, n_col = gridflux.shape
+        for i in range(n_row):
+            for j in range(n_col):
+                if hemi_code == 0:
+                    gridflux[i, j] += weight*(fluxgridN[i, j]+fluxgridS[i, j])/2
+                elif hemi_code == 1:
+                    gridflux[i, j] += weight*fluxgridN[i, j]
+                else:
+                    gridflux[i, j] += weight*fluxgridS[i, j]
+
+    @numba.njit(cache=True)
+    def _accumulate_hemispheres_for_grids_numba(gridfluxes, i_grids, weights, fluxgridsN, fluxgridsS,
+                                                hemi_code):
+        for k in range(i_grids.size):
+            _accumulate_hemispheres_numba(gridfluxes[i_grids[k]], weights[k], fluxgridsN[k], fluxgridsS[k],
+                                          hemi_code)
+
+def active_regression_flux(backend, dFs, active, limits, out=None):
+    """
+    Corrected flux of the active bins (an ActiveBins) for a 1D array of
+    dF values with the 'numpy' or 'numba' backend, shape (len(dFs),
+    n_active). active.scatter makes the grids from it.
+    """
+    dFs = np.asarray(dFs, dtype=float).reshape(-1)
+    if out is None:
+        out = np.empty((dFs.size, active.n_active))
+    if backend == 'numba':
+        i_dFbins, i_dFbins_1, i_dFbins_2 = [np.asarray(i_bins, dtype=np.int64).reshape(-1)
+                                            for i_bins in which_dF_bins(dFs, active.prob.shape[-1])]
+        hi, value_hi, mid, value_mid = limits
+        _active_regression_flux_numba(dFs, active.b1a, active.b2a, active.b1p, active.b2p, active.prob_index,
+                                      active.prob, active.use_prob, i_dFbins, i_dFbins_1, i_dFbins_2,
+                                      hi, value_hi, mid, value_mid, out)
+    else:
+        out[...] = active_regression_flux_numpy(dFs.reshape(-1, 1), active, limits)
+    return out
+
+def _use_active(active, dFs):
+    """Inactive bins are only known to be zero for finite dF >= 0"""
+    dFs = np.asarray(dFs)
+    return active is not None and bool(np.all(np.logical_and(np.isfinite(dFs), dFs >= 0.)))
+
+def regression_flux(backend, dF, b1a, b2a, b1p, b2p, prob, use_prob, limits, out=None, active=None):
+    """
+    Northern and southern (nmlat//2, nmlt) flux grids for a scalar dF
+    with the 'numpy' or 'numba' backend. out is an optional tuple of
+    (fluxgridN, fluxgridS) arrays to write the result into. If active
+    (the ActiveBins of the tables) is passed, only the active bins are
+    evaluated and the others set to zero.
+    """
+    n_mlt, n_mlat = b1a.shape
+    if out is None:
+        out = (np.empty((n_mlat//2, n_mlt)), np.empty((n_mlat//2, n_mlt)))
+    fluxgridN, fluxgridS = out
+    if _use_active(active, dF):
+        regression_flux_for_dFs(backend, [dF], b1a, b2a, b1p, b2p, prob, use_prob, limits,
+                                out=(fluxgridN[np.newaxis], fluxgridS[np.newaxis]), active=active)
+    elif backend == 'numba':
+        i_dFbin, i_dFbin_1, i_dFbin_2 = [int(i_bin) for i_bin in which_dF_bins(dF, prob.shape[-1])]
+        hi, value_hi, mid, value_mid = limits
+        _regression_flux_numba(float(dF), b1a, b2a, b1p, b2p, prob, use_prob, i_dFbin, i_dFbin_1,
+                               i_dFbin_2, hi, value_hi, mid, value_mid, fluxgridN, fluxgridS)
+    else:
+        flux = regression_flux_numpy(dF, b1a, b2a, b1p, b2p, prob, use_prob, limits)
+        fluxgridN[...] = flux[:, n_mlat//2:].T
+        fluxgridS[...] = flux[:, :n_mlat//2].T
+    return fluxgridN, fluxgridS
+
+def regression_flux_for_dFs(backend, dFs, b1a, b2a, b1p, b2p, prob, use_prob, limits, out=None,
+                            chunk_size=32, active=None):
+    """
+    regression_flux for a 1D array of dF values. Returns northern and
+    southern flux grids of shape (len(dFs), nmlat//2, nmlt). The numpy
+    backend evaluates chunk_size values of dF per array operation, to
+    limit the size of the temporary arrays. active as in regression_flux.
+    """
+    dFs = np.asarray(dFs, dtype=float).reshape(-1)
+    n_mlt, n_mlat = b1a.shape
+    n_half = n_mlat//2
+    if out is None:
+        out = (np.empty((dFs.size, n_half, n_mlt)), np.empty((dFs.size, n_half, n_mlt)))
+    fluxgridsN, fluxgridsS = out
+    if _use_active(active, dFs) and backend == 'numba':
+        i_dFbins, i_dFbins_1, i_dFbins_2 = [np.asarray(i_bins, dtype=np.int64).reshape(-1)
+                                            for i_bins in which_dF_bins(dFs, active.prob.shape[-1])]
+        hi, value_hi, mid, value_mid = limits
+        _active_regression_flux_grids_numba(dFs, active.b1a, active.b2a, active.b1p, active.b2p,
+                                            active.prob_index, active.prob, active.use_prob, i_dFbins,
+                                            i_dFbins_1, i_dFbins_2, hi, value_hi, mid, value_mid,
+                                            active.grid_index, active.flux_buffer(), fluxgridsN, fluxgridsS)
+    elif _use_active(active, dFs):
+        for start in range(0, dFs.size, chunk_size):
+            stop = min(start+chunk_size, dFs.size)
+            flux = active_regression_flux_numpy(dFs[start:stop].reshape(-1, 1), active, limits)
+            active.scatter(flux, out=(fluxgridsN[start:stop], fluxgridsS[start:stop]))
+    elif backend == 'numba':
+        #All of the values of dF in one compiled call
+        i_dFbins, i_dFbins_1, i_dFbins_2 = [np.asarray(i_bins, dtype=np.int64).reshape(-1)
+                                            for i_bins in which_dF_bins(dFs, prob.shape[-1])]
+        hi, value_hi, mid, value_mid = limits
+        _regression_flux_for_dFs_numba(dFs, b1a, b2a, b1p, b2p, prob, use_prob, i_dFbins, i_dFbins_1,
+                                       i_dFbins_2, hi, value_hi, mid, value_mid, fluxgridsN, fluxgridsS)
+    else:
+        for start in range(0, dFs.size, chunk_size):
+            stop = min(start+chunk_size, dFs.size)
+            flux = regression_flux_numpy(dFs[start:stop].reshape(-1, 1, 1), b1a, b2a, b1p, b2p,
+                                         prob, use_prob, limits)
+            fluxgridsN[start:stop] = np.swapaxes(flux[:, :, n_half:], 1, 2)
+            fluxgridsS[start:stop] = np.swapaxes(flux[:, :, :n_half], 1, 2)
+    return fluxgridsN, fluxgridsS
+
+def interp_wedge(backend, row_mlats, mlts, fluxgridN, nedge=_wedge_nedge, inwedge=None):
+    """
+    Wedge interpolation with the 'numpy' or 'numba' backend, modifies
+    fluxgridN in place and returns the inwedge boolean grid (written
+    into inwedge if it is passed)
+    """
+    if backend == 'numba':
+        wedge_mlts = _wedge_mlts(mlts)
+        order = np.argsort(wedge_mlts, kind='mergesort')
+        if inwedge is None:
+            inwedge = np.zeros(fluxgridN.shape, dtype=bool)
+        else:
+            inwedge[...] = False
+        _interp_wedge_numba(np.asarray(row_mlats, dtype=float), wedge_mlts, order, fluxgridN, inwedge,
+                            nedge, _wedge_mlat_min, _wedge_mlat_max, _wedge_mlt_min, _wedge_mlt_max)
+        return inwedge
+    if inwedge is None:
+        return interp_wedge_numpy(row_mlats, mlts, fluxgridN, nedge=nedge)
+    inwedge[...] = interp_wedge_numpy(row_mlats, mlts, fluxgridN, nedge=nedge)
+    return inwedge
+
+def interp_wedge_for_grids(backend, row_mlats, mlts, fluxgridsN, nedge=_wedge_nedge):
+    """
+    interp_wedge for a stack of grids (n, nmlat, nmlt), modified in place
+    (one compiled call for all of them with the numba backend). Returns
+    the inwedge boolean grids.
+    """
+    if backend == 'numba':
+        wedge_mlts = _wedge_mlts(mlts)
+        order = np.argsort(wedge_mlts, kind='mergesort')
+        inwedges = np.zeros(fluxgridsN.shape, dtype=bool)
+        _interp_wedge_for_grids_numba(np.asarray(row_mlats, dtype=float), wedge_mlts, order, fluxgridsN,
+                                      inwedges, nedge, _wedge_mlat_min, _wedge_mlat_max, _wedge_mlt_min,
+                                      _wedge_mlt_max)
+        return inwedges
+    inwedges = np.zeros(fluxgridsN.shape, dtype=bool)
+    for fluxgridN, inwedge in zip(fluxgridsN, inwedges):
+        inwedge[...] = interp_wedge_numpy(row_mlats, mlts, fluxgridN, nedge=nedge)
+    return inwedges
+
+def accumulate_hemispheres(backend, gridflux, weight, fluxgridN, fluxgridS, hemi):
+    """
+    Add one season's contribution to gridflux in place, hemi is
+    'NS' (average of the two hemispheres' flux), 'N' or 'S'
+    """
+    if backend == 'numba':
+        hemi_code = {'NS': 0, 'N': 1, 'S': 2}[hemi]
+        _accumulate_hemispheres_numba(gridflux, float(weight), fluxgridN, fluxgridS, hemi_code)
+    elif hemi == 'NS':
+        gridflux += weight*(fluxgridN+fluxgridS)/2
+    elif hemi == 'N':
+        gridflux += weight*fluxgridN
+    else:
+        gridflux += weight*fluxgridS
+    return gridflux
+
+def accumulate_hemispheres_for_grids(backend, gridfluxes, i_grids, weights, fluxgridsN, fluxgridsS, hemi):
+    """
+    accumulate_hemispheres for a stack of grids, adds weights[k] times
+    the flux of fluxgridsN[k] and fluxgridsS[k] to gridfluxes[i_grids[k]]
+    """
+    if backend == 'numba':
+        hemi_code = {'NS': 0, 'N': 1, 'S': 2}[hemi]
+        _accumulate_hemispheres_for_grids_numba(gridfluxes, np.asarray(i_grids, dtype=np.int64),
+                                                np.asarray(weights, dtype=float), fluxgridsN, fluxgridsS,
+                                                hemi_code)
+        return gridfluxes
+    weights = np.asarray(weights, dtype=float).reshape(-1, 1, 1)
+    if hemi == 'NS':
+        gridfluxes[i_grids] += weights*(fluxgridsN+fluxgridsS)/2
+    elif hemi == 'N':
+        gridfluxes[i_grids] += weights*fluxgridsN
+    else:
+        gridfluxes[i_grids] += weights*fluxgridsS
+    return gridfluxes
+
+def sorted_percentiles(values, percentiles):
+    """
+    np.percentile(values, percentiles, axis=0) (linear interpolation)
+    from one sort of values along the first axis, which is much faster
+    than np.percentile for many small columns
+    """
+    sorted_values = np.sort(values, axis=0)
+    n = sorted_values.shape[0]
+    results = np.empty((len(percentiles),)+sorted_values.shape[1:])
+    for i_q, q in enumerate(percentiles):
+        position = q/100.*(n-1)
+        i_lo = int(np.floor(position))
+        i_hi = min(i_lo+1, n-1)
+        frac = position-i_lo
+        results[i_q] = sorted_values[i_lo]+frac*(sorted_values[i_hi]-sorted_values[i_lo])
+    return results
@@ -52,4 +52,161 @@ def pcolor_flux(ax,mlatgrid,mltgrid,fluxgrid,hemisphere,**pcolor_kwargs):
     rgrid = r.reshape(mlatgrid.shape)
     thetagrid = theta.reshape(mltgrid.shape)
     mappable = ax.pcolormesh(thetagrid,rgrid,fluxgrid,**pcolor_kwargs)
-    return mappable
\ No newline at end of file
+    return mappable
+
+def color_limits(fluxgrids,lower=5.,upper=95.):
+    """
+    Fixed color limits (the lower and upper percentiles of all of the
+    grids) for rendering a sequence of flux grids with the same colors
+    """
+    values = np.concatenate([np.asarray(fluxgrid,dtype=float).ravel() for fluxgrid in fluxgrids])
+    vmin,vmax = np.nanpercentile(values,[lower,upper])
+    return vmin,vmax
+
+class DialRenderer(object):
+    """
+    Renders many flux grids (e.g. the frames of a movie) as dial plots
+
+    The figure, the polar axes, the mesh and the colorbar are built once.
+    Everything which does not change between frames (axes, tick labels,
+    colorbar) is drawn once and kept as a background image, so each frame
+    only sets the mesh colors and redraws the mesh, the grid lines over
+    it and the title. This is many times faster than making a new figure
+    (or calling pcolor_flux and savefig) for each frame.
+
+    The color limits are fixed, pass vmin and vmax (e.g. from
+    color_limits) so all frames use the same colors.
+    """
+    #zlib level of PNG frames (Pillow's default of 6 takes longer than drawing the frame)
+    png_compress_level = 1
+
+    def __init__(self,mlatgrid,mltgrid,vmin,vmax,hemisphere='N',figsize=(6,6),dpi=100,
+                 colorbar_label=None,**pcolor_kwargs):
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+        self.mlatgrid,self.mltgrid = mlatgrid,mltgrid
+        self.hemisphere = hemisphere
+        self.fig = Figure(figsize=figsize,dpi=dpi)
+        self.canvas = FigureCanvasAgg(self.fig)
+        self.ax = self.fig.add_subplot(111,projection='polar')
+        self.mesh = pcolor_flux(self.ax,mlatgrid,mltgrid,np.zeros(mlatgrid.shape),hemisphere,
+                                vmin=vmin,vmax=vmax,**pcolor_kwargs)
+        polar2dial(self.ax)
+        self.colorbar = self.fig.colorbar(self.mesh,ax=self.ax,label=colorbar_label)
+        #The title is positioned (above the tick labels) when it is drawn with some text
+        self.title = self.ax.set_title(' ')
+
+        self.mesh.set_animated(True)
+        self.title.set_animated(True)
+        for spine in self.ax.spines.values():
+            spine.set_animated(True)
+        self.canvas.draw()
+        #Grid lines, latitude labels and outline are drawn over the mesh in a full draw
+        self._overlay = (self.ax.xaxis.get_gridlines()+self.ax.yaxis.get_gridlines()
+                         +[label for label in self.ax.yaxis.get_ticklabels() if label.get_visible()]
+                         +list(self.ax.spines.values()))
+        self._background = self.canvas.copy_from_bbox(self.fig.bbox)
+
+    def render(self,fluxgrid,title=''):
+        """
+        Draws one frame, returns the image as an (height,width,4) RGBA
+        uint8 array
+        """
+        self.canvas.restore_region(self._background)
+        self.mesh.set_array(np.asarray(fluxgrid).ravel())
+        self.title.set_text(title)
+        self.ax.draw_artist(self.mesh)
+        for artist in self._overlay:
+            self.ax.draw_artist(artist)
+        self.ax.draw_artist(self.title)
+        return np.array(self.canvas.buffer_rgba())
+
+    def save_frame(self,fluxgrid,filename,title=''):
+        """Draws one frame and writes it to an image file (e.g. PNG)"""
+        import matplotlib.image
+        pil_kwargs = {'compress_level':self.png_compress_level} if filename.lower().endswith('.png') else None
+        matplotlib.image.imsave(filename,self.render(fluxgrid,title=title),pil_kwargs=pil_kwargs)
+
+#Renderer of each worker process of render_frames and save_animation
+_worker_renderer = None
+
+def _init_worker(renderer_args,renderer_kwargs):
+    global _worker_renderer
+    _worker_renderer = DialRenderer(*renderer_args,**renderer_kwargs)
+
+def _render_frame(renderer,frame):
+    fluxgrid,title,filename = frame
+    if filename is None:
+        return renderer.render(fluxgrid,title=title)
+    renderer.save_frame(fluxgrid,filename,title=title)
+    return filename
+
+def _render_worker(frame):
+    return _render_frame(_worker_renderer,frame)
+
+def _frames(fluxgrids,titles,filename_format):
+    for i_frame,fluxgrid in enumerate(fluxgrids):
+        title = titles[i_frame] if titles is not None else ''
+        filename = filename_format.format(i_frame) if filename_format is not None else None
+        yield fluxgrid,title,filename
+
+def _render(frames,renderer_args,renderer_kwargs,processes,chunksize):
+    """Results of _render_worker for each frame, in order"""
+    if processes == 1:
+        renderer = DialRenderer(*renderer_args,**renderer_kwargs)
+        for frame in frames:
+            yield _render_frame(renderer,frame)
+        return
+    import multiprocessing
+    with multiprocessing.Pool(processes,initializer=_init_worker,
+                              initargs=(renderer_args,renderer_kwargs)) as pool:
+        for result in pool.imap(_render_worker,frames,chunksize=chunksize):
+            yield result
+
+def render_frames(fluxgrids,filename_format,mlatgrid,mltgrid,vmin,vmax,titles=None,
+                  processes=None,chunksize=4,**renderer_kwargs):
+    """
+    Writes each of fluxgrids (an array or any iterable of grids, e.g. a
+    generator) as an image, named filename_format.format(i_frame), e.g.
+    'frames/flux_{0:05d}.png'. The frames are shared among processes
+    worker processes (all CPUs if None, 1 renders in this process), each
+    of which makes one DialRenderer. Returns the list of filenames.
+    """
+    frames = _frames(fluxgrids,titles,filename_format)
+    return list(_render(frames,(mlatgrid,mltgrid,vmin,vmax),renderer_kwargs,processes,chunksize))
+
+def save_animation(fluxgrids,filename,mlatgrid,mltgrid,vmin,vmax,titles=None,fps=10,
+                   processes=None,chunksize=4,**renderer_kwargs):
+    """
+    Renders fluxgrids as in render_frames and writes them to an animated
+    GIF (if filename ends with .gif, using Pillow) or to any format
+    ffmpeg can write (e.g. .mp4, the frames are piped to the ffmpeg set
+    in matplotlib's animation.ffmpeg_path)
+    """
+    frames = _frames(fluxgrids,titles,None)
+    images = _render(frames,(mlatgrid,mltgrid,vmin,vmax),renderer_kwargs,processes,chunksize)
+    if filename.lower().endswith('.gif'):
+        from PIL import Image
+        #Converted to palette images as they arrive to keep long movies in memory
+        pil_images = [Image.fromarray(image).convert('RGB').quantize(method=Image.FASTOCTREE) for image in images]
+        pil_images[0].save(filename,save_all=True,append_images=pil_images[1:],
+                           duration=int(round(1000./fps)),loop=0)
+        return filename
+
+    import subprocess
+    import matplotlib
+    ffmpeg = None
+    for image in images:
+        if ffmpeg is None:
+            height,width = image.shape[:2]
+            command = [matplotlib.rcParams['animation.ffmpeg_path'],'-y','-loglevel','error',
+                       '-f','rawvideo','-pix_fmt','rgba','-s','{0}x{1}'.format(width,height),
+                       '-r',str(fps),'-i','-','-pix_fmt','yuv420p',filename]
+            ffmpeg = subprocess.Popen(command,stdin=subprocess.PIPE)
+        ffmpeg.stdin.write(image.tobytes())
+    if ffmpeg is not None:
+        ffmpeg.stdin.close()
+        if ffmpeg.wait() != 0:
+            raise RuntimeError('ffmpeg failed writing {0}'.format(filename))
+    return filename
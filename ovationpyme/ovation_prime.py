@@ -4,15 +4,19 @@ Ovation Prime (historically called season_epoch.pro)
 """
 import os
 import datetime
+import threading
 from collections import OrderedDict
 
 import numpy as np
 from scipy import interpolate
 
 from ovationpyme import ovation_utilities
+from ovationpyme import ovation_kernels
+from ovationpyme.ovation_profiling import timed, stage
 
 from ovationpyme.ovation_utilities import robinson_auroral_conductance
 from ovationpyme.ovation_utilities import brekke_moen_solar_conductance
+from ovationpyme.ovation_utilities import brekke_moen_solar_conductance_for_times
 
 import geospacepy
 from geospacepy import special_datetime,sun,satplottools
@@ -48,6 +52,111 @@ def _check_for_old_jtype(estimator,type_of_flux):
         raise RuntimeError('{} is not a valid fluxtype.\n{}'.format(type_of_flux,
                                                                 explaination))
 
+#AACGMv2 keeps the date of its coefficients as global state, and setting
+#the date and converting are separate calls, so every AACGM conversion
+#(in any thread) is done while holding this lock
+_aacgm_lock = threading.RLock()
+
+def _aacgm_to_geo(mlats, mlons, dt, height=110.):
+    """Convert AACGM latitude and longitude to geodetic with the AACGMv2 library"""
+    with _aacgm_lock:
+        try:
+            glats,glons = aacgmv2.convert(mlats, mlons, height*np.ones_like(mlats),
+                                            date=dt, a2g=True, geocentric=False)
+        except AttributeError:
+            #convert method was deprecated
+            glats,glons,r = aacgmv2.convert_latlon_arr(mlats,
+                                                        mlons,
+                                                        height,
+                                                        dt,
+                                                        method_code='A2G')
+    return glats,glons
+
+def _geo_to_aacgm(glats, glons, dt, height=110.):
+    """Convert geodetic latitude and longitude to AACGM with the AACGMv2 library"""
+    with _aacgm_lock:
+        try:
+            mlats,mlons = aacgmv2.convert(glats, glons, height*np.ones_like(glats),
+                                            date=dt, a2g=False, geocentric=False)
+        except AttributeError:
+            #convert method was deprecated
+            mlats,mlons,r = aacgmv2.convert_latlon_arr(glats,
+                                                        glons,
+                                                        height,
+                                                        dt,
+                                                        method_code='G2A')
+    return mlats,mlons
+
+def _mlt_to_mlon(mlts, dt):
+    """Convert magnetic local time to AACGM longitude with the AACGMv2 library"""
+    with _aacgm_lock:
+        return aacgmv2.convert_mlt(mlts, dt, m2a=True)
+
+def coarsen_grid(grid, row_mlats, coarsen):
+    """
+    Average blocks of coarsen=(n_mlat, n_mlt) bins of (..., nmlat, nmlt)
+    grids. The latitude rows are weighted by their area (cos(mlat)), so the
+    area integral of a flux over the grid is unchanged.
+    """
+    n_mlat, n_mlt = coarsen
+    n_rows, n_cols = grid.shape[-2:]
+    if n_rows % n_mlat != 0 or n_cols % n_mlt != 0:
+        raise ValueError('Grid of shape {0} can not be divided into blocks of {1}'.format((n_rows, n_cols),
+                                                                                        coarsen))
+    weights = np.cos(np.radians(np.abs(row_mlats))).reshape(n_rows//n_mlat, n_mlat)
+    blocks = grid.reshape(grid.shape[:-2]+(n_rows//n_mlat, n_mlat, n_cols//n_mlt, n_mlt))
+    block_sums = np.sum(blocks*weights.reshape(n_rows//n_mlat, n_mlat, 1, 1), axis=(-3, -1))
+    return block_sums/(np.sum(weights, axis=1).reshape(-1, 1)*n_mlt)
+
+def _table_mlats_mlts():
+    """
+    Magnetic latitudes and local times of the bins of the coefficient tables
+    The mlat bins are orgainized like -50:-dlat:-90, 50:dlat:90
+    """
+    mlats = np.concatenate([np.linspace(-90., -50., 80)[::-1], np.linspace(50., 90., 80)])
+    mlts = np.linspace(0., 24., 96)
+    return mlats, mlts
+
+#Grid coordinates of the native grid (None) and each coarse grid
+_model_grids = {}
+
+def model_grids(coarsen=None):
+    """
+    mlatgridN, mltgridN, mlatgridS, mltgridS of the flux grids, the coarse
+    grids if coarsen is passed (see SeasonalFluxEstimator). They are made
+    once and shared by every estimator, so they are read-only.
+    """
+    grids = _model_grids.get(coarsen)
+    if grids is None:
+        mlats, mlts = _table_mlats_mlts()
+        n_half = mlats.size//2
+        mlatgridN, mltgridN = np.meshgrid(mlats[n_half:], mlts, indexing='ij')
+        mlatgridS, mltgridS = np.meshgrid(mlats[:n_half], mlts, indexing='ij')
+        grids = [mlatgridN, mltgridN, mlatgridS, mltgridS]
+        if coarsen is not None:
+            grids = [coarsen_grid(grid, mlats[n_half:], coarsen) for grid in grids]
+        for grid in grids:
+            grid.flags.writeable = False
+        #Another thread may have made them first
+        grids = _model_grids.setdefault(coarsen, tuple(grids))
+    return grids
+
+class _ScratchBuffers(threading.local):
+    """
+    Arrays an estimator reuses for intermediate results between calls,
+    keyed by name, shape and dtype. Each thread has its own, so the
+    estimator can still be shared between threads.
+    """
+    def __init__(self):
+        self.arrays = {}
+
+    def get(self, name, shape, dtype=float):
+        key = (name, tuple(shape), np.dtype(dtype))
+        array = self.arrays.get(key)
+        if array is None:
+            array = self.arrays[key] = np.empty(shape, dtype=dtype)
+        return array
+
 class LatLocaltimeInterpolator(object):
     def __init__(self, mlat_grid, mlt_grid, var):
         self.mlat_orig = mlat_grid
@@ -85,20 +194,66 @@ class BinCorrector(object):
         self.mlt_grid = mlt_grid
         self.mlts = self.mlt_grid[0, :].flatten()
         self.dy_thresh = None
+        #The wrapped MLTs of each latitude ring and which wrapped bin is
+        #nearest to each grid MLT do not depend on the values being fixed,
+        #they are worked out the first time a ring is used
+        self.nwrap = 4 # Pchip is cubic so order+1
+        self._rings = {}
 
-    def fix(self, y_grid, min_mlat=49, max_mlat=75, label=''):
+    def ring_geometry(self, i_mlat):
+        """
+        For latitude ring i_mlat returns (mlts_nowrap, mlts, i_nearest),
+        the ring's MLTs, the MLTs with nwrap bins wrapped around at each
+        end and the index of the wrapped MLT nearest to each ring MLT
+        """
+        if i_mlat not in self._rings:
+            nwrap = self.nwrap
+            wraparound = lambda x, nwrap: np.concatenate([x[-1*(nwrap+1):-1], x, x[:nwrap]])
+            mlts_nowrap = self.mlt_grid[i_mlat, :].copy()
+            mlts_nowrap[mlts_nowrap<0] += 24
+            mlts_nowrap[-1] = 23.9
+            #Wrap around first and last nwarp indicies in MLT
+            #this prevents out of bounds errors in the spline/derviative
+            mlts = wraparound(mlts_nowrap, nwrap)
+            mlts[:nwrap] -= 24. #to keep mlt in increasing order
+            mlts[-1*nwrap:] += 24.
+            #Same choice of bin as a nearest neighbour interp1d of the derivative
+            i_nearest = interpolate.interp1d(mlts, np.arange(len(mlts)), kind='nearest')(mlts_nowrap)
+            self._rings[i_mlat] = (mlts_nowrap, mlts, i_nearest.astype(int))
+        return self._rings[i_mlat]
+
+    @timed('BinCorrector.fix')
+    def fix(self, y_grid, min_mlat=49, max_mlat=75, label='', dy_thresh=None, out=None):
         """
         Compute derivatives and attempt to identify bad bins
         Assumes mlat varies along the first dimension of the gridded location
         arrays
+
+        dy_thresh, float, optional
+            Threshold on the change between adjacent bins above which a bin
+            is considered bad. Overrides the dy_thresh attribute for this
+            call only. If neither is set, the threshold is computed from
+            y_grid (3 standard deviations of the differences)
+
+        out, np.ndarray, optional
+            array to write the corrected grid into instead of a copy of
+            y_grid (can be y_grid itself, each ring is read before it is
+            corrected)
         """
         debug=False
         plot=False
-        bad_bins = np.zeros_like(y_grid, dtype=bool)
-        y_grid_corr = y_grid.copy()
-        if self.dy_thresh is None:
-                self.dy_thresh = 3.*np.nanstd(np.diff(y_grid.flatten()))
+        if out is None:
+            y_grid_corr = y_grid.copy()
+        else:
+            y_grid_corr = out
+            if out is not y_grid:
+                y_grid_corr[...] = y_grid
+        if dy_thresh is None:
+            dy_thresh = self.dy_thresh
+        if dy_thresh is None:
+            dy_thresh = 3.*np.nanstd(np.diff(y_grid_corr.flatten()))
         wraparound = lambda x, nwrap: np.concatenate([x[-1*(nwrap+1):-1], x, x[:nwrap]])
+        nwrap = self.nwrap
 
         for i_mlat, mlat in enumerate(self.mlats):
             if not(np.abs(mlat)>=min_mlat and np.abs(mlat)<=max_mlat):
@@ -107,35 +262,25 @@ class BinCorrector(object):
                               +' {0} and {1}'.format(min_mlat, max_mlat)
                               +' skipping')
                 continue
-            mlts_nowrap = self.mlt_grid[i_mlat, :].copy()
-            mlts_nowrap[mlts_nowrap<0] += 24
-            mlts_nowrap[-1] = 23.9
-            y = y_grid[i_mlat, :]
-            #Wrap around first and last nwarp indicies in MLT
-            #this prevents out of bounds errors in the spline/derviative
-            nwrap = 4 # Pchip is cubic so order+1
-            mlts = wraparound(mlts_nowrap, nwrap)
-            mlts[:nwrap] -= 24. #to keep mlt in increasing order
-            mlts[-1*nwrap:] += 24.
+            mlts_nowrap, mlts, i_nearest = self.ring_geometry(i_mlat)
+            y = y_grid_corr[i_mlat, :]
             y = wraparound(y, nwrap)
             #y_i = interpolate.PchipInterpolator(mlts, y)
             dy = np.diff(np.concatenate([y[:1], y])) # compute 1st derivative of spline
-            i_dy = interpolate.interp1d(mlts,dy,kind='nearest')
+            bad_bins = np.abs(dy[i_nearest]) > dy_thresh
             mlt_mask = np.ones_like(mlts,dtype=bool)
-            for i_mlt,mlt in enumerate(mlts_nowrap.flatten()):
-                if np.abs(i_dy(mlt)) > self.dy_thresh:
-                    bad_bins[i_mlat, i_mlt] = True
-                    mlt_mask[i_mlt+nwrap] = False
+            mlt_mask[nwrap:nwrap+len(mlts_nowrap)] = np.logical_not(bad_bins)
 
             y_corr_i = interpolate.PchipInterpolator(mlts[mlt_mask], y[mlt_mask])
             y_corr = y_corr_i(mlts)
             y_grid_corr[i_mlat, :] = y_corr_i(mlts_nowrap)
             if plot:
-                self.plot_single_spline(mlat, mlts, y, dy, mlt_mask, y_corr, label=label)
+                self.plot_single_spline(mlat, mlts, y, dy, mlt_mask, y_corr,
+                                        label=label, dy_thresh=dy_thresh)
 
         return y_grid_corr
 
-    def plot_single_spline(self, mlat, mlts, y, dy, mlt_mask, y_corr, label=''):
+    def plot_single_spline(self, mlat, mlts, y, dy, mlt_mask, y_corr, label='', dy_thresh=None):
         import matplotlib.pyplot as plt
         f = plt.figure(figsize=(8, 6))
         ax = f.add_subplot(111)
@@ -144,7 +289,7 @@ class BinCorrector(object):
         bad_bins = np.logical_not(mlt_mask)
         ax.plot(mlts, y_corr, 'g.', label='After Correction')
         ax.plot(mlts[bad_bins], y[bad_bins], 'rx',
-                label='Bad@dy>{0:.1f}'.format(self.dy_thresh))
+                label='Bad@dy>{0:.1f}'.format(dy_thresh if dy_thresh is not None else np.nan))
         ax.set_title('Spline fit (mlat={0:.1f})'.format(mlat))
         ax.set_xlabel('MLT')
         ax.legend()
@@ -168,76 +313,242 @@ class ConductanceEstimator(object):
     total electron energy flux
     (assumes a Maxwellian electron energy distribution)
     """
-    def __init__(self,fluxtypes=['diff']):
+    def __init__(self,fluxtypes=['diff'],numflux_estimators=None,eavg_estimators=None,coarsen=None):
+        """
+        fluxtypes - list of str, optional
+            auroral types to use for auroral conductance
+
+        numflux_estimators, eavg_estimators - dict, optional
+            Already created number flux FluxEstimators and
+            AverageEnergyEstimators keyed by auroral type, to
+            share loaded coefficients with other estimators
+
+        coarsen - tuple, optional
+            compute on a coarser grid (see SeasonalFluxEstimator), for
+            the estimators created here
+        """
+        numflux_estimators = {} if numflux_estimators is None else numflux_estimators
+        eavg_estimators = {} if eavg_estimators is None else eavg_estimators
 
         #Use diffuse aurora only
         self.numflux_estimator = {}
         self.eavg_estimator = {}
         for fluxtype in fluxtypes:
-            self.numflux_estimator[fluxtype] = FluxEstimator(fluxtype, 'number')
-            self.eavg_estimator[fluxtype] = AverageEnergyEstimator(fluxtype)
-
+            if fluxtype in numflux_estimators:
+                self.numflux_estimator[fluxtype] = numflux_estimators[fluxtype]
+            else:
+                self.numflux_estimator[fluxtype] = FluxEstimator(fluxtype, 'number', coarsen=coarsen)
+            if fluxtype in eavg_estimators:
+                self.eavg_estimator[fluxtype] = eavg_estimators[fluxtype]
+            else:
+                self.eavg_estimator[fluxtype] = AverageEnergyEstimator(fluxtype,
+                                                    numflux_estimator=self.numflux_estimator[fluxtype],
+                                                    coarsen=coarsen)
+        self._scratch = _ScratchBuffers()
+        self._bin_correctors = {}
+
+    def _bin_corrector(self, mlat_grid, mlt_grid):
+        """
+        A BinCorrector (and the bins below 52 degrees, which are zeroed)
+        for a grid, made once for each of the (shared, read-only) grids
+        """
+        key = (id(mlat_grid), id(mlt_grid))
+        cached = self._bin_correctors.get(key)
+        if cached is None or cached[0] is not mlat_grid or cached[1] is not mlt_grid:
+            cached = (mlat_grid, mlt_grid, BinCorrector(mlat_grid, mlt_grid), np.abs(mlat_grid) < 52.0)
+            self._bin_correctors[key] = cached
+        return cached[2:]
+
+    def coefficient_tables(self):
+        """
+        Loaded tables of the flux estimators, keyed by ('numflux', fluxtype,
+        ...) and ('eavg', fluxtype, ...) (see ovation_profiling.table_memory)
+        """
+        tables = OrderedDict()
+        for fluxtype in self.numflux_estimator:
+            for key, table in self.numflux_estimator[fluxtype].coefficient_tables().items():
+                tables[('numflux', fluxtype)+key] = table
+            for key, table in self.eavg_estimator[fluxtype].coefficient_tables().items():
+                tables[('eavg', fluxtype)+key] = table
+        return tables
+
+    @timed('get_conductance')
     def get_conductance(self, dt, hemi='N', solar=True, auroral=True,  background_p=None, background_h=None,
                         conductance_fluxtypes=['diff'], interp_bad_bins=True,
                         return_dF=False, return_f107=False,
-                        dnflux_bad_thresh=1.0e8, deavg_bad_thresh=.3):
+                        dnflux_bad_thresh=1.0e8, deavg_bad_thresh=.3,
+                        dF=None, f107=None, out=None):
         """
         Compute total conductance using Robinson formula and emperical solar conductance model
+
+        dF, float, optional
+            Newell coupling to use instead of the value computed from
+            solar wind data for dt
+
+        f107, float, optional
+            F10.7 to use instead of the daily value for dt
+
+        out, tuple, optional
+            (sigp, sigh) arrays (nmlat, nmlt) to write the conductances
+            into. The flux, average energy and auroral conductance grids
+            and the bin correctors are kept between calls.
         """
+        if hemi not in ['N', 'S']:
+            raise ValueError('Invalid hemisphere {0} for conductance (use N or S)'.format(hemi))
         log.notice("Getting conductance with solar {0}, aurora {1}, fluxtypes {2}, background_ped: {3}, background_hall {4}".format(solar,
                     auroral, conductance_fluxtypes, background_p, background_h))
 
         all_sigp_auroral, all_sigh_auroral = [], []
-        #Create a bin interpolation corrector
         for fluxtype in conductance_fluxtypes:
-            mlat_grid, mlt_grid, numflux_grid, dF = self.numflux_estimator[fluxtype].get_flux_for_time(dt, hemi=hemi, return_dF=True)
+            grid_shape = self.numflux_estimator[fluxtype].grid_shape()
+            numflux_grid = self._scratch.get('numflux', grid_shape)
+            eavg_grid = self._scratch.get('eavg', grid_shape)
+            mlat_grid, mlt_grid, numflux_grid, dF = self.numflux_estimator[fluxtype].get_flux_for_time(dt, hemi=hemi,
+                                                                                    return_dF=True, dF=dF,
+                                                                                    out=numflux_grid)
             #mlat_grid, mlt_grid, energyflux_grid = self.energyflux_estimator.get_flux_for_time(dt, hemi=hemi)
-            mlat_grid, mlt_grid, eavg_grid = self.eavg_estimator[fluxtype].get_eavg_for_time(dt, hemi=hemi)
+            mlat_grid, mlt_grid, eavg_grid = self.eavg_estimator[fluxtype].get_eavg_for_time(dt, hemi=hemi, dF=dF,
+                                                                                            out=eavg_grid)
 
             if interp_bad_bins:
-                #Clean up any extremely large bins
-                fixer = BinCorrector(mlat_grid, mlt_grid)
+                #Clean up any extremely large bins with a bin interpolation corrector
+                fixer, bad = self._bin_corrector(mlat_grid, mlt_grid)
 
                 #Fix numflux
-                fixer.dy_thresh = dnflux_bad_thresh
-                numflux_grid = fixer.fix(numflux_grid, label='nflux_{0}'.format(fluxtype))
+                fixer.fix(numflux_grid, label='nflux_{0}'.format(fluxtype),
+                          dy_thresh=dnflux_bad_thresh, out=numflux_grid)
 
                 #Fix avg energy
-                fixer.dy_thresh = deavg_bad_thresh
-                eavg_grid = fixer.fix(eavg_grid, label='eavg_{0}'.format(fluxtype))
+                fixer.fix(eavg_grid, label='eavg_{0}'.format(fluxtype),
+                          dy_thresh=deavg_bad_thresh, out=eavg_grid)
 
                 #zero out lowest latitude numflux row because it makes no sense
                 #has some kind of artefact at post midnight
-                bad = np.abs(mlat_grid) < 52.0
-                numflux_grid[bad] = 0.
+                np.copyto(numflux_grid, 0., where=bad)
 
             #raise RuntimeError('Debug stop!')
 
-            aur_conds = robinson_auroral_conductance(numflux_grid, eavg_grid)
+            aur_conds = robinson_auroral_conductance(numflux_grid, eavg_grid,
+                                                     out=(self._scratch.get('sigp_'+fluxtype, grid_shape),
+                                                          self._scratch.get('sigh_'+fluxtype, grid_shape)))
             this_sigp_auroral, this_sigh_auroral = aur_conds
             all_sigp_auroral.append(this_sigp_auroral)
             all_sigh_auroral.append(this_sigh_auroral)
 
-        sigp_solar, sigh_solar, f107 =  self.solar_conductance(dt, mlat_grid, mlt_grid, return_f107=True)
-        total_sigp_sqrd = np.zeros_like(sigp_solar)
-        total_sigh_sqrd = np.zeros_like(sigh_solar)
+        sigp_solar, sigh_solar, f107 =  self.solar_conductance(dt, mlat_grid, mlt_grid, return_f107=True,
+                                                              f107=f107)
+        sigp, sigh = self._total_conductance(sigp_solar, sigh_solar, all_sigp_auroral, all_sigh_auroral,
+                                             solar, auroral, background_p, background_h, out=out)
+
+        if return_dF and return_f107:
+            return mlat_grid, mlt_grid, sigp, sigh, dF, f107
+        elif return_dF:
+            return mlat_grid, mlt_grid, sigp, sigh, dF
+        elif return_f107:
+            return mlat_grid, mlt_grid, sigp, sigh, f107
+        else:
+            return mlat_grid, mlt_grid, sigp, sigh
+
+    @timed('get_conductance_for_times')
+    def get_conductance_for_times(self, dts, hemi='N', solar=True, auroral=True, background_p=None,
+                                  background_h=None, conductance_fluxtypes=['diff'], interp_bad_bins=True,
+                                  return_dF=False, return_f107=False,
+                                  dnflux_bad_thresh=1.0e8, deavg_bad_thresh=.3,
+                                  dFs=None, f107s=None):
+        """
+        get_conductance for many times at once (e.g. every step of a
+        storm interval). The flux and average energy regressions are
+        evaluated for all times together (FluxEstimator.get_flux_for_times),
+        one BinCorrector is used for every time and the solar conductance
+        is computed with solar_conductance_for_times.
+
+        dts - list of datetime.datetime (ntime,)
+
+        dFs - float or np.ndarray (ntime,), optional
+            Newell coupling for each time, instead of the values
+            computed from solar wind data
+
+        f107s - float or np.ndarray (ntime,), optional
+            F10.7 for each time, instead of the daily values
+
+        Returns mlat_grid, mlt_grid, sigp, sigh where sigp and sigh
+        have shape (ntime, nmlat, nmlt) (and the dF and F10.7 values
+        for each time if return_dF or return_f107 are True)
+        """
+        dts = list(dts)
+        if hemi not in ['N', 'S']:
+            raise ValueError('Invalid hemisphere {0} for conductance (use N or S)'.format(hemi))
+        log.notice("Getting conductance for {0} times with solar {1}, aurora {2}, fluxtypes {3}, background_ped: {4}, background_hall {5}".format(len(dts),
+                    solar, auroral, conductance_fluxtypes, background_p, background_h))
+
+        all_sigp_auroral, all_sigh_auroral = [], []
+        for fluxtype in conductance_fluxtypes:
+            outs = self.numflux_estimator[fluxtype].get_flux_for_times(dts, hemi=hemi, return_dF=True, dFs=dFs)
+            mlat_grid, mlt_grid, numflux_grids, dFs = outs
+            mlat_grid, mlt_grid, eavg_grids = self.eavg_estimator[fluxtype].get_eavg_for_times(dts, hemi=hemi,
+                                                                                              dFs=dFs)
+
+            if interp_bad_bins:
+                fixer, bad = self._bin_corrector(mlat_grid, mlt_grid)
+
+                for i_time in range(len(dts)):
+                    numflux_grids[i_time] = fixer.fix(numflux_grids[i_time], label='nflux_{0}'.format(fluxtype),
+                                                      dy_thresh=dnflux_bad_thresh)
+                    eavg_grids[i_time] = fixer.fix(eavg_grids[i_time], label='eavg_{0}'.format(fluxtype),
+                                                   dy_thresh=deavg_bad_thresh)
+
+                #zero out lowest latitude numflux row (see get_conductance)
+                numflux_grids[:, bad] = 0.
+
+            this_sigp_auroral, this_sigh_auroral = robinson_auroral_conductance(numflux_grids, eavg_grids)
+            all_sigp_auroral.append(this_sigp_auroral)
+            all_sigh_auroral.append(this_sigh_auroral)
+
+        sigp_solar, sigh_solar, f107s = self.solar_conductance_for_times(dts, mlat_grid, mlt_grid,
+                                                                         return_f107=True, f107s=f107s)
+        sigp, sigh = self._total_conductance(sigp_solar, sigh_solar, all_sigp_auroral, all_sigh_auroral,
+                                             solar, auroral, background_p, background_h)
+
+        if return_dF and return_f107:
+            return mlat_grid, mlt_grid, sigp, sigh, dFs, f107s
+        elif return_dF:
+            return mlat_grid, mlt_grid, sigp, sigh, dFs
+        elif return_f107:
+            return mlat_grid, mlt_grid, sigp, sigh, f107s
+        else:
+            return mlat_grid, mlt_grid, sigp, sigh
+
+    @staticmethod
+    def _total_conductance(sigp_solar, sigh_solar, all_sigp_auroral, all_sigh_auroral,
+                           solar, auroral, background_p, background_h, out=None):
+        """
+        Combine the solar and auroral conductances (arrays of any shape)
+        as the square root of the sum of squares, with an optional floor.
+        The conductances passed in are squared in place, the result is
+        written into out=(sigp, sigh) if it is passed.
+        """
+        if out is None:
+            out = (np.empty(np.shape(sigp_solar)), np.empty(np.shape(sigh_solar)))
+        total_sigp_sqrd, total_sigh_sqrd = out
+        total_sigp_sqrd[...] = 0.
+        total_sigh_sqrd[...] = 0.
 
         if solar:
-            total_sigp_sqrd += sigp_solar**2
-            total_sigh_sqrd += sigh_solar**2
+            total_sigp_sqrd += np.square(sigp_solar, out=sigp_solar)
+            total_sigh_sqrd += np.square(sigh_solar, out=sigh_solar)
 
         if auroral:
             #Sum up all contributions (sqrt of summed squares)
             for sigp_auroral, sigh_auroral in zip(all_sigp_auroral, all_sigh_auroral):
-                    total_sigp_sqrd += sigp_auroral**2
-                    total_sigh_sqrd += sigh_auroral**2
+                    total_sigp_sqrd += np.square(sigp_auroral, out=sigp_auroral)
+                    total_sigh_sqrd += np.square(sigh_auroral, out=sigh_auroral)
             #sigp_auroral *= 1.5
             #sigh_auroral *= 1.5
 
         #Now take square root to get hall and pedersen conductance
         if solar or auroral:
-            sigp = np.sqrt(total_sigp_sqrd)
-            sigh = np.sqrt(total_sigh_sqrd)
+            sigp = np.sqrt(total_sigp_sqrd, out=total_sigp_sqrd)
+            sigh = np.sqrt(total_sigh_sqrd, out=total_sigh_sqrd)
         else:
             #No conductance except flat background
             sigp = total_sigp_sqrd
@@ -248,19 +559,12 @@ class ConductanceEstimator(object):
             #Ellen found this to be the background nightside conductance level which
             #best optimizes the SuperDARN ElePot AMIE ability to predict AMPERE deltaB data, and
             #the AMPERE MagPot AMIE ability to predict SuperDARN LOS V
-            sigp[sigp<background_p]=background_p
-            sigh[sigh<background_h]=background_h
+            np.maximum(sigp, background_p, out=sigp)
+            np.maximum(sigh, background_h, out=sigh)
 
-        if return_dF and return_f107:
-            return mlat_grid, mlt_grid, sigp, sigh, dF, f107
-        elif return_dF:
-            return mlat_grid, mlt_grid, sigp, sigh, dF
-        elif return_f107:
-            return mlat_grid, mlt_grid, sigp, sigh, f107
-        else:
-            return mlat_grid, mlt_grid, sigp, sigh
+        return sigp, sigh
 
-    def solar_conductance(self, dt, mlats, mlts, return_f107=False):
+    def solar_conductance(self, dt, mlats, mlts, return_f107=False, f107=None):
         """
         Estimate the solar conductance using methods from:
             Cousins, E. D. P., T. Matsuo, and A. D. Richmond (2015), Mapping
@@ -273,32 +577,28 @@ class ConductanceEstimator(object):
             Maybe is not good for SZA for southern hemisphere? Don't know
             Going to use absolute value of latitude because that's what's done
             in Cousins IDL code.
+
+            If f107 is passed it is used instead of the daily F10.7 for dt
         """
-        #Find the closest hourly f107 value
-        #to the current time to specifiy the conductance
-        f107 = ovation_utilities.get_daily_f107(dt)
-        if hasattr(self,'_f107'):
-            log.warning(('Warning: Overriding real F107 {0}'.format(f107)
+        if f107 is None and hasattr(self,'_f107'):
+            log.warning(('Warning: Overriding real F107 '
                    +'with secret instance property _f107 {0}'.format(self._f107)
                    +'this is for debugging and will not'
-                   +'produce accurate results for a particular date.'))
+                   +'produce accurate results for a particular date.'
+                   +'Pass f107 as an argument instead'))
             f107 = self._f107
+        elif f107 is None:
+            #Find the closest hourly f107 value
+            #to the current time to specifiy the conductance
+            f107 = ovation_utilities.get_daily_f107(dt)
 
         #print "F10.7 = %f" % (f107)
 
         #Convert from magnetic to geocentric using the AACGMv2 python library
-        flatmlats,flatmlts = mlats.flatten(),mlts.flatten()
-        flatmlons = aacgmv2.convert_mlt(flatmlts, dt, m2a=True)
-        try:
-            glats,glons = aacgmv2.convert(flatmlats, flatmlons, 110.*np.ones_like(flatmlats),
-                                            date=dt, a2g=True, geocentric=False)
-        except AttributeError:
-            #convert method was deprecated
-            glats,glons,r = aacgmv2.convert_latlon_arr(flatmlats,
-                                                        flatmlons,
-                                                        110.,
-                                                        dt,
-                                                        method_code='A2G')
+        with stage('aacgm_conversion'):
+            flatmlats,flatmlts = mlats.flatten(),mlts.flatten()
+            flatmlons = _mlt_to_mlon(flatmlts, dt)
+            glats,glons = _aacgm_to_geo(flatmlats, flatmlons, dt)
 
         sigp,sigh = brekke_moen_solar_conductance(dt,glats,glons,f107)
 
@@ -310,16 +610,172 @@ class ConductanceEstimator(object):
         else:
             return sigp_unflat, sigh_unflat
 
+    def solar_conductance_for_times(self, dts, mlats, mlts, return_f107=False, f107s=None):
+        """
+        Solar conductance (see solar_conductance) for many times at once.
+        The conversion to geographic coordinates is done with one AACGM
+        call per UT day (the AACGM coefficients are evaluated at the start
+        of the day, so results differ from solar_conductance by a small
+        fraction of a Mho), and the Brekke-Moen model is evaluated for all
+        times and locations with one array operation.
+
+        dts - list of datetime.datetime (ntime,)
+
+        mlats, mlts - np.ndarray
+            magnetic latitude and local time grid (e.g. from get_flux_for_time)
+
+        f107s - float or np.ndarray (ntime,), optional
+            F10.7 for each time, instead of the daily values
+
+        Returns sigp, sigh with shape (ntime,)+mlats.shape (and the
+        F10.7 values if return_f107 is True)
+        """
+        dts = list(dts)
+        n_times = len(dts)
+        if f107s is None and hasattr(self,'_f107'):
+            log.warning(('Warning: Overriding real F107 '
+                   +'with secret instance property _f107 {0}'.format(self._f107)))
+            f107s = self._f107
+        if f107s is None:
+            f107s = np.array([ovation_utilities.get_daily_f107(dt) for dt in dts])
+        f107s = np.broadcast_to(np.asarray(f107s, dtype=float), (n_times,))
+
+        flatmlats,flatmlts = mlats.flatten(),mlts.flatten()
+        glats = np.empty((n_times, flatmlats.size))
+        glons = np.empty((n_times, flatmlats.size))
+        with stage('aacgm_conversion'):
+            #Magnetic longitude is linear in MLT, so only the longitude
+            #of magnetic midnight has to be found for each time
+            midnight_mlons = np.array([_mlt_to_mlon(np.zeros(1), dt)[0] for dt in dts])
+            flatmlons = np.mod(midnight_mlons.reshape(-1,1)+15.*flatmlts.reshape(1,-1), 360.)
+            days = np.array([dt.toordinal() for dt in dts])
+            for day in np.unique(days):
+                in_day = days == day
+                n_in_day = np.count_nonzero(in_day)
+                day_dt = datetime.datetime.fromordinal(int(day))
+                day_glats,day_glons = _aacgm_to_geo(np.tile(flatmlats, n_in_day),
+                                                    flatmlons[in_day].flatten(), day_dt)
+                glats[in_day] = day_glats.reshape(n_in_day, -1)
+                glons[in_day] = day_glons.reshape(n_in_day, -1)
+
+        sigp,sigh = brekke_moen_solar_conductance_for_times(dts,glats,glons,f107s)
+
+        sigp = sigp.reshape((n_times,)+mlats.shape)
+        sigh = sigh.reshape((n_times,)+mlats.shape)
+        if return_f107:
+            return sigp, sigh, np.array(f107s)
+        else:
+            return sigp, sigh
+
 class AverageEnergyEstimator(object):
     """A class which estimates average energy by estimating both
     energy and number flux
     """
-    def __init__(self,atype,numflux_threshold=5.0e7):
+    def __init__(self,atype,numflux_threshold=5.0e7,
+                 numflux_estimator=None,energyflux_estimator=None,coarsen=None):
+        """
+        atype - str, ['diff','mono','wave','ions']
+            type of aurora
+
+        numflux_threshold - float, optional
+            average energy is zeroed where number flux is below this
+
+        numflux_estimator, energyflux_estimator - FluxEstimator, optional
+            Already created number and energy FluxEstimators for atype,
+            to share loaded coefficients with other estimators
+
+        coarsen - tuple, optional
+            compute on a coarser grid (see SeasonalFluxEstimator), for
+            the flux estimators created here
+        """
         self.numflux_threshold = numflux_threshold
-        self.numflux_estimator = FluxEstimator(atype,'number')
-        self.energyflux_estimator = FluxEstimator(atype,'energy')
+        if numflux_estimator is None:
+            numflux_estimator = FluxEstimator(atype,'number',coarsen=coarsen)
+        if energyflux_estimator is None:
+            energyflux_estimator = FluxEstimator(atype,'energy',coarsen=coarsen)
+        for estimator,energy_or_number in [(numflux_estimator,'number'),
+                                           (energyflux_estimator,'energy')]:
+            if estimator.atype != atype or estimator.energy_or_number != energy_or_number:
+                raise RuntimeError(('{0} FluxEstimator must be for auroral type {1}'.format(energy_or_number,atype)
+                                    +' got {0} {1}'.format(estimator.atype,estimator.energy_or_number)))
+        self.numflux_estimator = numflux_estimator
+        self.energyflux_estimator = energyflux_estimator
+        self._scratch = _ScratchBuffers()
+
+    def coefficient_tables(self):
+        """Loaded tables of the number and energy flux estimators"""
+        tables = OrderedDict()
+        for energy_or_number,estimator in [('number',self.numflux_estimator),('energy',self.energyflux_estimator)]:
+            for key,table in estimator.coefficient_tables().items():
+                tables[(energy_or_number,)+key] = table
+        return tables
+
+    @timed('get_eavg_for_time')
+    def get_eavg_for_time(self,dt,hemi='N',return_dF=False,combine_hemispheres=True,dF=None,out=None):
+        """
+        Average energy (keV) for a time, from the ratio of the energy and
+        number fluxes. If dF (Newell coupling) is passed it is used
+        instead of the value computed from solar wind data for dt.
+        hemi='both' returns both hemispheres (see FluxEstimator.get_flux_for_time)
+
+        out - np.ndarray (nmlat, nmlt), optional
+            array to write the average energy into (a tuple of two
+            arrays for hemi='both'), the flux grids are kept between calls
+        """
+        if dF is None and hasattr(self,'_dF'):
+            log.warning(('Warning: Overriding real Newell Coupling '
+                           +'with secret instance property _dF {0}'.format(self._dF)
+                           +'this is for debugging and will not'
+                           +'produce accurate results for a particular date.'
+                           +'Pass dF as an argument instead'))
+            dF = self._dF
+
+        kwargs = {
+                    'hemi':hemi,
+                    'combine_hemispheres':combine_hemispheres,
+                    'return_dF':True
+                    }
+
+        hemis = FluxEstimator._hemispheres(hemi)
+        grid_shape = self.numflux_estimator.grid_shape()
+        def flux_buffers(name):
+            buffers = tuple(self._scratch.get(name+h,grid_shape) for h in hemis)
+            return buffers if len(hemis) > 1 else buffers[0]
+        numflux_outs = self.numflux_estimator.get_flux_for_time(dt,dF=dF,out=flux_buffers('number'),**kwargs)
+        dF = numflux_outs[-1]
+        energyflux_outs = self.energyflux_estimator.get_flux_for_time(dt,dF=dF,out=flux_buffers('energy'),
+                                                                      **kwargs)
+
+        #Three outputs (mlats, mlts, flux) per hemisphere
+        outs = ()
+        mask = self._scratch.get('mask',grid_shape,dtype=bool)
+        for i_hemi,grideavg in zip(range(0, len(numflux_outs)-1, 3),FluxEstimator._hemisphere_outs(out,hemis)):
+            grid_mlats,grid_mlts,gridnumflux = numflux_outs[i_hemi:i_hemi+3]
+            gridenergyflux = energyflux_outs[i_hemi+2]
+            if grideavg is None:
+                grideavg = np.empty(grid_shape)
+            self._eavg_from_fluxes(gridnumflux,gridenergyflux,grideavg,mask)
+            outs += (grid_mlats,grid_mlts,grideavg)
 
-    def get_eavg_for_time(self,dt,hemi='N',return_dF=False,combine_hemispheres=True):
+        if not return_dF:
+            return outs
+        else:
+            return outs+(dF,)
+
+    @timed('get_eavg_for_times')
+    def get_eavg_for_times(self,dts,hemi='N',return_dF=False,combine_hemispheres=True,dFs=None):
+        """
+        get_eavg_for_time for many times at once (see
+        FluxEstimator.get_flux_for_times), returns average energy
+        grids with shape (ntime, nmlat, nmlt)
+        """
+        if dFs is None and hasattr(self,'_dF'):
+            log.warning(('Warning: Overriding real Newell Coupling '
+                           +'with secret instance property _dF {0}'.format(self._dF)
+                           +'this is for debugging and will not'
+                           +'produce accurate results for a particular date.'
+                           +'Pass dFs as an argument instead'))
+            dFs = self._dF
 
         kwargs = {
                     'hemi':hemi,
@@ -327,31 +783,54 @@ class AverageEnergyEstimator(object):
                     'return_dF':True
                     }
 
-        grid_mlats,grid_mlts,gridnumflux,dF = self.numflux_estimator.get_flux_for_time(dt,**kwargs)
-        grid_mlats,grid_mlts,gridenergyflux,dF = self.energyflux_estimator.get_flux_for_time(dt,**kwargs)
+        numflux_outs = self.numflux_estimator.get_flux_for_times(dts,dFs=dFs,**kwargs)
+        dFs = numflux_outs[-1]
+        energyflux_outs = self.energyflux_estimator.get_flux_for_times(dts,dFs=dFs,**kwargs)
 
-        grideavg = (gridenergyflux/1.6e-12)/gridnumflux #energy flux Joules->eV
-        grideavg = grideavg/1000. #eV to keV
+        #Three outputs (mlats, mlts, flux) per hemisphere
+        outs = ()
+        for i_hemi in range(0, len(numflux_outs)-1, 3):
+            grid_mlats,grid_mlts,gridnumfluxes = numflux_outs[i_hemi:i_hemi+3]
+            gridenergyfluxes = energyflux_outs[i_hemi+2]
+            grideavgs = self.eavg_from_fluxes(gridnumfluxes,gridenergyfluxes)
+            outs += (grid_mlats,grid_mlts,grideavgs)
+
+        if not return_dF:
+            return outs
+        else:
+            return outs+(dFs,)
+
+    def eavg_from_fluxes(self,gridnumflux,gridenergyflux,out=None):
+        """
+        Average energy (keV) from number and energy flux arrays (of any
+        shape), limited to the range of the DMSP SSJ channels (written
+        into out if it is passed)
+        """
+        if out is None:
+            out = np.empty(np.shape(gridnumflux))
+        return self._eavg_from_fluxes(gridnumflux,gridenergyflux,out,np.empty(out.shape,dtype=bool))
+
+    def _eavg_from_fluxes(self,gridnumflux,gridenergyflux,grideavg,mask):
+        """eavg_from_fluxes in place in grideavg, using the boolean array mask for the limits"""
+        np.divide(gridenergyflux,1.6e-12,out=grideavg) #energy flux Joules->eV
+        np.divide(grideavg,gridnumflux,out=grideavg)
+        np.divide(grideavg,1000.,out=grideavg) #eV to keV
 
         #Limit to reasonable number fluxes
-        n_pts = len(grideavg.flatten())
-        n_low_numflux = np.count_nonzero(gridnumflux<self.numflux_threshold)
-        grideavg[gridnumflux<self.numflux_threshold]=0.
+        n_pts = grideavg.size
+        n_low_numflux = np.count_nonzero(np.less(gridnumflux,self.numflux_threshold,out=mask))
+        np.copyto(grideavg,0.,where=mask)
         log.debug(('Zeroed {:d}/{:d} average energies'.format(n_low_numflux,n_pts)
               +'with numflux below {:e}'.format(self.numflux_threshold)))
 
         #Limit to DMSP SSJ channels range
-        n_over = np.count_nonzero(grideavg>30)
-        n_under = np.count_nonzero(grideavg<.5)
+        n_over = np.count_nonzero(np.greater(grideavg,30.,out=mask))
+        n_under = np.count_nonzero(np.less(grideavg,.5,out=mask))
         log.debug('Zeroed {:d}/{:d} average energies over 30 keV'.format(n_over,n_pts))
         log.debug('Zeroed {:d}/{:d} average energies under .2 keV'.format(n_under,n_pts))
-        grideavg[grideavg>30.]=30.#Max of 30keV
-        grideavg[grideavg<.2]=0. #Min of 1 keV
-
-        if not return_dF:
-            return grid_mlats,grid_mlts,grideavg
-        else:
-            return grid_mlats,grid_mlts,grideavg,dF
+        np.copyto(grideavg,30.,where=np.greater(grideavg,30.,out=mask))#Max of 30keV
+        np.copyto(grideavg,0.,where=np.less(grideavg,.2,out=mask)) #Min of 1 keV
+        return grideavg
 
 class FluxEstimator(object):
     """
@@ -363,7 +842,8 @@ class FluxEstimator(object):
     time, and are interpolated using a B-spline
     representation
     """
-    def __init__(self, atype, energy_or_number, seasonal_estimators=None):
+    def __init__(self, atype, energy_or_number, seasonal_estimators=None, backend=None,
+                 solarwind_cadence='1min', coarsen=None):
         """
 
         doy - int
@@ -380,27 +860,128 @@ class FluxEstimator(object):
             A dictionary of SeasonalFluxEstimators for seasons
             'spring','fall','summer','winter', if you
             don't want to create them
-            (for efficiency across multi-day calls)
+            (for efficiency across multi-day calls, or to share
+            one set of loaded coefficients between several estimators).
+            If not passed, each season's estimator is created (its
+            coefficient files are read) the first time a day of year
+            with nonzero weight for that season is used
+
+        backend - str, ['python','numpy','numba'], optional
+            how to evaluate the seasonal regressions (see ovation_kernels),
+            None uses the default backend
+
+        solarwind_cadence - str, ['1min','5min','hourly'], optional
+            cadence of the OMNI data the Newell coupling is computed
+            from (when it is not passed to get_flux_for_time), the
+            coarser cadences read much less data
+
+        coarsen - tuple, optional
+            compute on a coarser grid, (n_mlat, n_mlt) native bins per
+            output bin (see SeasonalFluxEstimator)
 
         """
         self.atype = atype #Type of aurora
+        if solarwind_cadence not in ovation_utilities.solarwind_cadences:
+            raise ValueError('Invalid solar wind cadence {0}, valid values {1}'.format(solarwind_cadence,
+                                                                    ovation_utilities.solarwind_cadences))
+        self.solarwind_cadence = solarwind_cadence
+        self.coarsen = coarsen
 
         #Check for legacy values of this argument
         _check_for_old_jtype(self,energy_or_number)
 
         self.energy_or_number = energy_or_number #Type of flux
+        self.backend = backend
 
         seasons = ['spring','summer','fall','winter']
 
+        self._seasonal_lock = threading.Lock()
+        self._scratch = _ScratchBuffers()
+        self._southern_grid = None
         if seasonal_estimators is None:
-            #Make a seasonal estimator for each season with nonzero weight
-            self.seasonal_flux_estimators = {season:SeasonalFluxEstimator(season,atype,energy_or_number) for season in seasons}
+            #Seasonal estimators are made on first use (see get_seasonal_estimator)
+            self._seasonal_flux_estimators = {}
         else:
             #Ensure the passed seasonal estimators are approriate for this atype and jtype
+            jtype_atype_ok = set(seasonal_estimators.keys()) == set(seasons)
             for season,estimator in seasonal_estimators.items():
-                jtype_atype_ok = jtype_atype_ok and (self.jtype == estimator.jtype and self.atype == estimator.atype)
+                jtype_atype_ok = jtype_atype_ok and (self.energy_or_number == estimator.energy_or_number
+                                                     and self.atype == estimator.atype)
             if not jtype_atype_ok:
-                raise RuntimeError('Auroral and flux type of SeasonalFluxEstimators do not match {0} and {1}!'.format(self.atype,self.jtype))
+                raise RuntimeError('Auroral and flux type of SeasonalFluxEstimators do not match {0} and {1}!'.format(self.atype,
+                                                                                                                   self.energy_or_number))
+            self._seasonal_flux_estimators = dict(seasonal_estimators)
+
+    def get_seasonal_estimator(self, season):
+        """
+        The SeasonalFluxEstimator for a season, reading its coefficients
+        if this is the first time the season is needed
+        """
+        estimator = self._seasonal_flux_estimators.get(season)
+        if estimator is None:
+            with self._seasonal_lock:
+                #Another thread may have loaded it while we waited
+                estimator = self._seasonal_flux_estimators.get(season)
+                if estimator is None:
+                    log.debug('Loading {0} {1} {2} coefficients'.format(season, self.atype,
+                                                                        self.energy_or_number))
+                    estimator = SeasonalFluxEstimator(season, self.atype, self.energy_or_number,
+                                                      backend=self.backend, coarsen=self.coarsen)
+                    self._seasonal_flux_estimators[season] = estimator
+        return estimator
+
+    def preload(self, seasons=['spring','summer','fall','winter']):
+        """
+        Load the coefficients for seasons now instead of on first
+        use (e.g. before serving requests)
+        """
+        for season in seasons:
+            self.get_seasonal_estimator(season)
+        return self
+
+    def coefficient_tables(self):
+        """
+        Tables of the seasons loaded so far, keyed by (season, name)
+        (see SeasonalFluxEstimator.coefficient_tables)
+        """
+        tables = OrderedDict()
+        for season in ['spring','summer','fall','winter']:
+            estimator = self._seasonal_flux_estimators.get(season)
+            if estimator is not None:
+                for name,table in estimator.coefficient_tables().items():
+                    tables[(season,name)] = table
+        return tables
+
+    def grid_shape(self):
+        """(nmlat, nmlt) shape of the flux grids"""
+        for estimator in list(self._seasonal_flux_estimators.values()):
+            return estimator.output_grids()[0].shape
+        return model_grids(None if self.coarsen is None else tuple(self.coarsen))[0].shape
+
+    def _southern_mlats(self, grid_mlats):
+        """
+        -1*grid_mlats, the latitudes returned for the southern hemisphere,
+        made once for the (shared, read-only) grid of the seasonal estimators
+        """
+        cached = self._southern_grid
+        if cached is None or cached[0] is not grid_mlats:
+            southern_mlats = -1.*grid_mlats
+            southern_mlats.flags.writeable = False
+            cached = self._southern_grid = (grid_mlats, southern_mlats)
+        return cached[1]
+
+    @staticmethod
+    def _hemisphere_outs(out, hemis):
+        """The out argument as a list of one output array (or None) per hemisphere"""
+        if out is None:
+            return [None]*len(hemis)
+        return [out] if len(hemis) == 1 else list(out)
+
+    @property
+    def seasonal_flux_estimators(self):
+        """Dictionary of the SeasonalFluxEstimators of all seasons (loads any not yet used)"""
+        self.preload()
+        return dict(self._seasonal_flux_estimators)
 
     def season_weights(self,doy):
         """
@@ -440,20 +1021,26 @@ class FluxEstimator(object):
 
         return weight
 
-    def get_season_fluxes(self, dF, weights):
+    def get_season_fluxes(self, dF, weights, out=None):
         """
         Extract the flux for each season and hemisphere and
         store them in a dictionary
         Return positive latitudes, since northern and southern
         latitude/localtime grids are the same
+
+        out - dict, optional
+            (fluxgridN, fluxgridS) arrays to write each season's flux
+            into, keyed by season
         """
         seasonfluxesN,seasonfluxesS = OrderedDict(),OrderedDict()
         gridmlats,gridmlts = None,None
-        for season,estimator in self.seasonal_flux_estimators.items():
-            if weights[season]==0.:
-                continue #Skip calculation for seasons with zero weight
+        for season,weight in weights.items():
+            if weight==0.:
+                continue #Skip calculation (and loading) for seasons with zero weight
 
-            flux_outs = estimator.get_gridded_flux(dF)
+            estimator = self.get_seasonal_estimator(season)
+            flux_outs = estimator.get_gridded_flux(dF, backend=self.backend,
+                                                   out=None if out is None else out[season])
             gridmlatsN,gridmltsN,gridfluxN = flux_outs[:3]
             gridmlatsS,gridmltsS,gridfluxS = flux_outs[3:]
             seasonfluxesN[season]=gridfluxN
@@ -462,8 +1049,10 @@ class FluxEstimator(object):
             gridmlts = gridmltsN
         return gridmlats,gridmlts,seasonfluxesN,seasonfluxesS
 
+    @timed('get_flux_for_time')
     def get_flux_for_time(self,dt,
-                            hemi='N',return_dF=False,combine_hemispheres=True):
+                            hemi='N',return_dF=False,combine_hemispheres=True,
+                            dF=None,solarwind_cadence=None,out=None):
         """
         The weighting of the seasonal flux for the different hemispheres
         is a bit counterintuitive, but after some investigation of the flux
@@ -492,6 +1081,23 @@ class FluxEstimator(object):
         there are data gaps (particularly in the northern hemisphere dawn)
         so this is the default behavior here as well. This can be overriden
         by passing combine_hemispheres=False
+
+        The Newell coupling (dF) is normally computed from solar wind
+        data for dt, passing dF uses that value instead (e.g. to run the model
+        for a hypothetical driving)
+
+        hemi='both' returns grid_mlatsN, grid_mltsN, gridfluxN, grid_mlatsS,
+        grid_mltsS, gridfluxS (like SeasonalFluxEstimator.get_gridded_flux),
+        evaluating each season's grids only once for the two hemispheres
+
+        solarwind_cadence overrides the estimator's OMNI cadence for
+        computing dF for this call
+
+        out - np.ndarray (nmlat, nmlt), optional
+            array to write the flux into instead of a new array (a tuple
+            of two arrays for hemi='both'). The seasonal grids are kept
+            between calls, and the grid coordinates are read-only and
+            shared, so a loop which passes out allocates no new grids.
         """
         doy = dt.timetuple().tm_yday
 
@@ -499,46 +1105,213 @@ class FluxEstimator(object):
             log.warning(('Warning: IDL version of OP2010 always combines hemispheres.'
                         +'know what you are doing before switching this behavior'))
 
-        if hemi=='N':
-            weights = self.season_weights(doy)
-        elif hemi=='S':
-            weights = self.season_weights(365.-doy)
-        else:
-            raise ValueError('Invalid hemisphere {0} (use N or S)'.format(hemi))
+        hemis = self._hemispheres(hemi)
+        hemi_weights = OrderedDict([(h, self.hemisphere_weights(doy, h)) for h in hemis])
 
-        dF = ovation_utilities.calc_dF(dt)
-        if hasattr(self,'_dF'):
-            log.warning(('Warning: Overriding real Newell Coupling {0}'.format(dF)
+        if dF is None and hasattr(self,'_dF'):
+            log.warning(('Warning: Overriding real Newell Coupling '
                            +'with secret instance property _dF {0}'.format(self._dF)
                            +'this is for debugging and will not'
-                           +'produce accurate results for a particular date'))
+                           +'produce accurate results for a particular date.'
+                           +'Pass dF as an argument instead'))
             dF = self._dF
-
-        season_fluxes_outs = self.get_season_fluxes(dF,weights)
+        elif dF is None:
+            if solarwind_cadence is None:
+                solarwind_cadence = self.solarwind_cadence
+            dF = ovation_utilities.calc_dF(dt,cadence=solarwind_cadence)
+
+        #Each season is evaluated once, for either hemisphere that needs it
+        weights = OrderedDict([(season, max([hemi_weights[h][season] for h in hemis]))
+                               for season in hemi_weights[hemis[0]]])
+        grid_shape = self.grid_shape()
+        season_buffers = OrderedDict([(season, (self._scratch.get(season+'N', grid_shape),
+                                                self._scratch.get(season+'S', grid_shape)))
+                                      for season, weight in weights.items() if weight != 0.])
+        season_fluxes_outs = self.get_season_fluxes(dF,weights,out=season_buffers)
         grid_mlats,grid_mlts,seasonfluxesN,seasonfluxesS = season_fluxes_outs
 
-        gridflux = np.zeros_like(grid_mlats)
-        for season,W in weights.items():
-            if W==0.:
-                continue
-            
-            gridfluxN = seasonfluxesN[season]
-            gridfluxS = seasonfluxesS[season]
+        backend = ovation_kernels.resolve_backend(self.backend)
+        outs = ()
+        for h,gridflux in zip(hemis,self._hemisphere_outs(out,hemis)):
+            if gridflux is None:
+                gridflux = np.zeros(grid_mlats.shape)
+            else:
+                gridflux[...] = 0.
+            for season,W in hemi_weights[h].items():
+                if W==0.:
+                    continue
+
+                gridfluxN = seasonfluxesN[season]
+                gridfluxS = seasonfluxesS[season]
+
+                ovation_kernels.accumulate_hemispheres(backend, gridflux, W, gridfluxN, gridfluxS,
+                                                       'NS' if combine_hemispheres else h)
+
+            #by default returns positive latitudes
+            outs += (grid_mlats if h == 'N' else self._southern_mlats(grid_mlats), grid_mlts, gridflux)
+
+        if not return_dF:
+            return outs
+        else:
+            return outs+(dF,)
+
+    @staticmethod
+    def _hemispheres(hemi):
+        """Hemispheres to compute for a hemi argument ('N', 'S' or 'both')"""
+        if hemi in ['N', 'S']:
+            return [hemi]
+        elif hemi == 'both':
+            return ['N', 'S']
+        raise ValueError('Invalid hemisphere {0} (use N, S or both)'.format(hemi))
+
+    def hemisphere_weights(self, doy, hemi):
+        """
+        Season weights for a hemisphere, the southern hemisphere uses
+        the weights for 365-doy (see get_flux_for_time)
+        """
+        return self.season_weights(doy if hemi == 'N' else 365.-doy)
+
+    @timed('get_flux_for_times')
+    def get_flux_for_times(self, dts, hemi='N', return_dF=False, combine_hemispheres=True,
+                           dFs=None, solarwind_cadence=None):
+        """
+        get_flux_for_time for many times at once. Each season's
+        regression is evaluated for all of the times it contributes to
+        in one call (see SeasonalFluxEstimator.get_gridded_flux_for_dFs)
+
+        dts - list of datetime.datetime (ntime,)
+
+        dFs - float or np.ndarray (ntime,), optional
+            Newell coupling for each time, instead of the values
+            computed from solar wind data
+
+        solarwind_cadence - str, optional
+            see get_flux_for_time
 
-            if combine_hemispheres:
-                gridflux += W*(gridfluxN+gridfluxS)/2
-            elif hemi=='N':
-                gridflux += W*gridfluxN
-            elif hemi=='S':
-                gridflux += W*gridfluxS
+        Returns grid_mlats, grid_mlts, gridfluxes (ntime, nmlat, nmlt)
+        (three of these for each hemisphere if hemi is 'both', and the dF
+        values if return_dF is True)
+        """
+        dts = list(dts)
+        n_times = len(dts)
+
+        if not combine_hemispheres:
+            log.warning(('Warning: IDL version of OP2010 always combines hemispheres.'
+                        +'know what you are doing before switching this behavior'))
 
-        if hemi == 'S':
-            grid_mlats = -1.*grid_mlats #by default returns positive latitudes
+        hemis = self._hemispheres(hemi)
+        doys = [dt.timetuple().tm_yday for dt in dts]
+        hemi_weights = OrderedDict([(h, [self.hemisphere_weights(doy, h) for doy in doys]) for h in hemis])
+
+        if dFs is None and hasattr(self,'_dF'):
+            log.warning(('Warning: Overriding real Newell Coupling '
+                           +'with secret instance property _dF {0}'.format(self._dF)
+                           +'this is for debugging and will not'
+                           +'produce accurate results for a particular date.'
+                           +'Pass dFs as an argument instead'))
+            dFs = self._dF
+        elif dFs is None:
+            if solarwind_cadence is None:
+                solarwind_cadence = self.solarwind_cadence
+            dFs = [ovation_utilities.calc_dF(dt,cadence=solarwind_cadence) for dt in dts]
+        dFs = np.array(np.broadcast_to(np.asarray(dFs, dtype=float), (n_times,)))
+
+        backend = ovation_kernels.resolve_backend(self.backend)
+        grid_mlats, grid_mlts = None, None
+        gridfluxes = OrderedDict([(h, None) for h in hemis])
+        #Same season order as get_flux_for_time, so the sums are identical
+        for season in self.season_weights(1).keys():
+            hemi_W = OrderedDict([(h, np.array([weight[season] for weight in hemi_weights[h]])) for h in hemis])
+            in_season = np.logical_or.reduce([W != 0. for W in hemi_W.values()])
+            if not np.any(in_season):
+                continue
+
+            #Evaluated once for the times either hemisphere needs
+            flux_outs = self.get_seasonal_estimator(season).get_gridded_flux_for_dFs(dFs[in_season],
+                                                                                        backend=self.backend)
+            grid_mlats, grid_mlts = flux_outs[0], flux_outs[1]
+            gridfluxesN, gridfluxesS = flux_outs[2], flux_outs[5]
+
+            for h in hemis:
+                if gridfluxes[h] is None:
+                    gridfluxes[h] = np.zeros((n_times,)+grid_mlats.shape)
+                W = hemi_W[h][in_season]
+                #Skip (rather than multiply by) zero weights, as get_flux_for_time does
+                used = W != 0.
+                i_times = np.flatnonzero(in_season)[used]
+                if not np.all(used):
+                    gridfluxesN_used, gridfluxesS_used = gridfluxesN[used], gridfluxesS[used]
+                else:
+                    gridfluxesN_used, gridfluxesS_used = gridfluxesN, gridfluxesS
+                ovation_kernels.accumulate_hemispheres_for_grids(backend, gridfluxes[h], i_times, W[used],
+                                                                 gridfluxesN_used, gridfluxesS_used,
+                                                                 'NS' if combine_hemispheres else h)
+
+        if grid_mlats is None:
+            #No times, the grid is the same for every season (and no coefficients are needed)
+            grid_mlats, grid_mlts = model_grids(None if self.coarsen is None else tuple(self.coarsen))[:2]
+            gridfluxes = OrderedDict([(h, np.zeros((0,)+grid_mlats.shape)) for h in hemis])
+
+        outs = ()
+        for h in hemis:
+            #by default returns positive latitudes
+            outs += (grid_mlats if h == 'N' else self._southern_mlats(grid_mlats), grid_mlts, gridfluxes[h])
 
         if not return_dF:
-            return grid_mlats,grid_mlts,gridflux
+            return outs
         else:
-            return grid_mlats,grid_mlts,gridflux,dF
+            return outs+(dFs,)
+
+    @timed('get_flux_ensemble')
+    def get_flux_ensemble(self, dt, dFs=None, dF_distribution=None, n_members=100, hemi='N',
+                          percentiles=[5., 50., 95.], combine_hemispheres=True, random_state=None,
+                          return_members=False):
+        """
+        Flux for an ensemble of Newell coupling values at one time (e.g.
+        to estimate the uncertainty due to the solar wind driving). The
+        regressions for all of the members are evaluated together, as in
+        get_flux_for_times.
+
+        dFs - np.ndarray (n_members,), optional
+            dF of each member
+
+        dF_distribution - optional
+            distribution to draw n_members values of dF from instead,
+            anything with an rvs(size=..., random_state=...) method such
+            as a scipy.stats distribution, e.g.
+            scipy.stats.lognorm(.3, scale=ovation_utilities.calc_dF(dt))
+
+        percentiles - list of float
+            percentiles (0-100) of the members' flux to return
+
+        Returns grid_mlats, grid_mlts, ensemble (three of these for each
+        hemisphere if hemi is 'both'). ensemble is an OrderedDict with
+        the members' values of 'dF', the 'mean' and 'std' flux grids, and
+        'percentiles', an OrderedDict of flux grids keyed by percentile
+        (and 'members', the (n_members, nmlat, nmlt) grids, if
+        return_members is True)
+        """
+        if dFs is None:
+            if dF_distribution is None:
+                raise ValueError('Pass the dF of each member or a dF_distribution to draw them from')
+            dFs = dF_distribution.rvs(size=n_members, random_state=random_state)
+        dFs = np.atleast_1d(np.asarray(dFs, dtype=float))
+
+        outs = self.get_flux_for_times([dt]*dFs.size, hemi=hemi, combine_hemispheres=combine_hemispheres,
+                                       dFs=dFs)
+        ensemble_outs = ()
+        for i_hemi in range(len(outs)//3):
+            grid_mlats, grid_mlts, members = outs[3*i_hemi:3*i_hemi+3]
+            ensemble = OrderedDict()
+            ensemble['dF'] = dFs
+            ensemble['mean'] = np.mean(members, axis=0)
+            ensemble['std'] = np.std(members, axis=0)
+            ensemble['percentiles'] = OrderedDict(zip(percentiles,
+                                                      ovation_kernels.sorted_percentiles(members, percentiles)))
+            if return_members:
+                ensemble['members'] = members
+            ensemble_outs += (grid_mlats, grid_mlts, ensemble)
+        return ensemble_outs
 
 class SeasonalFluxEstimator(object):
     """
@@ -551,8 +1324,10 @@ class SeasonalFluxEstimator(object):
     """
 
     _valid_atypes = ['diff', 'mono', 'wave','ions']
-    
-    def __init__(self, season, atype, energy_or_number):
+    coefficient_names = ['b1a', 'b2a', 'b1p', 'b2p', 'prob']
+
+    def __init__(self, season, atype, energy_or_number, backend=None, coefficients=None, coarsen=None,
+                 active_bins=None):
         """
         season - str,['winter','spring','summer','fall']
             season for which to load regression coeffients
@@ -563,6 +1338,31 @@ class SeasonalFluxEstimator(object):
 
         energy_or_number - str, ['energy','number']
             type of flux you want to estimate
+
+        backend - str, ['python','numpy','numba'], optional
+            how to evaluate the regressions over the grid (see
+            ovation_kernels), None uses the default backend
+
+        coefficients - dict, optional
+            Already loaded coefficient arrays (keys are coefficient_names,
+            e.g. views of shared memory, see ovation_sharedmem) to use
+            instead of reading the coefficient files. Packed active bins
+            (keys 'active_'+ActiveBins.table_names) are used if present.
+
+        active_bins - bool, optional
+            whether the numpy and numba backends evaluate only the bins
+            which can have flux (see ovation_kernels.ActiveBins). The
+            packed tables are extra memory, so by default (None) they
+            are only made if enough bins are inactive to pay off (see
+            ovation_kernels.min_inactive_fraction)
+
+        coarsen - tuple, optional
+            (n_mlat, n_mlt) native bins averaged into each bin of the
+            output grids, e.g. (2, 4) for about 1 degree by 1 hour (for
+            quick looks). The flux grids for a range of dF values are
+            averaged onto the coarse grid (area weighted, see coarsen_grid)
+            when the estimator is created, and get_gridded_flux
+            interpolates between them in dF.
         """
 
         nmlt = 96   #number of mag local times in arrays (resolution of 15 minutes)
@@ -579,18 +1379,147 @@ class SeasonalFluxEstimator(object):
         #Check for legacy values of this argument
         _check_for_old_jtype(self,energy_or_number)
 
+        self.season = season
         self.energy_or_number = energy_or_number
+        self.backend = backend
 
         #The mlat bins are orgainized like -50:-dlat:-90, 50:dlat:90
-        self.mlats = np.concatenate([np.linspace(-90., -50., self.n_mlat_bins//2)[::-1],
-                                     np.linspace(50., 90., self.n_mlat_bins//2)])
-
-        self.mlts = np.linspace(0., 24., self.n_mlt_bins)
+        self.mlats, self.mlts = _table_mlats_mlts()
 
         #Determine file names
         file_suffix = '_n' if energy_or_number=='number' else ''
         self.afile = os.path.join(ovation_datadir, 'premodel/{0}_{1}{2}.txt'.format(season, atype, file_suffix))
         self.pfile = os.path.join(ovation_datadir, 'premodel/{0}_prob_b_{1}.txt'.format(season, atype))
+        if coefficients is None:
+            coefficients = self.read_coefficients()
+        self.b1a, self.b2a, self.b1p, self.b2p, self.prob = [coefficients[name]
+                                                             for name in self.coefficient_names]
+        for coeffs in [self.b1a, self.b2a, self.b1p, self.b2p]:
+            if coeffs.shape != (nmlt, nmlat):
+                raise ValueError('Coefficient arrays must have shape {0}'.format((nmlt, nmlat)))
+        if self.prob.shape != (nmlt, nmlat, ndF):
+            raise ValueError('Probability array must have shape {0}'.format((nmlt, nmlat, ndF)))
+
+        #The coefficients never change after loading, making them read-only
+        #means one estimator can safely be shared between threads
+        for coeffs in [self.b1a, self.b2a, self.b1p, self.b2p, self.prob]:
+            coeffs.flags.writeable = False
+
+        #Bins which can have flux, the only ones the numpy and numba backends evaluate
+        use_prob = self.atype != 'ions'
+        active_names = ['active_'+name for name in ovation_kernels.ActiveBins.table_names]
+        if active_bins is not False and all(name in coefficients for name in active_names):
+            self.active_bins = ovation_kernels.ActiveBins({name[len('active_'):]: coefficients[name]
+                                                           for name in active_names}, use_prob)
+        elif active_bins is False:
+            self.active_bins = None
+        else:
+            mask = ovation_kernels.active_bins_mask(self.b1a, self.b2a, self.b1p, self.b2p, self.prob, use_prob)
+            log.debug('{0} {1} {2}: {3} of {4} bins active'.format(season, atype, energy_or_number,
+                                                                   np.count_nonzero(mask), mask.size))
+            if active_bins or ovation_kernels.packing_pays_off(mask):
+                self.active_bins = ovation_kernels.ActiveBins.pack(self.b1a, self.b2a, self.b1p, self.b2p,
+                                                                   self.prob, use_prob, mask=mask)
+            else:
+                self.active_bins = None
+
+        self._scratch = _ScratchBuffers()
+        self.coarsen = None if coarsen is None else tuple(coarsen)
+        if self.coarsen is not None:
+            self._coarse_tables = self._coarse_flux_tables()
+
+    def coefficient_tables(self):
+        """
+        The arrays held for the estimator's lifetime: the regression
+        coefficients and probabilities, their packed active bins (if
+        any), and the coarse grid flux tables
+        """
+        tables = OrderedDict([(name, getattr(self, name)) for name in self.coefficient_names])
+        if self.active_bins is not None:
+            for name, table in self.active_bins.tables().items():
+                tables['active_'+name] = table
+        if self.coarsen is not None:
+            dF_nodes, tablesN, tablesS = self._coarse_tables
+            tables['coarse_tablesN'] = tablesN
+            tables['coarse_tablesS'] = tablesS
+        return tables
+
+    def _native_grids(self):
+        """mlatgridN, mltgridN, mlatgridS, mltgridS of the native grid"""
+        return model_grids()
+
+    def output_grids(self):
+        """
+        mlatgridN, mltgridN, mlatgridS, mltgridS of the flux grids (read-only,
+        see model_grids)
+        """
+        return model_grids(self.coarsen)
+
+    def coarse_dF_nodes(self):
+        """
+        dF values of the coarse grid flux tables, spaced at 1/8 of a
+        probability table dF bin up to the last bin, 1/2 of a bin up to 4
+        times that (beyond it the native grid is computed and averaged)
+        """
+        dFstep = 4421./8.
+        last_bin = self.n_dF_bins*dFstep
+        return np.concatenate([np.arange(0., last_bin, dFstep/8.),
+                               np.arange(last_bin, 4.*last_bin+dFstep/4., dFstep/2.)])
+
+    def _coarse_flux_tables(self):
+        """Coarse grid fluxes (wedge interpolated) for each of coarse_dF_nodes"""
+        dF_nodes = self.coarse_dF_nodes()
+        outs = self._native_gridded_flux_for_dFs(dF_nodes, interp_N=True)
+        row_mlats = self.mlats[self.n_mlat_bins//2:]
+        tablesN = coarsen_grid(outs[2], row_mlats, self.coarsen)
+        tablesS = coarsen_grid(outs[5], row_mlats, self.coarsen)
+        for tables in [tablesN, tablesS]:
+            tables.flags.writeable = False
+        return dF_nodes, tablesN, tablesS
+
+    def _coarse_fluxes(self, dFs, interp_N, return_inwedge, backend, out=None):
+        """
+        Coarse northern and southern flux grids (n, nmlat, nmlt) for an
+        array of dF values (written into out if it is passed) and the
+        coarse bins containing any wedge interpolated native bins (None
+        unless return_inwedge)
+        """
+        dF_nodes, tablesN, tablesS = self._coarse_tables
+        if out is None:
+            out = (np.empty((dFs.size,)+tablesN.shape[1:]), np.empty((dFs.size,)+tablesS.shape[1:]))
+        fluxgridsN, fluxgridsS = out
+        inwedges = np.zeros((dFs.size,)+tablesN.shape[1:], dtype=bool) if return_inwedge else None
+
+        #The tables are made with the wedge interpolation and do not
+        #record where it was done
+        tabulated = np.logical_and(dFs >= dF_nodes[0], dFs <= dF_nodes[-1])
+        if not interp_N or return_inwedge:
+            tabulated[:] = False
+
+        if np.any(tabulated):
+            i_node = np.clip(np.searchsorted(dF_nodes, dFs[tabulated], side='right')-1, 0, dF_nodes.size-2)
+            w = (dFs[tabulated]-dF_nodes[i_node])/(dF_nodes[i_node+1]-dF_nodes[i_node])
+            w = w.reshape(-1, 1, 1)
+            fluxgridsN[tabulated] = (1.-w)*tablesN[i_node]+w*tablesN[i_node+1]
+            fluxgridsS[tabulated] = (1.-w)*tablesS[i_node]+w*tablesS[i_node+1]
+
+        row_mlats = self.mlats[self.n_mlat_bins//2:]
+        for i_dF in np.flatnonzero(~tabulated):
+            outs = self._native_gridded_flux(dFs[i_dF], interp_N=interp_N, return_inwedge=True, backend=backend)
+            fluxgridsN[i_dF] = coarsen_grid(outs[2], row_mlats, self.coarsen)
+            fluxgridsS[i_dF] = coarsen_grid(outs[5], row_mlats, self.coarsen)
+            if return_inwedge:
+                inwedges[i_dF] = coarsen_grid(outs[6].astype(float), row_mlats, self.coarsen) > 0.
+        return fluxgridsN, fluxgridsS, inwedges
+
+    def read_coefficients(self):
+        """
+        Read the regression coefficients from the afile and pfile
+        text files, returns an OrderedDict of arrays (keys are
+        coefficient_names)
+        """
+        nmlt, nmlat, ndF = self.n_mlt_bins, self.n_mlat_bins, self.n_dF_bins
+
         #Defualt values of header (don't know why need yet)
         # b1 = 0.
         # b2 = 0.
@@ -605,22 +1534,24 @@ class SeasonalFluxEstimator(object):
             aheader = f.readline() # y0,d0,yend,dend,files_done,sf0
             #print "Read Auroral Flux Coefficient File %s,\n Header: %s" % (self.afile,aheader)
             # Don't know if it will read from where f pointer is after reading header line
-            adata = np.genfromtxt(f, max_rows=nmlat*nmlt)
+            #loadtxt parses straight into the array, genfromtxt's per-row
+            #temporaries peaked at ~20 times the size of the tables
+            adata = np.loadtxt(f, max_rows=nmlat*nmlt)
             #print "First line was %s" % (str(adata[0,:]))
 
         #These are the coefficients for each bin which are used
         #in the predicted flux calulation for electron auroral types
         #and for ions
-        self.b1a, self.b2a = np.zeros((nmlt, nmlat)), np.zeros((nmlt, nmlat))
-        self.b1a.fill(np.nan)
-        self.b2a.fill(np.nan)
+        b1a, b2a = np.zeros((nmlt, nmlat)), np.zeros((nmlt, nmlat))
+        b1a.fill(np.nan)
+        b2a.fill(np.nan)
         mlt_bin_inds, mlat_bin_inds = adata[:, 0].astype(int), adata[:, 1].astype(int)
-        self.b1a[mlt_bin_inds, mlat_bin_inds] = adata[:, 2]
-        self.b2a[mlt_bin_inds, mlat_bin_inds] = adata[:, 3]
+        b1a[mlt_bin_inds, mlat_bin_inds] = adata[:, 2]
+        b2a[mlt_bin_inds, mlat_bin_inds] = adata[:, 3]
 
-        self.b1p = np.full((nmlt, nmlat),np.nan)
-        self.b2p = np.full((nmlt, nmlat),np.nan)
-        self.prob = np.full((nmlt, nmlat, ndF),np.nan)
+        b1p = np.full((nmlt, nmlat),np.nan)
+        b2p = np.full((nmlt, nmlat),np.nan)
+        prob = np.full((nmlt, nmlat, ndF),np.nan)
         
         #pdata has 2 columns, b1, b2 for first 15361 rows
         #pdata has nmlat*nmlt rows (one for each positional bin)
@@ -628,23 +1559,23 @@ class SeasonalFluxEstimator(object):
         #Electron auroral types also include a probability in their
         #predicted flux calculations (related to the probability of
         #observing one type of aurora versus another)
-        if atype in ['diff', 'mono', 'wave']:
+        if self.atype in ['diff', 'mono', 'wave']:
             with open(self.pfile, 'r') as f:
                 pheader = f.readline() #y0,d0,yend,dend,files_done,sf0
                 # Don't know if it will read from where f pointer is after reading header line
-                pdata_b = np.genfromtxt(f, max_rows=nmlt*nmlat) # 2 columns, b1 and b2
+                pdata_b = np.loadtxt(f, max_rows=nmlt*nmlat) # 2 columns, b1 and b2
                 #print "Shape of b1p,b2p should be nmlt*nmlat=%d, is %s" % (nmlt*nmlat,len(pdata_b[:,0]))
-                pdata_p = np.genfromtxt(f, max_rows=nmlt*nmlat*ndF) # 1 column, pval
+                pdata_p = np.loadtxt(f, max_rows=nmlt*nmlat*ndF) # 1 column, pval
 
             #in the file the probability is stored with coupling strength bin
             #varying fastest (this is Fortran indexing order)
             pdata_p_column_dFbin = pdata_p.reshape((-1, ndF), order='F')
 
             #mlt is first dimension
-            self.b1p[mlt_bin_inds, mlat_bin_inds]=pdata_b[:, 0]
-            self.b2p[mlt_bin_inds, mlat_bin_inds]=pdata_b[:, 1]
+            b1p[mlt_bin_inds, mlat_bin_inds]=pdata_b[:, 0]
+            b2p[mlt_bin_inds, mlat_bin_inds]=pdata_b[:, 1]
             for idF in range(ndF):
-                self.prob[mlt_bin_inds, mlat_bin_inds, idF]=pdata_p_column_dFbin[:, idF]
+                prob[mlt_bin_inds, mlat_bin_inds, idF]=pdata_p_column_dFbin[:, idF]
 
         #IDL original read
         #readf,20,i,j,b1,b2,rF
@@ -653,6 +1584,8 @@ class SeasonalFluxEstimator(object):
         #adata has 5 columns, mlt bin number, mlat bin number, b1, b2, rF
         #adata has nmlat*nmlt rows (one for each positional bin)
 
+        return OrderedDict(zip(self.coefficient_names, [b1a, b2a, b1p, b2p, prob]))
+
     def which_dF_bin(self, dF):
         """
         Given a coupling strength value, finds the bin it falls into
@@ -727,7 +1660,7 @@ class SeasonalFluxEstimator(object):
         if flux < 0.:
             flux = 0.
 
-        if self.atype is not 'ions':
+        if self.atype != 'ions':
             #Electron Energy Flux
             if fluxtype == 'energy':
                 if flux > 10.:
@@ -757,7 +1690,9 @@ class SeasonalFluxEstimator(object):
                     flux = 0.
         return flux
 
-    def get_gridded_flux(self, dF, combined_N_and_S=False, interp_N=True):
+    @timed('get_gridded_flux')
+    def get_gridded_flux(self, dF, combined_N_and_S=False, interp_N=True, return_inwedge=False,
+                         backend=None, out=None):
         """
         Return the flux interpolated onto arbitary locations
         in mlats and mlts
@@ -773,34 +1708,142 @@ class SeasonalFluxEstimator(object):
         interp_N, bool, optional
             Interpolate flux linearly for each latitude ring in the wedge
             of low coverage in northern hemisphere dawn/midnight region
+
+        return_inwedge, bool, optional
+            Also return the boolean grid of northern hemisphere bins which
+            were filled by the wedge interpolation (as the last output).
+            Nothing about the call is stored on the estimator, so
+            it can be shared between threads
+
+        backend - str, ['python','numpy','numba'], optional
+            overrides the estimator's backend for this call. 'python'
+            is the per-bin reference implementation
+
+        out - tuple, optional
+            (fluxgridN, fluxgridS) arrays (nmlat, nmlt) to write the flux
+            into instead of new arrays (with combined_N_and_S the average
+            is written into fluxgridN)
+
+        If the estimator was made with coarsen, the grids are the coarse
+        grids (return_inwedge or interp_N=False compute the native grids
+        and average them). The grid coordinates are read-only and shared
+        (see model_grids).
         """
+        if self.coarsen is None:
+            return self._native_gridded_flux(dF, combined_N_and_S=combined_N_and_S, interp_N=interp_N,
+                                             return_inwedge=return_inwedge, backend=backend, out=out)
+
+        mlatgridN, mltgridN, mlatgridS, mltgridS = self.output_grids()
+        if out is not None:
+            out = (out[0][np.newaxis], out[1][np.newaxis])
+        fluxgridsN, fluxgridsS, inwedges = self._coarse_fluxes(np.array([dF], dtype=float), interp_N,
+                                                               return_inwedge, backend, out=out)
+        fluxgridN, fluxgridS = fluxgridsN[0], fluxgridsS[0]
+        if not combined_N_and_S:
+            outs = (mlatgridN, mltgridN, fluxgridN, mlatgridS, mltgridS, fluxgridS)
+        else:
+            fluxgridN += fluxgridS
+            fluxgridN /= 2.
+            outs = (mlatgridN, mltgridN, fluxgridN)
+
+        if return_inwedge:
+            outs = outs + (inwedges[0],)
+        return outs
+
+    def _native_gridded_flux(self, dF, combined_N_and_S=False, interp_N=True, return_inwedge=False,
+                             backend=None, out=None):
+        """get_gridded_flux on the native grid"""
+        backend = ovation_kernels.resolve_backend(self.backend if backend is None else backend)
+
+        mlatgridN, mltgridN, mlatgridS, mltgridS = self._native_grids()
+        #Every bin is written below
+        if out is None:
+            out = (np.empty(mlatgridN.shape), np.empty(mlatgridS.shape))
+        fluxgridN, fluxgridS = out
+
+        if backend == 'python':
+            for i_mlt in range(self.n_mlt_bins):
+                for j_mlat in range(self.n_mlat_bins//2):
+                    #The mlat bins are orgainized like -50:-dlat:-90,50:dlat:90
+                    fluxgridN[j_mlat, i_mlt] = self.estimate_auroral_flux(dF, i_mlt, self.n_mlat_bins//2+j_mlat)
+                    fluxgridS[j_mlat, i_mlt] = self.estimate_auroral_flux(dF, i_mlt, j_mlat)
+        else:
+            ovation_kernels.regression_flux(backend, dF, self.b1a, self.b2a, self.b1p, self.b2p,
+                                            self.prob, self.atype != 'ions',
+                                            ovation_kernels.correction_limits(self.atype, self.energy_or_number),
+                                            out=(fluxgridN, fluxgridS), active=self.active_bins)
+
+        if not interp_N:
+            inwedge = np.zeros(fluxgridN.shape, dtype=bool) if return_inwedge else None
+        elif backend == 'python':
+            fluxgridN, inwedge = self.interp_wedge(mlatgridN, mltgridN, fluxgridN)
+        else:
+            #Reused between calls unless it is returned
+            inwedge = None if return_inwedge else self._scratch.get('inwedge', fluxgridN.shape, dtype=bool)
+            with stage('interp_wedge'):
+                inwedge = ovation_kernels.interp_wedge(backend, mlatgridN[:, 0], mltgridN[0, :], fluxgridN,
+                                                       inwedge=inwedge)
+
+        if not combined_N_and_S:
+            outs = (mlatgridN, mltgridN, fluxgridN, mlatgridS, mltgridS, fluxgridS)
+        else:
+            #In place, (fluxgridN+fluxgridS)/2. without a temporary array
+            fluxgridN += fluxgridS
+            fluxgridN /= 2.
+            outs = (mlatgridN, mltgridN, fluxgridN)
 
-        fluxgridN = np.zeros((self.n_mlat_bins//2, self.n_mlt_bins))
-        fluxgridN.fill(np.nan)
-        #Make grid coordinates
-        mlatgridN, mltgridN = np.meshgrid(self.mlats[self.n_mlat_bins//2:], self.mlts, indexing='ij')
+        if return_inwedge:
+            outs = outs + (inwedge,)
+        return outs
 
-        fluxgridS = np.zeros((self.n_mlat_bins//2, self.n_mlt_bins))
-        fluxgridS.fill(np.nan)
-        #Make grid coordinates
-        mlatgridS, mltgridS = np.meshgrid(self.mlats[:self.n_mlat_bins//2], self.mlts, indexing='ij')
-        #print(self.mlats[:self.n_mlat_bins//2])
+    @timed('get_gridded_flux_for_dFs')
+    def get_gridded_flux_for_dFs(self, dFs, interp_N=True, backend=None):
+        """
+        get_gridded_flux (separate hemispheres) for many values of the
+        Newell coupling at once
 
-        for i_mlt in range(self.n_mlt_bins):
-            for j_mlat in range(self.n_mlat_bins//2):
-                #The mlat bins are orgainized like -50:-dlat:-90,50:dlat:90
-                fluxgridN[j_mlat, i_mlt] = self.estimate_auroral_flux(dF, i_mlt, self.n_mlat_bins//2+j_mlat)
-                fluxgridS[j_mlat, i_mlt] = self.estimate_auroral_flux(dF, i_mlt, j_mlat)
+        dFs - np.ndarray (n,)
+            Newell coupling values
 
-        if interp_N:
-            fluxgridN, inwedge = self.interp_wedge(mlatgridN, mltgridN, fluxgridN)
-            self.inwedge = inwedge
+        interp_N, backend - see get_gridded_flux
 
-        if not combined_N_and_S:
-            return mlatgridN, mltgridN, fluxgridN, mlatgridS, mltgridS, fluxgridS
+        Returns (mlatgridN, mltgridN, fluxgridsN, mlatgridS, mltgridS, fluxgridsS)
+        where the flux grids have shape (n, nmlat, nmlt)
+        """
+        dFs = np.atleast_1d(np.asarray(dFs, dtype=float))
+        if self.coarsen is None:
+            return self._native_gridded_flux_for_dFs(dFs, interp_N=interp_N, backend=backend)
+
+        mlatgridN, mltgridN, mlatgridS, mltgridS = self.output_grids()
+        fluxgridsN, fluxgridsS, _ = self._coarse_fluxes(dFs, interp_N, False, backend)
+        return mlatgridN, mltgridN, fluxgridsN, mlatgridS, mltgridS, fluxgridsS
+
+    def _native_gridded_flux_for_dFs(self, dFs, interp_N=True, backend=None):
+        """get_gridded_flux_for_dFs on the native grid"""
+        backend = ovation_kernels.resolve_backend(self.backend if backend is None else backend)
+
+        mlatgridN, mltgridN, mlatgridS, mltgridS = self._native_grids()
+        fluxgridsN = np.empty((dFs.size,)+mlatgridN.shape)
+        fluxgridsS = np.empty((dFs.size,)+mlatgridS.shape)
+
+        if backend == 'python':
+            for i_dF, dF in enumerate(dFs):
+                flux_outs = self._native_gridded_flux(dF, interp_N=interp_N, backend=backend)
+                fluxgridsN[i_dF], fluxgridsS[i_dF] = flux_outs[2], flux_outs[5]
         else:
-            return mlatgridN, mltgridN, (fluxgridN+fluxgridS)/2.
-
+            ovation_kernels.regression_flux_for_dFs(backend, dFs, self.b1a, self.b2a, self.b1p, self.b2p,
+                                                    self.prob, self.atype != 'ions',
+                                                    ovation_kernels.correction_limits(self.atype,
+                                                                                      self.energy_or_number),
+                                                    out=(fluxgridsN, fluxgridsS), active=self.active_bins)
+            if interp_N:
+                #Which bins are in the wedge depends on the flux of each grid
+                with stage('interp_wedge'):
+                    ovation_kernels.interp_wedge_for_grids(backend, mlatgridN[:, 0], mltgridN[0, :], fluxgridsN)
+
+        return mlatgridN, mltgridN, fluxgridsN, mlatgridS, mltgridS, fluxgridsS
+
+    @timed('interp_wedge')
     def interp_wedge(self, mlatgridN, mltgridN, fluxgridN):
         """
         Interpolates across the wedge shaped data gap
@@ -0,0 +1,222 @@
+"""
+Per-stage timing instrumentation for the model routines
+
+Stages of the model (solar wind averaging, seasonal grid evaluation,
+wedge interpolation, bin correction, coordinate conversion, solar
+conductance) are marked with the timed decorator or the stage context
+manager. When profiling is off these only check a module level flag,
+when it is on the wall time and number of calls for each stage are
+accumulated (from all threads).
+
+Turn profiling on with the OVATIONPYME_PROFILE environment variable
+(the accumulated report is logged at exit) or for a block of code:
+
+    with ovation_profiling.profiling() as stats:
+        estimator.get_conductance(dt)
+    print(stats['interp_wedge']['total_s'])
+
+Memory use can be measured the same way. memory_profiling reports the
+memory allocated in a block (with tracemalloc, including NumPy arrays)
+which is still held at its end and the peak during it, table_memory
+accounts for the coefficient tables an estimator holds:
+
+    with ovation_profiling.memory_profiling() as memory:
+        estimator = ConductanceEstimator(fluxtypes=['diff', 'mono'])
+    print(memory['current_bytes'], memory['peak_bytes'])
+    print(ovation_profiling.table_memory(estimator))
+
+scripts/benchmark_memory.py reports these (and the peak resident set
+size) for the estimator types.
+"""
+import os
+import sys
+import time
+import atexit
+import tracemalloc
+import functools
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from logbook import Logger
+log = Logger('OvationPyme.ovation_profiling')
+
+_enabled = os.environ.get('OVATIONPYME_PROFILE', '').lower() in ['1', 'true', 'yes', 'on']
+_stats_lock = threading.Lock()
+_stats = {}
+
+def is_enabled():
+    return _enabled
+
+def enable():
+    global _enabled
+    _enabled = True
+
+def disable():
+    global _enabled
+    _enabled = False
+
+def reset():
+    """Forget all accumulated timings"""
+    with _stats_lock:
+        _stats.clear()
+
+def _record(name, elapsed):
+    with _stats_lock:
+        stat = _stats.get(name)
+        if stat is None:
+            _stats[name] = [1, elapsed, elapsed]
+        else:
+            stat[0] += 1
+            stat[1] += elapsed
+            if elapsed > stat[2]:
+                stat[2] = elapsed
+
+class stage(object):
+    """
+    Context manager which times a block of code as the stage name
+    (if profiling is enabled when the block is entered)
+    """
+    __slots__ = ('name', 't0')
+
+    def __init__(self, name):
+        self.name = name
+        self.t0 = None
+
+    def __enter__(self):
+        if _enabled:
+            self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.t0 is not None:
+            _record(self.name, time.perf_counter()-self.t0)
+            self.t0 = None
+        return False
+
+def timed(name):
+    """Decorator which times every call of a function as stage name"""
+    def timed_decorator(func):
+        @functools.wraps(func)
+        def timed_wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            t0 = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                _record(name, time.perf_counter()-t0)
+        return timed_wrapper
+    return timed_decorator
+
+def report():
+    """
+    Accumulated timings as an OrderedDict of stage name ->
+    OrderedDict(calls, total_s, mean_s, max_s), largest total time first
+    """
+    with _stats_lock:
+        items = [(name, list(stat)) for name, stat in _stats.items()]
+    items.sort(key=lambda item: item[1][1], reverse=True)
+    stats = OrderedDict()
+    for name, (calls, total, longest) in items:
+        stats[name] = OrderedDict([('calls', calls),
+                                   ('total_s', total),
+                                   ('mean_s', total/calls),
+                                   ('max_s', longest)])
+    return stats
+
+def format_report(stats=None):
+    """Text table of a report (the current one by default)"""
+    stats = report() if stats is None else stats
+    lines = ['{0:<24s}{1:>8s}{2:>12s}{3:>12s}{4:>12s}'.format('stage', 'calls', 'total [s]',
+                                                            'mean [s]', 'max [s]')]
+    for name, stat in stats.items():
+        lines.append('{0:<24s}{1:>8d}{2:>12.4f}{3:>12.6f}{4:>12.6f}'.format(name, stat['calls'],
+                                                                          stat['total_s'],
+                                                                          stat['mean_s'],
+                                                                          stat['max_s']))
+    return '\n'.join(lines)
+
+def log_report(logger=None, stats=None):
+    """Log the report (the current one by default) at notice level"""
+    logger = log if logger is None else logger
+    logger.notice('Ovation Prime stage timings:\n{0}'.format(format_report(stats)))
+
+@contextmanager
+def profiling(reset_stats=True, log_on_exit=False):
+    """
+    Enable profiling for a block. Yields a dict which is filled with
+    the report when the block exits. Profiling is restored to its
+    previous state afterwards
+    """
+    global _enabled
+    was_enabled = _enabled
+    if reset_stats:
+        reset()
+    stats = OrderedDict()
+    _enabled = True
+    try:
+        yield stats
+    finally:
+        _enabled = was_enabled
+        stats.update(report())
+        if log_on_exit:
+            log_report(stats=stats)
+
+@contextmanager
+def memory_profiling():
+    """
+    Traces Python (and NumPy) memory allocation in a block. Yields a
+    dict which is filled when the block exits with current_bytes (memory
+    allocated in the block and still held, e.g. loaded tables) and
+    peak_bytes (the most allocated at once during the block, including
+    temporaries), both relative to the start of the block. Tracing slows
+    allocation down, so do not combine it with timing.
+    """
+    was_tracing = tracemalloc.is_tracing()
+    if not was_tracing:
+        tracemalloc.start()
+    tracemalloc.reset_peak()
+    start_bytes = tracemalloc.get_traced_memory()[0]
+    memory = OrderedDict()
+    try:
+        yield memory
+    finally:
+        current_bytes, peak_bytes = tracemalloc.get_traced_memory()
+        if not was_tracing:
+            tracemalloc.stop()
+        memory['current_bytes'] = current_bytes-start_bytes
+        memory['peak_bytes'] = peak_bytes-start_bytes
+
+def peak_rss_bytes():
+    """
+    Peak resident set size of this process so far (the operating
+    system's high water mark, which never decreases, so measure each
+    configuration in a new process)
+    """
+    import resource
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    #kilobytes on Linux, bytes on macOS
+    return maxrss if sys.platform == 'darwin' else maxrss*1024
+
+def table_memory(estimator):
+    """
+    Bytes of each coefficient table an estimator (SeasonalFluxEstimator,
+    FluxEstimator, AverageEnergyEstimator or ConductanceEstimator) holds,
+    as an OrderedDict keyed as its coefficient_tables. Tables shared with
+    an earlier key (e.g. the number flux estimator a ConductanceEstimator
+    and its AverageEnergyEstimator both use) are counted once, so the
+    values sum to the memory the tables take.
+    """
+    memory = OrderedDict()
+    seen = set()
+    for key, table in estimator.coefficient_tables().items():
+        address = (table.__array_interface__['data'][0], table.nbytes)
+        if address in seen:
+            continue
+        seen.add(address)
+        memory[key] = table.nbytes
+    return memory
+
+if _enabled:
+    atexit.register(log_report)
@@ -0,0 +1,411 @@
+"""
+Reanalysis runs spread over many nodes with a shared filesystem work queue
+
+A coordinator splits the time range into work units (unit_size
+consecutive times) in a queue directory on a filesystem every node can
+see. Workers on any node claim units, evaluate the flux and conductance
+grids for their times with the batched estimator methods and write one
+output file per unit. A final step consolidates the outputs into one
+array per variable. No external services are needed:
+
+    python -m ovationpyme.ovation_reanalysis create /shared/run 2008-12-01 2019-12-01 \\
+        --step-minutes 60 --unit-size 168 --fluxes diff:energy,mono:energy --conductance \\
+        --index-archive /shared/drivers.npz
+    python -m ovationpyme.ovation_reanalysis work /shared/run      #on each node, as many as wanted
+    python -m ovationpyme.ovation_reanalysis status /shared/run
+    python -m ovationpyme.ovation_reanalysis consolidate /shared/run /shared/run_output
+
+Queue directory layout:
+
+    config.json                  the run (times, products, drivers)
+    pending/unit_000012          units nobody has claimed
+    claimed/unit_000012@worker   claimed units (the claim's modification
+                                 time is refreshed while the unit runs)
+    outputs/unit_000012.npz      the unit's grids, dF and F10.7
+    done/unit_000012             completion markers
+
+A unit is claimed by renaming its pending file, which only one worker can
+do. Outputs are written to a temporary file and renamed into place, and
+the completion marker is written after the output, so a unit is either
+done with complete output or not done. Running a unit twice (e.g. after
+requeue_stale gives back the units of a worker which died) writes the
+same output again, so completion is idempotent.
+
+The consolidated output is a directory of .npy files (time, dF, f107,
+mlat_N/mlat_S, mlt and one (ntime, nmlat, nmlt) array per product and
+hemisphere) which can be opened with np.load(..., mmap_mode='r') without
+reading them into memory.
+"""
+import os
+import json
+import time
+import socket
+import argparse
+import datetime
+from collections import OrderedDict
+
+import numpy as np
+
+from ovationpyme import ovation_utilities
+from ovationpyme.ovation_prime import FluxEstimator, AverageEnergyEstimator, ConductanceEstimator
+from ovationpyme.ovation_indices import IndexArchive
+from ovationpyme.ovation_timeseries import _chunk_drivers
+
+from logbook import Logger
+log = Logger('OvationPyme.ovation_reanalysis')
+
+_datetime_format = '%Y-%m-%dT%H:%M:%S'
+
+def default_worker_id():
+    """hostname-pid, unique among the workers of a run"""
+    return '{0}-{1}'.format(socket.gethostname(), os.getpid())
+
+def _write_atomic(filename, write):
+    """Calls write(file) on a temporary file then renames it to filename"""
+    tmp_filename = '{0}.{1}.tmp'.format(filename, default_worker_id())
+    with open(tmp_filename, 'wb') as f:
+        write(f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_filename, filename)
+
+class WorkQueue(object):
+    """
+    Queue of numbered work units in a (shared) directory, see the module
+    docstring for the layout
+    """
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, 'config.json')) as f:
+            self.config = json.load(f)
+        self.n_units = self.config['n_units']
+
+    @classmethod
+    def create(cls, directory, n_units, config=None):
+        """Makes a queue of n_units pending units, config is stored with it"""
+        if os.path.exists(os.path.join(directory, 'config.json')):
+            raise RuntimeError('A queue already exists in {0}'.format(directory))
+        for subdirectory in ['pending', 'claimed', 'outputs', 'done']:
+            os.makedirs(os.path.join(directory, subdirectory), exist_ok=True)
+        for i_unit in range(n_units):
+            open(os.path.join(directory, 'pending', cls.unit_name(i_unit)), 'w').close()
+        config = OrderedDict() if config is None else OrderedDict(config)
+        config['n_units'] = n_units
+        _write_atomic(os.path.join(directory, 'config.json'),
+                      lambda f: f.write(json.dumps(config, indent=2).encode('utf-8')))
+        return cls(directory)
+
+    @staticmethod
+    def unit_name(i_unit):
+        return 'unit_{0:06d}'.format(i_unit)
+
+    def _path(self, subdirectory, name):
+        return os.path.join(self.directory, subdirectory, name)
+
+    def output_filename(self, i_unit):
+        return self._path('outputs', self.unit_name(i_unit)+'.npz')
+
+    def claim_filename(self, i_unit, worker_id):
+        return self._path('claimed', '{0}@{1}'.format(self.unit_name(i_unit), worker_id))
+
+    def is_done(self, i_unit):
+        return os.path.exists(self._path('done', self.unit_name(i_unit)))
+
+    def claim(self, worker_id):
+        """Claims a pending unit, returns its number (None if none are left)"""
+        for name in sorted(os.listdir(os.path.join(self.directory, 'pending'))):
+            i_unit = int(name.split('_')[1])
+            try:
+                os.rename(self._path('pending', name), self.claim_filename(i_unit, worker_id))
+            except (FileNotFoundError, PermissionError):
+                #Another worker claimed it first
+                continue
+            return i_unit
+        return None
+
+    def heartbeat(self, i_unit, worker_id):
+        """Marks a claim as still being worked on (see requeue_stale)"""
+        try:
+            os.utime(self.claim_filename(i_unit, worker_id))
+        except FileNotFoundError:
+            log.warning('Claim of unit {0} by {1} was requeued'.format(i_unit, worker_id))
+
+    def complete(self, i_unit, worker_id):
+        """Marks a unit done (after its output is written) and drops the claim"""
+        _write_atomic(self._path('done', self.unit_name(i_unit)), lambda f: None)
+        try:
+            os.remove(self.claim_filename(i_unit, worker_id))
+        except FileNotFoundError:
+            pass
+
+    def requeue_stale(self, max_age_seconds):
+        """
+        Returns claims not refreshed for max_age_seconds (e.g. the worker
+        died) to pending, returns the numbers of the requeued units
+        """
+        requeued = []
+        now = time.time()
+        for name in sorted(os.listdir(os.path.join(self.directory, 'claimed'))):
+            unit_name, worker_id = name.split('@', 1)
+            i_unit = int(unit_name.split('_')[1])
+            try:
+                stale = now-os.path.getmtime(self._path('claimed', name)) > max_age_seconds
+                if self.is_done(i_unit):
+                    os.remove(self._path('claimed', name))
+                elif stale:
+                    os.rename(self._path('claimed', name), self._path('pending', unit_name))
+                    log.notice('Requeued unit {0} claimed by {1}'.format(i_unit, worker_id))
+                    requeued.append(i_unit)
+            except FileNotFoundError:
+                continue
+        return requeued
+
+    def status(self):
+        """Number of pending, claimed and done units"""
+        counts = OrderedDict()
+        for subdirectory in ['pending', 'claimed', 'done']:
+            counts[subdirectory] = len([name for name in os.listdir(os.path.join(self.directory, subdirectory))
+                                        if not name.endswith('.tmp')])
+        counts['total'] = self.n_units
+        return counts
+
+def create(directory, startdt, enddt, step, unit_size=168, fluxes=[('diff', 'energy')], conductance=False,
+           conductance_fluxtypes=['diff'], hemis=['N', 'S'], solarwind_cadence='1min', index_archive=None,
+           coarsen=None):
+    """
+    Makes the work queue of a reanalysis of the times
+    ovation_timeseries.time_range(startdt, enddt, step), unit_size times
+    per work unit
+
+    fluxes - list of (atype, energy_or_number)
+        flux products (named e.g. 'diff_energy_flux_N')
+
+    conductance - bool
+        also the Pedersen and Hall conductance ('sigp_N', 'sigh_N')
+        from the auroral types conductance_fluxtypes
+
+    index_archive - str, optional
+        IndexArchive file (on the shared filesystem) the workers take dF
+        and F10.7 from instead of reading OMNI data
+    """
+    for hemi in hemis:
+        if hemi not in ['N', 'S']:
+            raise ValueError('Invalid hemisphere {0} (use N or S)'.format(hemi))
+    n_times = int(np.ceil((enddt-startdt).total_seconds()/step.total_seconds()))
+    n_times = max(n_times, 0)
+    config = OrderedDict()
+    config['startdt'] = startdt.strftime(_datetime_format)
+    config['step_seconds'] = step.total_seconds()
+    config['n_times'] = n_times
+    config['unit_size'] = unit_size
+    config['fluxes'] = [list(flux) for flux in fluxes]
+    config['conductance'] = conductance
+    config['conductance_fluxtypes'] = list(conductance_fluxtypes)
+    config['hemis'] = list(hemis)
+    config['solarwind_cadence'] = solarwind_cadence
+    config['index_archive'] = None if index_archive is None else os.path.abspath(index_archive)
+    config['coarsen'] = None if coarsen is None else list(coarsen)
+    n_units = int(np.ceil(n_times/float(unit_size)))
+    log.info('Reanalysis of {0} times in {1} units in {2}'.format(n_times, n_units, directory))
+    return WorkQueue.create(directory, n_units, config)
+
+def unit_times(config, i_unit):
+    """Times of a work unit"""
+    startdt = datetime.datetime.strptime(config['startdt'], _datetime_format)
+    step = datetime.timedelta(seconds=config['step_seconds'])
+    i_first = i_unit*config['unit_size']
+    i_last = min(i_first+config['unit_size'], config['n_times'])
+    return [startdt+i_time*step for i_time in range(i_first, i_last)]
+
+class UnitEvaluator(object):
+    """
+    The estimators of a run (made once per worker and reused for all of
+    the units it runs)
+    """
+    def __init__(self, config):
+        self.config = config
+        self._estimators = {}
+        self.flux_estimators = OrderedDict([((atype, energy_or_number), self._flux_estimator(atype, energy_or_number))
+                                            for atype, energy_or_number in config['fluxes']])
+        self.conductance_estimator = None
+        if config['conductance']:
+            fluxtypes = config['conductance_fluxtypes']
+            #Sharing the flux estimators of the flux products
+            numflux_estimators = {atype: self._flux_estimator(atype, 'number') for atype in fluxtypes}
+            eavg_estimators = {atype: AverageEnergyEstimator(atype, numflux_estimator=numflux_estimators[atype],
+                                                             energyflux_estimator=self._flux_estimator(atype, 'energy'))
+                               for atype in fluxtypes}
+            self.conductance_estimator = ConductanceEstimator(fluxtypes=fluxtypes,
+                                                              numflux_estimators=numflux_estimators,
+                                                              eavg_estimators=eavg_estimators)
+
+    def _flux_estimator(self, atype, energy_or_number):
+        if (atype, energy_or_number) not in self._estimators:
+            estimator = FluxEstimator(atype, energy_or_number, coarsen=self.config['coarsen'],
+                                      solarwind_cadence=self.config['solarwind_cadence'])
+            self._estimators[(atype, energy_or_number)] = estimator.preload()
+        return self._estimators[(atype, energy_or_number)]
+
+    def __call__(self, dts, heartbeat=None):
+        """
+        OrderedDict of the unit's arrays (time, dF, f107, grids and the
+        grid coordinates). heartbeat is called between products.
+        """
+        config = self.config
+        hemis = config['hemis']
+        dFs, f107s = _chunk_drivers(dts, config['solarwind_cadence'], True)
+        outputs = OrderedDict()
+        outputs['time'] = np.array(dts, dtype='datetime64[s]')
+        outputs['dF'] = dFs
+        outputs['f107'] = f107s
+        flux_hemi = 'both' if len(hemis) == 2 else hemis[0]
+        for (atype, energy_or_number), estimator in self.flux_estimators.items():
+            outs = estimator.get_flux_for_times(dts, hemi=flux_hemi, dFs=dFs)
+            for i_hemi, hemi in enumerate(['N', 'S'] if flux_hemi == 'both' else hemis):
+                grid_mlats, grid_mlts, gridfluxes = outs[3*i_hemi:3*i_hemi+3]
+                outputs['mlat_'+hemi] = grid_mlats[:, 0]
+                outputs['mlt'] = grid_mlts[0, :]
+                outputs['{0}_{1}_flux_{2}'.format(atype, energy_or_number, hemi)] = gridfluxes
+            if heartbeat is not None:
+                heartbeat()
+        if self.conductance_estimator is not None:
+            for hemi in hemis:
+                outs = self.conductance_estimator.get_conductance_for_times(
+                    dts, hemi=hemi, conductance_fluxtypes=config['conductance_fluxtypes'],
+                    dFs=dFs, f107s=f107s)
+                outputs['mlat_'+hemi] = outs[0][:, 0]
+                outputs['mlt'] = outs[1][0, :]
+                outputs['sigp_'+hemi], outputs['sigh_'+hemi] = outs[2], outs[3]
+                if heartbeat is not None:
+                    heartbeat()
+        return outputs
+
+def run_worker(directory, worker_id=None, max_units=None, stale_seconds=None):
+    """
+    Claims and runs units of the queue in directory until none are left
+    (or max_units have been run), returns the numbers of the units run
+
+    stale_seconds - float, optional
+        before each claim, requeue units whose claims have not been
+        refreshed for this long (their workers died)
+    """
+    queue = WorkQueue(directory)
+    worker_id = default_worker_id() if worker_id is None else worker_id
+    if queue.config['index_archive'] is not None:
+        ovation_utilities.set_index_archive(IndexArchive.load(queue.config['index_archive']))
+    evaluator = None
+    units_run = []
+    while max_units is None or len(units_run) < max_units:
+        if stale_seconds is not None:
+            queue.requeue_stale(stale_seconds)
+        i_unit = queue.claim(worker_id)
+        if i_unit is None:
+            break
+        if queue.is_done(i_unit):
+            #Requeued after another worker finished it
+            queue.complete(i_unit, worker_id)
+            continue
+        if evaluator is None:
+            evaluator = UnitEvaluator(queue.config)
+
+        t0 = time.time()
+        dts = unit_times(queue.config, i_unit)
+        outputs = evaluator(dts, heartbeat=lambda: queue.heartbeat(i_unit, worker_id))
+        _write_atomic(queue.output_filename(i_unit), lambda f: np.savez(f, **outputs))
+        queue.complete(i_unit, worker_id)
+        units_run.append(i_unit)
+        log.info('{0} ran unit {1} ({2} times) in {3:.1f} s'.format(worker_id, i_unit, len(dts), time.time()-t0))
+    return units_run
+
+def consolidate(directory, output_directory):
+    """
+    Combines the outputs of all units into one .npy file per variable in
+    output_directory (filled one unit at a time through memory maps, so
+    the whole run never has to be in memory). Returns the variable names.
+    """
+    queue = WorkQueue(directory)
+    n_missing = len([i_unit for i_unit in range(queue.n_units) if not queue.is_done(i_unit)])
+    if n_missing:
+        raise RuntimeError('{0} of {1} units are not done'.format(n_missing, queue.n_units))
+    os.makedirs(output_directory, exist_ok=True)
+
+    n_times = queue.config['n_times']
+    arrays = OrderedDict()
+    i_time = 0
+    for i_unit in range(queue.n_units):
+        with np.load(queue.output_filename(i_unit)) as npz:
+            n_unit_times = npz['time'].shape[0]
+            for name in npz.files:
+                values = npz[name]
+                if name in ['mlat_N', 'mlat_S', 'mlt']:
+                    if name not in arrays:
+                        np.save(os.path.join(output_directory, name+'.npy'), values)
+                        arrays[name] = None
+                    continue
+                if name not in arrays:
+                    arrays[name] = np.lib.format.open_memmap(os.path.join(output_directory, name+'.npy'), mode='w+',
+                                                             dtype=values.dtype, shape=(n_times,)+values.shape[1:])
+                arrays[name][i_time:i_time+n_unit_times] = values
+        i_time += n_unit_times
+    for array in arrays.values():
+        if array is not None:
+            array.flush()
+    return list(arrays.keys())
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Ovation Prime reanalysis over a shared filesystem work queue')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    create_parser = subparsers.add_parser('create', help='make the work queue of a run')
+    create_parser.add_argument('directory')
+    create_parser.add_argument('startdate', help='YYYY-mm-dd[THH:MM]')
+    create_parser.add_argument('enddate', help='YYYY-mm-dd[THH:MM]')
+    create_parser.add_argument('--step-minutes', type=float, default=60.)
+    create_parser.add_argument('--unit-size', type=int, default=168, help='times per work unit')
+    create_parser.add_argument('--fluxes', default='diff:energy',
+                               help='comma separated atype:energy_or_number products')
+    create_parser.add_argument('--conductance', action='store_true')
+    create_parser.add_argument('--conductance-fluxtypes', default='diff')
+    create_parser.add_argument('--hemis', default='N,S')
+    create_parser.add_argument('--solarwind-cadence', default='1min')
+    create_parser.add_argument('--index-archive', default=None,
+                               help='IndexArchive npz file the workers take dF and F10.7 from')
+    create_parser.add_argument('--coarsen', default=None, help='n_mlat,n_mlt coarse grid')
+
+    work_parser = subparsers.add_parser('work', help='run units until none are left')
+    work_parser.add_argument('directory')
+    work_parser.add_argument('--worker-id', default=None)
+    work_parser.add_argument('--max-units', type=int, default=None)
+    work_parser.add_argument('--stale-seconds', type=float, default=None,
+                             help='requeue claims not refreshed for this long')
+
+    status_parser = subparsers.add_parser('status', help='count pending, claimed and done units')
+    status_parser.add_argument('directory')
+
+    consolidate_parser = subparsers.add_parser('consolidate', help='combine the unit outputs')
+    consolidate_parser.add_argument('directory')
+    consolidate_parser.add_argument('output_directory')
+
+    args = parser.parse_args(argv)
+    if args.command == 'create':
+        parse_date = lambda s: datetime.datetime.strptime(s, '%Y-%m-%dT%H:%M' if 'T' in s else '%Y-%m-%d')
+        fluxes = [tuple(flux.split(':')) for flux in args.fluxes.split(',') if flux]
+        coarsen = None if args.coarsen is None else [int(n) for n in args.coarsen.split(',')]
+        create(args.directory, parse_date(args.startdate), parse_date(args.enddate),
+               datetime.timedelta(minutes=args.step_minutes), unit_size=args.unit_size, fluxes=fluxes,
+               conductance=args.conductance, conductance_fluxtypes=args.conductance_fluxtypes.split(','),
+               hemis=args.hemis.split(','), solarwind_cadence=args.solarwind_cadence,
+               index_archive=args.index_archive, coarsen=coarsen)
+    elif args.command == 'work':
+        run_worker(args.directory, worker_id=args.worker_id, max_units=args.max_units,
+                   stale_seconds=args.stale_seconds)
+    elif args.command == 'status':
+        for name, count in WorkQueue(args.directory).status().items():
+            print('{0}: {1}'.format(name, count))
+    elif args.command == 'consolidate':
+        for name in consolidate(args.directory, args.output_directory):
+            print(name)
+
+if __name__ == '__main__':
+    main()
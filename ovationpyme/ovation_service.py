@@ -0,0 +1,330 @@
+"""
+A small asyncio HTTP service which serves Ovation Prime nowcast maps
+(auroral flux, average energy and conductance) as JSON or binary (npz)
+arrays.
+
+All of the coefficient tables are loaded once at startup and shared by
+every request. Concurrent requests for the same time, hemisphere and
+product are coalesced into one computation, and finished results are
+kept in a bounded least-recently-used cache.
+
+Run with:
+    python -m ovationpyme.ovation_service --port 8080
+
+Routes:
+    /health
+    /grid?product=flux&atype=diff&fluxtype=energy&time=2015-03-17T12:00&hemi=N&format=json
+    /point?product=conductance&time=2015-03-17T12:00&hemi=N&mlat=65,70&mlt=0,23.5
+
+product is one of 'flux' (needs atype and fluxtype), 'eavg' (needs atype)
+or 'conductance'. format is 'json' (default) or 'npz'. If time is
+omitted the current time (rounded down to the minute) is used.
+"""
+import io
+import json
+import asyncio
+import argparse
+import datetime
+import functools
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit, parse_qs
+
+import numpy as np
+
+from ovationpyme import ovation_prime
+from ovationpyme import ovation_utilities
+
+from logbook import Logger
+log = Logger('OvationPyme.ovation_service')
+
+_time_formats = ['%Y-%m-%dT%H:%M:%S', '%Y-%m-%dT%H:%M', '%Y%m%dT%H:%M:%S', '%Y%m%dT%H%M']
+
+_http_reasons = {200: 'OK', 400: 'Bad Request', 404: 'Not Found',
+                 405: 'Method Not Allowed', 500: 'Internal Server Error'}
+
+def parse_time(timestr):
+    """Parse an ISO8601-like UTC time string from a query"""
+    for fmt in _time_formats:
+        try:
+            return datetime.datetime.strptime(timestr, fmt)
+        except ValueError:
+            continue
+    raise ValueError('Could not parse time {0}, use e.g. 2015-03-17T12:00:00'.format(timestr))
+
+def _jsonable(arr):
+    """Nested lists for JSON, with NaN replaced by null"""
+    arr = np.asarray(arr, dtype=float)
+    return np.where(np.isfinite(arr), arr, None).tolist()
+
+class NowcastService(object):
+    """
+    Holds the shared estimators, the result cache and the in-flight
+    computations for the HTTP service.
+
+    The Newell coupling and F10.7 for a time come from dF_provider and
+    f107_provider (callables taking a datetime), which default to the
+    OMNI based ovation_utilities.calc_dF and get_daily_f107. Pass other
+    callables to run offline (e.g. from an archive or a fixed value).
+
+    coarsen=(n_mlat, n_mlt) serves coarser grids which are much quicker
+    to compute (see ovation_prime.SeasonalFluxEstimator).
+    """
+    def __init__(self, atypes=['diff', 'mono', 'wave', 'ions'],
+                 conductance_fluxtypes=['diff'], dF_provider=None,
+                 f107_provider=None, cache_size=64, max_workers=4, coarsen=None):
+
+        self.atypes = list(atypes)
+        self.conductance_fluxtypes = list(conductance_fluxtypes)
+        for fluxtype in self.conductance_fluxtypes:
+            if fluxtype not in self.atypes:
+                raise ValueError('Conductance auroral type {0} not in atypes {1}'.format(fluxtype,
+                                                                                       self.atypes))
+
+        self.dF_provider = ovation_utilities.calc_dF if dF_provider is None else dF_provider
+        self.f107_provider = ovation_utilities.get_daily_f107 if f107_provider is None else f107_provider
+
+        #Load every table once, the average energy and conductance
+        #estimators reuse the flux estimators' coefficients
+        self.flux_estimators = OrderedDict()
+        self.eavg_estimators = OrderedDict()
+        for atype in self.atypes:
+            for energy_or_number in ['energy', 'number']:
+                #Seasonal coefficients would otherwise be read by the
+                #first request which needs them
+                self.flux_estimators[(atype, energy_or_number)] = ovation_prime.FluxEstimator(atype,
+                                                                   energy_or_number, coarsen=coarsen).preload()
+            self.eavg_estimators[atype] = ovation_prime.AverageEnergyEstimator(atype,
+                                            numflux_estimator=self.flux_estimators[(atype, 'number')],
+                                            energyflux_estimator=self.flux_estimators[(atype, 'energy')])
+
+        numflux_estimators = {atype: self.flux_estimators[(atype, 'number')] for atype in self.atypes}
+        self.conductance_estimator = ovation_prime.ConductanceEstimator(fluxtypes=self.conductance_fluxtypes,
+                                                                       numflux_estimators=numflux_estimators,
+                                                                       eavg_estimators=self.eavg_estimators)
+
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._inflight = {}
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.n_computed = 0
+
+    def product_key(self, dt, hemi, product, atype=None, fluxtype=None):
+        """Validate a request and turn it into a hashable cache key"""
+        if hemi not in ['N', 'S']:
+            raise ValueError('Invalid hemisphere {0} (use N or S)'.format(hemi))
+        if product == 'flux':
+            if (atype, fluxtype) not in self.flux_estimators:
+                raise ValueError('No flux estimator for atype {0} fluxtype {1}'.format(atype, fluxtype))
+        elif product == 'eavg':
+            if atype not in self.eavg_estimators:
+                raise ValueError('No average energy estimator for atype {0}'.format(atype))
+            fluxtype = None
+        elif product == 'conductance':
+            atype, fluxtype = None, None
+        else:
+            raise ValueError('Unknown product {0} (use flux, eavg or conductance)'.format(product))
+        return (dt, hemi, product, atype, fluxtype)
+
+    def compute(self, key):
+        """
+        Run the model for a product key (blocking, runs in a worker
+        thread). Returns an OrderedDict of arrays and scalars
+        """
+        dt, hemi, product, atype, fluxtype = key
+        dF = self.dF_provider(dt)
+        result = OrderedDict()
+        if product == 'flux':
+            estimator = self.flux_estimators[(atype, fluxtype)]
+            mlats, mlts, flux = estimator.get_flux_for_time(dt, hemi=hemi, dF=dF)
+            result['mlat'], result['mlt'], result['flux'] = mlats, mlts, flux
+        elif product == 'eavg':
+            estimator = self.eavg_estimators[atype]
+            mlats, mlts, eavg = estimator.get_eavg_for_time(dt, hemi=hemi, dF=dF)
+            result['mlat'], result['mlt'], result['eavg'] = mlats, mlts, eavg
+        elif product == 'conductance':
+            f107 = self.f107_provider(dt)
+            outs = self.conductance_estimator.get_conductance(dt, hemi=hemi, dF=dF, f107=f107,
+                                                              conductance_fluxtypes=self.conductance_fluxtypes)
+            mlats, mlts, sigp, sigh = outs
+            result['mlat'], result['mlt'] = mlats, mlts
+            result['pedersen'], result['hall'] = sigp, sigh
+            result['f107'] = f107
+        result['dF'] = dF
+        return result
+
+    async def get(self, key):
+        """
+        Get a product, from the cache, by waiting on an identical
+        request already being computed, or by computing it
+        """
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            return self._cache[key]
+
+        if key in self._inflight:
+            return await asyncio.shield(self._inflight[key])
+
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self._executor, self.compute, key)
+        self._inflight[key] = future
+        self.n_computed += 1
+        try:
+            result = await asyncio.shield(future)
+        finally:
+            del self._inflight[key]
+
+        self._cache[key] = result
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return result
+
+    async def handle_query(self, path, query):
+        """
+        Answer one request, returns (status, content type, body bytes)
+        """
+        if path == '/health':
+            body = {'status': 'ok', 'atypes': self.atypes,
+                    'cached': len(self._cache), 'computed': self.n_computed}
+            return 200, 'application/json', json.dumps(body).encode()
+
+        if path not in ['/grid', '/point']:
+            return 404, 'application/json', json.dumps({'error': 'Unknown route {0}'.format(path)}).encode()
+
+        param = lambda name, default=None: query[name][0] if name in query else default
+
+        #Check every parameter before running the model, so malformed
+        #requests do not cost a computation (or a cache entry)
+        if param('time') is None:
+            now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+            dt = now.replace(second=0, microsecond=0)
+        else:
+            dt = parse_time(param('time'))
+        key = self.product_key(dt, param('hemi', 'N'), param('product', 'flux'),
+                               atype=param('atype', 'diff'), fluxtype=param('fluxtype', 'energy'))
+        fmt = param('format', 'json')
+        if fmt not in ['json', 'npz']:
+            raise ValueError('Unknown format {0} (use json or npz)'.format(fmt))
+        if path == '/point':
+            mlats = np.array([float(v) for v in param('mlat', '').split(',') if v])
+            mlts = np.array([float(v) for v in param('mlt', '').split(',') if v])
+            if mlats.size == 0 or mlats.shape != mlts.shape:
+                raise ValueError('Point queries need equal length mlat and mlt lists')
+            method = param('method', 'nearest')
+            if method not in ['nearest', 'linear', 'cubic']:
+                raise ValueError('Unknown interpolation method {0} (use nearest, linear or cubic)'.format(method))
+
+        result = await self.get(key)
+
+        arrays = OrderedDict()
+        if path == '/grid':
+            arrays.update(result)
+        else:
+            arrays['mlat'], arrays['mlt'] = mlats, mlts
+            for name, value in result.items():
+                if name in ['mlat', 'mlt'] or np.ndim(value) == 0:
+                    arrays[name] = value
+                    continue
+                interpolator = ovation_prime.LatLocaltimeInterpolator(result['mlat'], result['mlt'], value)
+                arrays[name] = interpolator.interpolate(mlats, mlts, method=method)
+
+        if fmt == 'json':
+            body = OrderedDict(time=dt.strftime(_time_formats[0]), hemi=key[1], product=key[2],
+                               atype=key[3], fluxtype=key[4])
+            for name, value in arrays.items():
+                body[name] = _jsonable(value)
+            return 200, 'application/json', json.dumps(body).encode()
+        buf = io.BytesIO()
+        np.savez(buf, **arrays)
+        return 200, 'application/octet-stream', buf.getvalue()
+
+    async def handle_connection(self, reader, writer):
+        """asyncio.start_server callback, answers one HTTP request"""
+        try:
+            request_line = (await reader.readline()).decode('latin-1').split()
+            #Skip the request headers
+            while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                pass
+
+            if len(request_line) < 2:
+                status, ctype, body = 400, 'application/json', b'{"error": "Malformed request"}'
+            elif request_line[0] != 'GET':
+                status, ctype, body = 405, 'application/json', b'{"error": "Only GET is supported"}'
+            else:
+                url = urlsplit(request_line[1])
+                try:
+                    status, ctype, body = await self.handle_query(url.path, parse_qs(url.query))
+                except ValueError as e:
+                    status, ctype, body = 400, 'application/json', json.dumps({'error': str(e)}).encode()
+                except Exception as e:
+                    log.error('Error answering {0}: {1!r}'.format(request_line[1], e))
+                    status, ctype, body = 500, 'application/json', json.dumps({'error': repr(e)}).encode()
+
+            header = ('HTTP/1.1 {0} {1}\r\n'.format(status, _http_reasons[status])
+                      +'Content-Type: {0}\r\n'.format(ctype)
+                      +'Content-Length: {0}\r\n'.format(len(body))
+                      +'Connection: close\r\n\r\n')
+            writer.write(header.encode('latin-1')+body)
+            await writer.drain()
+        finally:
+            writer.close()
+
+    async def start(self, host='127.0.0.1', port=8080):
+        """Start listening, returns the asyncio Server"""
+        server = await asyncio.start_server(self.handle_connection, host, port)
+        log.notice('Ovation Prime nowcast service listening on {0}:{1}'.format(host, port))
+        return server
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Ovation Prime nowcast HTTP service')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--atypes', default='diff,mono,wave,ions',
+                        help='Comma separated auroral types to serve')
+    parser.add_argument('--conductance-fluxtypes', default='diff',
+                        help='Comma separated auroral types used for conductance')
+    parser.add_argument('--cache-size', type=int, default=64,
+                        help='Number of results to keep in memory')
+    parser.add_argument('--workers', type=int, default=4,
+                        help='Number of model computation threads')
+    parser.add_argument('--index-archive', default=None,
+                        help='Precomputed dF and F10.7 archive (see ovation_indices)')
+    parser.add_argument('--solarwind-cadence', default='1min',
+                        choices=ovation_utilities.solarwind_cadences,
+                        help='Cadence of the OMNI data used for the Newell coupling')
+    parser.add_argument('--coarsen', default=None,
+                        help='Serve coarse grids, native bins per output bin as n_mlat,n_mlt (e.g. 2,4)')
+    parser.add_argument('--prefetch-omni', action='store_true',
+                        help='Load the next window of OMNI data in the background')
+    args = parser.parse_args(argv)
+
+    if args.index_archive is not None:
+        from ovationpyme.ovation_indices import IndexArchive
+        ovation_utilities.set_index_archive(IndexArchive.load(args.index_archive))
+    if args.prefetch_omni:
+        ovation_utilities.set_omni_prefetch(ovation_utilities.OmniPrefetcher())
+
+    service = NowcastService(atypes=args.atypes.split(','),
+                             conductance_fluxtypes=args.conductance_fluxtypes.split(','),
+                             dF_provider=functools.partial(ovation_utilities.calc_dF,
+                                                           cadence=args.solarwind_cadence),
+                             cache_size=args.cache_size, max_workers=args.workers,
+                             coarsen=None if args.coarsen is None else [int(n) for n in args.coarsen.split(',')])
+
+    async def serve():
+        server = await service.start(args.host, args.port)
+        async with server:
+            await server.serve_forever()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.close()
+
+if __name__ == '__main__':
+    main()
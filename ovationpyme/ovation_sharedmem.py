@@ -0,0 +1,271 @@
+"""
+Coefficient tables and result grids shared between processes
+
+When model runs are spread over a multiprocessing pool, every worker
+normally reads and keeps its own copy of the coefficient tables and
+sends its result grids back to the parent by pickling them.
+
+SharedCoefficientTables reads the tables once, in the parent, into one
+block of shared memory (multiprocessing.shared_memory) or a memory
+mapped file. Pickling it only sends the name of the block and the
+table layout, so passing it to workers is cheap, and the estimators it
+makes in a worker use the shared arrays without copying them.
+
+SharedArray is a preallocated shared array which workers write their
+results into directly.
+
+    def worker(args):
+        tables, results, i, dt, dF = args
+        estimator = tables.flux_estimator('diff', 'energy')
+        results.array[i] = estimator.get_flux_for_time(dt, dF=dF)[2]
+
+    with SharedCoefficientTables.create(atypes=['diff']) as tables:
+        with SharedArray.create((len(dts), 80, 96)) as results:
+            with multiprocessing.Pool(8) as pool:
+                pool.map(worker, [(tables, results, i, dt, dF) for i, (dt, dF) in enumerate(zip(dts, dFs))])
+            fluxes = results.array.copy()
+
+The tables and results are freed when the creating process leaves the
+with blocks (or calls unlink). Shared memory blocks are meant to be
+used by the creating process and its multiprocessing workers, use a
+memory mapped file (filename=) to share tables with unrelated processes.
+"""
+import os
+from collections import OrderedDict
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from ovationpyme.ovation_prime import (SeasonalFluxEstimator, FluxEstimator,
+                                       AverageEnergyEstimator, ConductanceEstimator)
+
+from logbook import Logger
+log = Logger('OvationPyme.ovation_sharedmem')
+
+_seasons = ['spring', 'summer', 'fall', 'winter']
+
+#Shared memory blocks and memory maps this process has attached to,
+#so that unpickling the same tables for every task attaches only once,
+#and the estimators made from each set of tables
+_attached = {}
+_estimators = {}
+
+def _attach_shared_memory(name):
+    try:
+        #Python 3.13+, the creating process is responsible for unlinking
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        return shared_memory.SharedMemory(name=name)
+
+def _close_shared_memory(shm):
+    try:
+        shm.close()
+    except BufferError:
+        #Arrays using the block still exist in this process, the memory
+        #is released when they are gone (unlinking still removes the name)
+        log.warning('Shared memory {0} is still in use in this process'.format(shm.name))
+
+def _attach(storage, name, nbytes):
+    """Attach (once per process) to a shared memory block or memory mapped file"""
+    key = (storage, name)
+    if key not in _attached:
+        if storage == 'shm':
+            shm = _attach_shared_memory(name)
+            _attached[key] = (shm, shm.buf)
+        else:
+            _attached[key] = (None, np.memmap(name, dtype=np.uint8, mode='r', shape=(nbytes,)))
+    return _attached[key][1]
+
+class SharedCoefficientTables(object):
+    """
+    The SeasonalFluxEstimator coefficient tables for several auroral
+    and flux types (all seasons) in one block of shared memory or a
+    memory mapped file
+    """
+    def __init__(self, storage, name, nbytes, layout, buf=None, shm=None):
+        """
+        Use SharedCoefficientTables.create (or unpickle one) instead
+        of calling this directly
+        """
+        self.storage = storage
+        self.name = name
+        self.nbytes = nbytes
+        self.layout = layout
+        self._shm = shm
+        self._buf = buf
+        self._estimators = _estimators.setdefault(name, {})
+
+    @classmethod
+    def create(cls, atypes=['diff', 'mono', 'wave', 'ions'], energy_or_numbers=['energy', 'number'],
+               filename=None):
+        """
+        Read the coefficient tables for atypes and energy_or_numbers
+        (every season) into a new shared memory block, or into the
+        memory mapped file filename if it is given
+        """
+        layout = OrderedDict()
+        tables = []
+        offset = 0
+        for atype in atypes:
+            for energy_or_number in energy_or_numbers:
+                for season in _seasons:
+                    #The packed active bins (if the estimator makes them) are
+                    #shared too, so workers do not each pack their own copy
+                    estimator = SeasonalFluxEstimator(season, atype, energy_or_number)
+                    for table_name, table in estimator.coefficient_tables().items():
+                        layout[(season, atype, energy_or_number, table_name)] = (offset, table.shape,
+                                                                                 table.dtype.str)
+                        tables.append(table)
+                        #Keep every array aligned to 8 bytes
+                        offset += -(-table.nbytes//8)*8
+        nbytes = offset
+
+        if filename is None:
+            shm = shared_memory.SharedMemory(create=True, size=nbytes)
+            storage, name, buf = 'shm', shm.name, shm.buf
+        else:
+            shm = None
+            storage, name = 'memmap', os.path.abspath(filename)
+            buf = np.memmap(name, dtype=np.uint8, mode='w+', shape=(nbytes,))
+
+        for (offset, shape, dtype), table in zip(layout.values(), tables):
+            np.frombuffer(buf, dtype=dtype, count=table.size, offset=offset)[:] = table.ravel()
+        if storage == 'memmap':
+            buf.flush()
+        log.info('Shared {0} coefficient tables ({1:.1f} MB) in {2} {3}'.format(len(tables), nbytes/1.0e6,
+                                                                              storage, name))
+        return cls(storage, name, nbytes, layout, buf=buf, shm=shm)
+
+    def __getstate__(self):
+        return {'storage': self.storage, 'name': self.name, 'nbytes': self.nbytes, 'layout': self.layout}
+
+    def __setstate__(self, state):
+        self.__init__(state['storage'], state['name'], state['nbytes'], state['layout'])
+
+    def _buffer(self):
+        if self._buf is None:
+            self._buf = _attach(self.storage, self.name, self.nbytes)
+        return self._buf
+
+    def coefficients(self, season, atype, energy_or_number):
+        """
+        Read-only views of one season's coefficient arrays and packed
+        active bins (keys as SeasonalFluxEstimator.coefficient_tables)
+        """
+        buf = self._buffer()
+        if (season, atype, energy_or_number, SeasonalFluxEstimator.coefficient_names[0]) not in self.layout:
+            raise KeyError('No shared coefficients for {0} {1} {2}'.format(season, atype,
+                                                                         energy_or_number))
+        coefficients = OrderedDict()
+        for key, (offset, shape, dtype) in self.layout.items():
+            if key[:3] != (season, atype, energy_or_number):
+                continue
+            table = np.frombuffer(buf, dtype=dtype, count=int(np.prod(shape)), offset=offset)
+            table = table.reshape(shape)
+            table.flags.writeable = False
+            coefficients[key[3]] = table
+        return coefficients
+
+    def flux_estimator(self, atype, energy_or_number, backend=None):
+        """A FluxEstimator using the shared tables (made once per process)"""
+        key = ('flux', atype, energy_or_number, backend)
+        if key not in self._estimators:
+            seasonal_estimators = {season: SeasonalFluxEstimator(season, atype, energy_or_number, backend=backend,
+                                                                 coefficients=self.coefficients(season, atype,
+                                                                                                energy_or_number))
+                                   for season in _seasons}
+            self._estimators[key] = FluxEstimator(atype, energy_or_number, seasonal_estimators=seasonal_estimators,
+                                                  backend=backend)
+        return self._estimators[key]
+
+    def eavg_estimator(self, atype, backend=None):
+        """An AverageEnergyEstimator using the shared tables"""
+        key = ('eavg', atype, backend)
+        if key not in self._estimators:
+            self._estimators[key] = AverageEnergyEstimator(atype,
+                                        numflux_estimator=self.flux_estimator(atype, 'number', backend=backend),
+                                        energyflux_estimator=self.flux_estimator(atype, 'energy', backend=backend))
+        return self._estimators[key]
+
+    def conductance_estimator(self, fluxtypes=['diff'], backend=None):
+        """A ConductanceEstimator using the shared tables"""
+        key = ('conductance', tuple(fluxtypes), backend)
+        if key not in self._estimators:
+            numflux_estimators = {fluxtype: self.flux_estimator(fluxtype, 'number', backend=backend)
+                                  for fluxtype in fluxtypes}
+            eavg_estimators = {fluxtype: self.eavg_estimator(fluxtype, backend=backend) for fluxtype in fluxtypes}
+            self._estimators[key] = ConductanceEstimator(fluxtypes=fluxtypes,
+                                                         numflux_estimators=numflux_estimators,
+                                                         eavg_estimators=eavg_estimators)
+        return self._estimators[key]
+
+    def unlink(self):
+        """
+        Free the shared tables (creating process only). Estimators made
+        from the tables in this process must not be used afterwards
+        """
+        _estimators.pop(self.name, None)
+        self._estimators = {}
+        self._buf = None
+        if self._shm is not None:
+            _close_shared_memory(self._shm)
+            self._shm.unlink()
+            self._shm = None
+        elif self.storage == 'memmap' and os.path.exists(self.name):
+            os.remove(self.name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.unlink()
+        return False
+
+class SharedArray(object):
+    """
+    A numpy array in shared memory which worker processes can write
+    results into (pickling sends only the name, shape and dtype)
+    """
+    def __init__(self, name, shape, dtype, shm=None):
+        """Use SharedArray.create (or unpickle one) instead of calling this directly"""
+        self.name = name
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self._shm = shm
+        self._array = None
+
+    @classmethod
+    def create(cls, shape, dtype=np.float64, fill_value=np.nan):
+        nbytes = max(1, int(np.prod(shape))*np.dtype(dtype).itemsize)
+        shm = shared_memory.SharedMemory(create=True, size=nbytes)
+        shared = cls(shm.name, shape, dtype, shm=shm)
+        shared.array.fill(fill_value)
+        return shared
+
+    @property
+    def array(self):
+        if self._array is None:
+            buf = self._shm.buf if self._shm is not None else _attach('shm', self.name, None)
+            self._array = np.ndarray(self.shape, dtype=self.dtype, buffer=buf)
+        return self._array
+
+    def __getstate__(self):
+        return {'name': self.name, 'shape': self.shape, 'dtype': self.dtype.str}
+
+    def __setstate__(self, state):
+        self.__init__(state['name'], state['shape'], state['dtype'])
+
+    def unlink(self):
+        """Free the shared memory (creating process only, copy the array first)"""
+        self._array = None
+        if self._shm is not None:
+            _close_shared_memory(self._shm)
+            self._shm.unlink()
+            self._shm = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.unlink()
+        return False
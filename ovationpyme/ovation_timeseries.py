@@ -0,0 +1,352 @@
+"""
+Streaming model output over long time ranges
+
+The generators here yield the model grids one time at a time, so long
+runs (months to years) can feed writers or reducers without holding the
+whole time series in memory:
+
+    for dt, grids in iter_flux(datetime(2015,1,1), datetime(2016,1,1),
+                               timedelta(hours=1), atypes=['diff','mono'],
+                               hemis=['N','S']):
+        mlat_grid, mlt_grid, gridflux = grids[('diff', 'energy', 'N')]
+        ...
+
+Internally the times are processed in chunks with the batched estimator
+methods (get_flux_for_times, get_conductance_for_times). The estimators
+(and their coefficient tables), the cached OMNI window and the AACGM
+conversions are reused from step to step. The Newell coupling and F10.7
+for the next chunk are computed in a background thread while the current
+chunk is evaluated (readahead=True), so reading solar wind data overlaps
+with the model evaluation.
+
+The model inputs change slowly (the Newell coupling is a 4 hour weighted
+average and the seasonal weights change daily), so iter_flux can also
+evaluate the model exactly at a coarser cadence, and where the coupling
+changes by more than a tolerance, and interpolate the grids in between:
+
+    iter_flux(..., timedelta(minutes=1), exact_step=timedelta(minutes=30),
+              dF_tolerance=500.)
+
+interpolation_error gives the error of this against evaluating every time.
+"""
+import datetime
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from ovationpyme import ovation_utilities
+from ovationpyme.ovation_prime import FluxEstimator, ConductanceEstimator
+
+from logbook import Logger
+log = Logger('OvationPyme.ovation_timeseries')
+
+def time_range(startdt, enddt, step):
+    """Times startdt, startdt+step, ... before enddt"""
+    if step <= datetime.timedelta(0):
+        raise ValueError('Time step must be positive, got {0}'.format(step))
+    dt = startdt
+    while dt < enddt:
+        yield dt
+        dt += step
+
+def time_chunks(startdt, enddt, step, chunk_size):
+    """Lists of at most chunk_size consecutive times of time_range"""
+    chunk = []
+    for dt in time_range(startdt, enddt, step):
+        chunk.append(dt)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def _chunk_drivers(dts, solarwind_cadence, with_f107):
+    dFs = np.array([ovation_utilities.calc_dF(dt, cadence=solarwind_cadence) for dt in dts])
+    if with_f107:
+        f107s = np.array([ovation_utilities.get_daily_f107(dt) for dt in dts])
+    else:
+        f107s = None
+    return dFs, f107s
+
+def iter_drivers(chunks, solarwind_cadence='1min', with_f107=False, readahead=True):
+    """
+    Yields each chunk of times with the Newell coupling and F10.7
+    (None unless with_f107) for its times (as arrays). With readahead
+    the values for the next chunk are computed in a background thread
+    while the caller works on the current one.
+    """
+    if not readahead:
+        for chunk in chunks:
+            yield (chunk,)+_chunk_drivers(chunk, solarwind_cadence, with_f107)
+        return
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        pending = None
+        for chunk in chunks:
+            future = executor.submit(_chunk_drivers, chunk, solarwind_cadence, with_f107)
+            if pending is not None:
+                yield (pending[0],)+pending[1].result()
+            pending = (chunk, future)
+        if pending is not None:
+            yield (pending[0],)+pending[1].result()
+
+def _flux_hemis(hemis):
+    """hemi arguments for get_flux_for_times covering hemis"""
+    hemis = list(hemis)
+    for hemi in hemis:
+        if hemi not in ['N', 'S']:
+            raise ValueError('Invalid hemisphere {0} (use N or S)'.format(hemi))
+    if 'N' in hemis and 'S' in hemis:
+        return [('both', ['N', 'S'])]
+    return [(hemi, [hemi]) for hemi in hemis]
+
+def _exact_step_knots(dts, exact_step):
+    """Indices of the times of dts every exact_step, and the last time"""
+    n_times = len(dts)
+    if n_times == 0:
+        return []
+    step = dts[1]-dts[0] if n_times > 1 else exact_step
+    n_step = exact_step.total_seconds()/step.total_seconds()
+    if n_step < 1 or n_step != int(n_step):
+        raise ValueError('exact_step must be a multiple of the time step, got {0} and {1}'.format(exact_step, step))
+    knots = list(range(0, n_times, int(n_step)))
+    if knots[-1] != n_times-1:
+        knots.append(n_times-1)
+    return knots
+
+def _refine_knots(dts, knots, knot_dFs, dF_tolerance, solarwind_cadence):
+    """
+    Add times halfway between consecutive knots whose Newell coupling
+    differs by more than dF_tolerance (see interpolation_knots), the
+    coupling of the new times is computed as they are needed
+    """
+    dFs = dict(zip(knots, knot_dFs))
+    def dF(i_time):
+        if i_time not in dFs:
+            dFs[i_time] = ovation_utilities.calc_dF(dts[i_time], cadence=solarwind_cadence)
+        return dFs[i_time]
+
+    refined = [knots[0]]
+    pending = [(i_start, i_end) for i_start, i_end in zip(knots[:-1], knots[1:])][::-1]
+    while pending:
+        i_start, i_end = pending.pop()
+        if i_end-i_start > 1 and abs(dF(i_end)-dF(i_start)) > dF_tolerance:
+            i_mid = (i_start+i_end)//2
+            pending.extend([(i_mid, i_end), (i_start, i_mid)])
+        else:
+            refined.append(i_end)
+    return refined, np.array([dF(i_time) for i_time in refined])
+
+def interpolation_knots(dts, exact_step, dF_tolerance=None, solarwind_cadence='1min'):
+    """
+    Indices of the times of dts (consecutive times of a time_range)
+    iter_flux evaluates the model exactly at with exact_step: every
+    exact_step, the last time, and (if dF_tolerance is set) times
+    halfway between two of these where their Newell coupling differs by
+    more than dF_tolerance, until it does not or there are no times
+    between them. Only the coupling at these times is compared, so a
+    change which returns to the same value between them is not found.
+    Returns the indices and the Newell coupling at each.
+    """
+    knots = _exact_step_knots(dts, exact_step)
+    knot_dFs = np.array([ovation_utilities.calc_dF(dts[i_time], cadence=solarwind_cadence) for i_time in knots])
+    if dF_tolerance is None or not knots:
+        return knots, knot_dFs
+    return _refine_knots(dts, knots, knot_dFs, dF_tolerance, solarwind_cadence)
+
+def _iter_flux_interpolated(dts, estimators, flux_hemis, exact_step, dF_tolerance, chunk_size,
+                            readahead, solarwind_cadence, combine_hemispheres):
+    """
+    iter_flux with interpolation between exact evaluations (see
+    interpolation_knots). The Newell coupling of the times every
+    exact_step is computed chunk_size times at a time with iter_drivers
+    (so with readahead the next chunk's is computed in the background),
+    the coupling of the times added by dF_tolerance as they are needed.
+    """
+    coarse_knots = _exact_step_knots(dts, exact_step)
+    chunks = ([dts[i_time] for i_time in coarse_knots[i_chunk:i_chunk+chunk_size]]
+              for i_chunk in range(0, len(coarse_knots), chunk_size))
+    n_coarse, n_exact = 0, 0
+    last_knot = None
+    previous = None
+    for chunk_dts, chunk_dFs, _ in iter_drivers(chunks, solarwind_cadence=solarwind_cadence, readahead=readahead):
+        knots = coarse_knots[n_coarse:n_coarse+len(chunk_dts)]
+        knot_dFs = chunk_dFs
+        n_coarse += len(chunk_dts)
+        if dF_tolerance is not None:
+            #Refine from the last knot of the previous chunk (already evaluated)
+            if last_knot is not None:
+                knots, knot_dFs = [last_knot[0]]+knots, np.concatenate([[last_knot[1]], knot_dFs])
+            knots, knot_dFs = _refine_knots(dts, knots, knot_dFs, dF_tolerance, solarwind_cadence)
+            if last_knot is not None:
+                knots, knot_dFs = knots[1:], knot_dFs[1:]
+            last_knot = (knots[-1], knot_dFs[-1])
+        n_exact += len(knots)
+
+        for i_chunk in range(0, len(knots), chunk_size):
+            chunk_knots = knots[i_chunk:i_chunk+chunk_size]
+            chunk_grids = OrderedDict()
+            for (atype, energy_or_number), estimator in estimators.items():
+                for hemi_arg, hemi_names in flux_hemis:
+                    outs = estimator.get_flux_for_times([dts[i_time] for i_time in chunk_knots], hemi=hemi_arg,
+                                                        dFs=knot_dFs[i_chunk:i_chunk+chunk_size],
+                                                        combine_hemispheres=combine_hemispheres)
+                    for i_hemi, hemi in enumerate(hemi_names):
+                        chunk_grids[(atype, energy_or_number, hemi)] = outs[3*i_hemi:3*i_hemi+3]
+
+            for i_knot, i_time in enumerate(chunk_knots):
+                if previous is not None:
+                    #Times between the previous knot and this one
+                    i_previous, previous_grids = previous
+                    for i_between in range(i_previous+1, i_time):
+                        weight = float(i_between-i_previous)/(i_time-i_previous)
+                        grids = OrderedDict()
+                        for key, (mlat_grid, mlt_grid, gridfluxes) in chunk_grids.items():
+                            start = previous_grids[key]
+                            grids[key] = (mlat_grid, mlt_grid, start+weight*(gridfluxes[i_knot]-start))
+                        yield dts[i_between], grids
+                grids = OrderedDict()
+                for key, (mlat_grid, mlt_grid, gridfluxes) in chunk_grids.items():
+                    grids[key] = (mlat_grid, mlt_grid, gridfluxes[i_knot])
+                yield dts[i_time], grids
+                previous = (i_time, OrderedDict([(key, grid[2]) for key, grid in grids.items()]))
+    log.info('Evaluated {0} of {1} times exactly'.format(n_exact, len(dts)))
+
+def iter_flux(startdt, enddt, step, atypes=['diff'], energy_or_numbers=['energy'], hemis=['N'],
+              chunk_size=24, readahead=True, solarwind_cadence='1min', estimators=None,
+              combine_hemispheres=True, exact_step=None, dF_tolerance=None):
+    """
+    Yields (dt, grids) for each time of time_range(startdt, enddt, step),
+    grids is an OrderedDict of (mlat_grid, mlt_grid, gridflux) with keys
+    (atype, energy_or_number, hemi)
+
+    chunk_size - int
+        number of times evaluated together (memory use is proportional
+        to it, not to the length of the time range)
+
+    readahead - bool
+        compute the Newell coupling for the next chunk in a background
+        thread (with exact_step, of the next chunk_size times every
+        exact_step)
+
+    estimators - dict, optional
+        FluxEstimator for each (atype, energy_or_number), to reuse ones
+        which are already loaded
+
+    exact_step - datetime.timedelta, optional
+        evaluate the model (and the Newell coupling) only every
+        exact_step (a multiple of step) and at the last time, and
+        interpolate the grids linearly in time between those times
+
+    dF_tolerance - float, optional
+        with exact_step, also evaluate the model halfway between two
+        exact times whose Newell coupling differs by more than this
+        (repeatedly, see interpolation_knots). interpolation_error
+        measures the error of interpolating against evaluating every
+        time.
+    """
+    if estimators is None:
+        estimators = {}
+    estimators = OrderedDict([((atype, energy_or_number),
+                               estimators[(atype, energy_or_number)]
+                               if (atype, energy_or_number) in estimators
+                               else FluxEstimator(atype, energy_or_number).preload())
+                              for atype in atypes for energy_or_number in energy_or_numbers])
+    flux_hemis = _flux_hemis(hemis)
+
+    if exact_step is not None:
+        for dt, grids in _iter_flux_interpolated(list(time_range(startdt, enddt, step)), estimators, flux_hemis,
+                                                 exact_step, dF_tolerance, chunk_size, readahead,
+                                                 solarwind_cadence, combine_hemispheres):
+            yield dt, grids
+        return
+
+    chunks = time_chunks(startdt, enddt, step, chunk_size)
+    for dts, dFs, _ in iter_drivers(chunks, solarwind_cadence=solarwind_cadence, readahead=readahead):
+        chunk_grids = OrderedDict()
+        for (atype, energy_or_number), estimator in estimators.items():
+            for hemi_arg, hemi_names in flux_hemis:
+                outs = estimator.get_flux_for_times(dts, hemi=hemi_arg, dFs=dFs,
+                                                    combine_hemispheres=combine_hemispheres)
+                for i_hemi, hemi in enumerate(hemi_names):
+                    chunk_grids[(atype, energy_or_number, hemi)] = outs[3*i_hemi:3*i_hemi+3]
+
+        for i_time, dt in enumerate(dts):
+            grids = OrderedDict()
+            for key, (mlat_grid, mlt_grid, gridfluxes) in chunk_grids.items():
+                grids[key] = (mlat_grid, mlt_grid, gridfluxes[i_time])
+            yield dt, grids
+
+def interpolation_error(startdt, enddt, step, exact_step, dF_tolerance=None, **kwargs):
+    """
+    Error of iter_flux with exact_step (and dF_tolerance) against
+    evaluating the model at every time. The other keyword arguments are
+    passed to both iter_flux calls (the estimators are shared).
+
+    Returns an OrderedDict with keys (atype, energy_or_number, hemi) of
+    OrderedDicts of the max_abs_error, rms_error and max_rel_error (the
+    largest absolute error relative to the largest flux of the exact grid
+    at the same time) over all of the grids, and the n_times and n_exact
+    (number of times evaluated exactly)
+    """
+    kwargs['estimators'] = dict(kwargs.get('estimators') or {})
+    for atype in kwargs.get('atypes', ['diff']):
+        for energy_or_number in kwargs.get('energy_or_numbers', ['energy']):
+            if (atype, energy_or_number) not in kwargs['estimators']:
+                kwargs['estimators'][(atype, energy_or_number)] = FluxEstimator(atype, energy_or_number).preload()
+    dts = list(time_range(startdt, enddt, step))
+    knots, _ = interpolation_knots(dts, exact_step, dF_tolerance, kwargs.get('solarwind_cadence', '1min'))
+
+    sums = OrderedDict()
+    exact = iter_flux(startdt, enddt, step, **kwargs)
+    interpolated = iter_flux(startdt, enddt, step, exact_step=exact_step, dF_tolerance=dF_tolerance, **kwargs)
+    for (dt, exact_grids), (_, interpolated_grids) in zip(exact, interpolated):
+        for key, (mlat_grid, mlt_grid, gridflux) in exact_grids.items():
+            abs_error = np.abs(interpolated_grids[key][2]-gridflux)
+            max_abs_error, sum_sq_error, max_rel_error, n_values = sums.get(key, (0., 0., 0., 0))
+            peak = np.nanmax(np.abs(gridflux)) if gridflux.size else 0.
+            sums[key] = (max(max_abs_error, np.nanmax(abs_error)),
+                         sum_sq_error+np.nansum(abs_error**2),
+                         max(max_rel_error, np.nanmax(abs_error)/peak if peak > 0. else 0.),
+                         n_values+abs_error.size)
+
+    errors = OrderedDict()
+    for key, (max_abs_error, sum_sq_error, max_rel_error, n_values) in sums.items():
+        errors[key] = OrderedDict([('max_abs_error', max_abs_error),
+                                   ('rms_error', np.sqrt(sum_sq_error/n_values)),
+                                   ('max_rel_error', max_rel_error),
+                                   ('n_times', len(dts)),
+                                   ('n_exact', len(knots))])
+    return errors
+
+def iter_conductance(startdt, enddt, step, hemis=['N'], fluxtypes=['diff'], chunk_size=24,
+                     readahead=True, solarwind_cadence='1min', estimator=None, **kwargs):
+    """
+    Yields (dt, grids) for each time of time_range(startdt, enddt, step),
+    grids is an OrderedDict of (mlat_grid, mlt_grid, sigp, sigh) with
+    the hemispheres as keys
+
+    The other keyword arguments are passed to
+    ConductanceEstimator.get_conductance_for_times (chunk_size, readahead
+    and solarwind_cadence as for iter_flux)
+    """
+    if estimator is None:
+        estimator = ConductanceEstimator(fluxtypes=fluxtypes)
+    for hemi in hemis:
+        if hemi not in ['N', 'S']:
+            raise ValueError('Invalid hemisphere {0} (use N or S)'.format(hemi))
+
+    chunks = time_chunks(startdt, enddt, step, chunk_size)
+    for dts, dFs, f107s in iter_drivers(chunks, solarwind_cadence=solarwind_cadence, with_f107=True,
+                                        readahead=readahead):
+        chunk_grids = OrderedDict()
+        for hemi in hemis:
+            chunk_grids[hemi] = estimator.get_conductance_for_times(dts, hemi=hemi, conductance_fluxtypes=fluxtypes,
+                                                                    dFs=dFs, f107s=f107s, **kwargs)
+
+        for i_time, dt in enumerate(dts):
+            grids = OrderedDict()
+            for hemi, (mlat_grid, mlt_grid, sigps, sighs) in chunk_grids.items():
+                grids[hemi] = (mlat_grid, mlt_grid, sigps[i_time], sighs[i_time])
+            yield dt, grids
@@ -2,6 +2,7 @@
 
 """
 import datetime
+import threading
 from collections import OrderedDict
 
 import numpy as np
@@ -9,19 +10,167 @@ import functools
 
 from geospacepy import special_datetime, sun
 from nasaomnireader.omnireader import omni_interval
+from ovationpyme.ovation_profiling import timed
 from logbook import Logger
 log = Logger('OvationPyme.ovation_utilites')
 
 #_ovation_prime_omni_cadence = 'hourly' #Ovation Prime was created using hourly SW
 
+#Precomputed dF and F10.7 (see ovation_indices.IndexArchive and set_index_archive)
+_index_archive = None
+
+def set_index_archive(archive):
+    """
+    Use an ovation_indices.IndexArchive of precomputed Newell coupling
+    and F10.7 for calc_dF and get_daily_f107 at the times it covers,
+    instead of computing them from OMNI data. Pass None to stop using it
+    """
+    global _index_archive
+    _index_archive = archive
+
+#Solar wind cadences which can be used for the Newell coupling
+solarwind_cadences = ['1min', '5min', 'hourly']
+
+#OMNI timestamps are the start of each averaging interval. Samples are
+#binned by the center of the minutes they average, so that the hourly
+#averages cover the same time whatever the cadence (this is zero for
+#1 minute data, i.e. 1 minute results are unchanged)
+_sample_center_offset_minutes = {'1min': 0., '5min': 2., 'hourly': 29.5}
+
+#omni_intervals shared by all decorated functions (one per cadence)
+_omni_interval_cache = {}
+_omni_interval_cache_lock = threading.Lock()
+
+#Background loading of the next omni_interval (see set_omni_prefetch)
+_omni_prefetcher = None
+
+def set_omni_prefetch(prefetcher):
+    """
+    Use an OmniPrefetcher to load the next window of OMNI data in the
+    background for the functions decorated with cache_omni_interval.
+    Pass None to stop prefetching
+    """
+    global _omni_prefetcher
+    _omni_prefetcher = prefetcher
+
+def load_omni_interval(startdt, enddt, cadence):
+    """The default OmniPrefetcher provider, reads OMNI data with nasaomnireader"""
+    return omni_interval(startdt, enddt, cadence, silent=True)
+
+class OmniPrefetcher(object):
+    """
+    Loads the omni_interval which follows the cached one in a background
+    thread, so sequential runs do not stop to read solar wind data each
+    time the times leave the cached window.
+
+    When a time moving forward (each time not before the previous one of
+    that cadence) comes within lead_hours of the first time the cached
+    interval can not be used for, the interval around that first time is
+    loaded in the background. When a time needs a new interval, the
+    prefetched one is used (waiting for it if it is still loading) if it
+    covers the time, and swapped into the cache while its lock is held.
+
+    provider - callable, optional
+        provider(startdt, enddt, cadence) returns an omni_interval-like
+        object (with startdt and enddt attributes, indexed by OMNI
+        variable name), used for all of the intervals while the
+        prefetcher is set. Defaults to load_omni_interval
+
+    lead_hours - float
+        how close to the end of the cached interval (in model time) to
+        start loading the next one
+    """
+    def __init__(self, provider=None, lead_hours=12.):
+        from concurrent.futures import ThreadPoolExecutor
+        self.provider = provider if provider is not None else load_omni_interval
+        self.lead_hours = lead_hours
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._lock = threading.Lock()
+        #cadence: (startdt, enddt, future) of the interval being loaded or loaded
+        self._pending = {}
+        self._last_dts = {}
+        self.n_loaded = 0
+        self.n_prefetched = 0
+        self.n_used = 0
+
+    def load(self, startdt, enddt, cadence):
+        """Loads an interval in the calling thread"""
+        with self._lock:
+            self.n_loaded += 1
+        return self.provider(startdt, enddt, cadence)
+
+    def prefetch(self, dt, next_dt, startdt, enddt, cadence):
+        """
+        Starts loading the interval startdt-enddt if dt (the time being
+        calculated) is moving forward and within lead_hours of next_dt
+        (the first time of cadence the cached interval can not be used
+        for), and the interval is not already loading
+        """
+        with self._lock:
+            last_dt = self._last_dts.get(cadence)
+            self._last_dts[cadence] = dt
+            if last_dt is not None and dt < last_dt:
+                return False
+            if (next_dt-dt).total_seconds()/3600. > self.lead_hours:
+                return False
+            pending = self._pending.get(cadence)
+            if pending is not None and pending[:2] == (startdt, enddt):
+                return False
+            log.debug("Prefetching solar wind interval: {}-{}".format(startdt, enddt))
+            self._pending[cadence] = (startdt, enddt, self._executor.submit(self.provider, startdt, enddt, cadence))
+            self.n_prefetched += 1
+            return True
+
+    def take(self, cadence, covers):
+        """
+        The prefetched interval of cadence if covers(startdt, enddt) is
+        True for it, waiting for it to load if needed, otherwise None
+        (also if loading it failed)
+        """
+        with self._lock:
+            pending = self._pending.get(cadence)
+            if pending is None or not covers(pending[0], pending[1]):
+                return None
+            del self._pending[cadence]
+        try:
+            oi = pending[2].result()
+        except Exception as err:
+            log.warning('Prefetching solar wind interval {}-{} failed: {}'.format(pending[0], pending[1], err))
+            return None
+        with self._lock:
+            self.n_used += 1
+        return oi
+
+    def close(self):
+        """Stops the background thread (after any load in progress)"""
+        self._executor.shutdown(wait=True)
+
 def cache_omni_interval(cadence):
     """Decorator which decorates functions with call signature
     func(dt,oi) which calculate something from a given omni interval
     Implements on-the-fly creation of an omni_interval, cacheing it
     as a function parameter, and then creating a new one if requested
     dateimte is out of range
+
+    cadence is the default cadence of the OMNI data, the decorated
+    function can be called as func(dt, cadence=...) to use another
+    ('1min', '5min' or 'hourly'). The cached intervals are shared by
+    all decorated functions, so functions calling each other for the
+    same time and cadence read the data once.
+
+    The cache is guarded by a lock, so decorated functions can be called
+    from several threads at once. Only the lookup/creation of the
+    omni_interval happens while the lock is held, the decorated function
+    itself runs outside of it (it must only read from the interval).
+
+    If an OmniPrefetcher is set (set_omni_prefetch), the next interval
+    is loaded in the background as the times approach the end of the
+    cached one. Waiting for a prefetched interval is done outside of the
+    lock, which is only taken to swap it into the cache.
     """
-    cache = {}
+    default_cadence = cadence
+    cache = _omni_interval_cache
+    cache_lock = _omni_interval_cache_lock
 
     def cache_omni_interval_decorator(func):
         
@@ -30,44 +179,68 @@ def cache_omni_interval(cadence):
         new_interval_days_before_dt = 1.5
         new_interval_days_after_dt = 1.5
 
-        def _dt_within_range(dt,oi):
+        def _dt_within_range(dt,startdt,enddt):
             """
             Check that dt is more than tol_hrs_before hours after the start of
             the omni_interval, and more that tol_hrs_after before the end of
             """
-            st_hrs_before_dt = (dt-oi.startdt).total_seconds()/3600.
-            ed_hrs_after_dt = (oi.enddt-dt).total_seconds()/3600.
+            st_hrs_before_dt = (dt-startdt).total_seconds()/3600.
+            ed_hrs_after_dt = (enddt-dt).total_seconds()/3600.
             in_before_range = st_hrs_before_dt > tol_hrs_before
             in_after_range = ed_hrs_after_dt > tol_hrs_after
             return in_before_range and in_after_range
 
-        def cache_omni_interval_wrapper(dt):
+        @functools.wraps(func)
+        def cache_omni_interval_wrapper(dt,cadence=None):
 
             #print("Cached OMNI called for {}".format(dt))
+            cadence = default_cadence if cadence is None else cadence
+            prefetcher = _omni_prefetcher
 
-            if 'omni_interval_{}'.format(cadence) in cache:
-                cached_oi = cache['omni_interval_{}'.format(cadence)]
-                need_new_oi = not _dt_within_range(dt,cached_oi)
-            else:
-                need_new_oi = True
+            key = 'omni_interval_{}'.format(cadence)
+            with cache_lock:
+                oi = cache.get(key)
+                need_new_oi = oi is None or not _dt_within_range(dt,oi.startdt,oi.enddt)
 
-            if need_new_oi:
-                startdt = dt-datetime.timedelta(days=new_interval_days_before_dt)
-                enddt = dt+datetime.timedelta(days=new_interval_days_after_dt)
+            prefetched_oi = None
+            if need_new_oi and prefetcher is not None:
+                #Wait for the prefetched interval without holding the cache
+                #lock, so other threads (and cadences) are not blocked
+                prefetched_oi = prefetcher.take(cadence,lambda st,ed: _dt_within_range(dt,st,ed))
 
-                oi = omni_interval(startdt,enddt,cadence,silent=True)
-
-                #Save to cache
-                cache['omni_interval_{}'.format(cadence)] = oi
-                log.debug("Created new solar wind interval: {}-{}".format(oi.startdt,
-                                                                        oi.enddt))
+            if need_new_oi:
+                with cache_lock:
+                    oi = cache.get(key)
+                    if oi is not None and _dt_within_range(dt,oi.startdt,oi.enddt):
+                        #Another thread made a usable interval while we waited
+                        log.debug("Using cached solar wind interval: {}-{}".format(oi.startdt,
+                                                                                oi.enddt))
+                    else:
+                        startdt = dt-datetime.timedelta(days=new_interval_days_before_dt)
+                        enddt = dt+datetime.timedelta(days=new_interval_days_after_dt)
+
+                        if prefetched_oi is not None:
+                            oi = prefetched_oi
+                        elif prefetcher is None:
+                            oi = omni_interval(startdt,enddt,cadence,silent=True)
+                        else:
+                            oi = prefetcher.load(startdt,enddt,cadence)
+
+                        #Save to cache
+                        cache[key] = oi
+                        log.debug("Created new solar wind interval: {}-{}".format(oi.startdt,
+                                                                                oi.enddt))
             else:
-                #Load from cache
-                oi = cache['omni_interval_{}'.format(cadence)]
-                
                 log.debug("Using cached solar wind interval: {}-{}".format(oi.startdt,
                                                                         oi.enddt))
 
+            if prefetcher is not None:
+                #The first time this interval can not be used for
+                next_dt = oi.enddt-datetime.timedelta(hours=tol_hrs_after)
+                prefetcher.prefetch(dt,next_dt,
+                                    next_dt-datetime.timedelta(days=new_interval_days_before_dt),
+                                    next_dt+datetime.timedelta(days=new_interval_days_after_dt),
+                                    cadence)
 
             return func(dt,oi)
 
@@ -75,6 +248,16 @@ def cache_omni_interval(cadence):
 
     return cache_omni_interval_decorator
 
+def sample_center_jds(jd, cadence):
+    """
+    Julian dates of the centers of OMNI samples of a cadence (from
+    the start times in the data)
+    """
+    if cadence not in _sample_center_offset_minutes:
+        raise ValueError('Invalid solar wind cadence {0}, valid values {1}'.format(cadence,
+                                                                                  solarwind_cadences))
+    return jd+_sample_center_offset_minutes[cadence]/1440.
+
 def calc_coupling(Bx, By, Bz, V):
     """
     Empirical Formula for dF/dt
@@ -84,7 +267,7 @@ def calc_coupling(Bx, By, Bz, V):
     Ec.fill(np.nan)
     B = np.sqrt(Bx**2 + By**2 + Bz**2)
     BT = np.sqrt(By**2 + Bz**2)
-    bztemp = Bz
+    bztemp = np.array(Bz, dtype=float) #copy, the input may be shared omni data
     bztemp[Bz == 0] = 0.001
     #Caculate clock angle (theta_c = t_c)
     tc = np.arctan2(By,bztemp)
@@ -135,11 +318,11 @@ def hourly_solarwind_for_average(dt,oi):
     
     target_jd = special_datetime.datetime2jd(dt)
     
-    sw = read_solarwind(dt)
+    sw = read_solarwind(dt,cadence=oi.cadence)
 
     #Julian date in days to time relative to target time in hours
     #with positive values indicating time before the target
-    hours_before_target = -1*(sw['jd']-target_jd)*24.
+    hours_before_target = -1*(sample_center_jds(sw['jd'],oi.cadence)-target_jd)*24.
     
     sw4avg = OrderedDict()
     for swkey,swdata in sw.items():
@@ -154,6 +337,7 @@ def hourly_solarwind_for_average(dt,oi):
         sw4avg[swkey]=np.array(hourly_swdata)
     return sw4avg
 
+@timed('calc_avg_solarwind')
 @cache_omni_interval('1min')
 def calc_avg_solarwind(dt,oi):
     """
@@ -165,10 +349,13 @@ def calc_avg_solarwind(dt,oi):
     oi is an optional omnireader.omni_interval
     instance from which to read the data. If this
     is None (default), will create a new omni_interval
+
+    Call as calc_avg_solarwind(dt, cadence=...) to use '5min' or
+    'hourly' OMNI data instead of '1min' (see solarwind_cadences)
     """
     prev_hour_weight=0.65
 
-    sw4avg = hourly_solarwind_for_average(dt)
+    sw4avg = hourly_solarwind_for_average(dt,cadence=oi.cadence)
     n = sw4avg['jd'].size #Number of hourly datapoints to be averaged
     weights = [prev_hour_weight**n_hours_back for n_hours_back in range(n)[::-1]] #reverse the range
 
@@ -182,8 +369,19 @@ def calc_avg_solarwind(dt,oi):
 
     return avgsw
 
+@timed('get_daily_f107')
+def get_daily_f107(dt):
+    """
+    F10.7 for the day of dt, from the index archive if one is set and
+    covers dt, otherwise from OMNI data
+    """
+    archive = _index_archive
+    if archive is not None and archive.covers(dt):
+        return archive.get_f107(dt)
+    return omni_daily_f107(dt)
+
 @cache_omni_interval('hourly')
-def get_daily_f107(dt,oi):
+def omni_daily_f107(dt,oi):
     """
     Since OvationPyme uses hourly OMNI data
     I just do the mean for all of the 1 hour values for the day
@@ -195,11 +393,19 @@ def get_daily_f107(dt,oi):
     imatch = np.nanargmin(np.abs(omjd-jd))
     return omf107[imatch]
 
-def calc_dF(dt):
-    """dF==newell coupling for Ovation Prime"""
-    return calc_avg_solarwind(dt)['Ec']
+def calc_dF(dt,cadence='1min'):
+    """
+    dF==newell coupling for Ovation Prime, from the index archive if
+    one is set, covers dt and was made from solar wind data of the same
+    cadence, otherwise from OMNI data of cadence ('1min', '5min' or
+    'hourly')
+    """
+    archive = _index_archive
+    if archive is not None and archive.cadence == cadence and archive.covers(dt):
+        return archive.get_dF(dt)
+    return calc_avg_solarwind(dt,cadence=cadence)['Ec']
 
-def robinson_auroral_conductance(numflux, eavg):
+def robinson_auroral_conductance(numflux, eavg, out=None):
     """Robinson empirical formula for auroral conductance from
     energy flux and average energy of precipitating electrons
 
@@ -209,6 +415,9 @@ def robinson_auroral_conductance(numflux, eavg):
             Electron number flux in #/cm^2/s
         eavg, np.ndarray
             Electron average energy in keV
+        out, tuple, optional
+            (sigp, sigh) arrays to write the result into (not numflux
+            or eavg), no other arrays are allocated
 
     RETURNS
     -------
@@ -222,12 +431,26 @@ def robinson_auroral_conductance(numflux, eavg):
     #Assume all of the particles come in at the average energy??
     #Under maxwellian assumption (eavg=eflux/nflux), so this is valid
     keV_to_ergs = 1.6022e-9
-    energyflux = numflux*eavg*keV_to_ergs
-    #energyflux_grid *= 1.6022e-9
-    sigp = 40.*eavg/(16+eavg**2) * np.sqrt(energyflux)
-    sigh = 0.45*eavg**0.85*sigp
+    if out is None:
+        energyflux = numflux*eavg*keV_to_ergs
+        #energyflux_grid *= 1.6022e-9
+        sigp = 40.*eavg/(16+eavg**2) * np.sqrt(energyflux)
+        sigh = 0.45*eavg**0.85*sigp
+        return sigp,sigh
+
+    #The same operations in the same order, using sigh for the temporaries
+    sigp,sigh = out
+    np.multiply(40.,eavg,out=sigp)
+    np.divide(sigp,np.add(16,np.square(eavg,out=sigh),out=sigh),out=sigp)
+    np.multiply(numflux,eavg,out=sigh)
+    np.multiply(sigh,keV_to_ergs,out=sigh)
+    np.multiply(sigp,np.sqrt(sigh,out=sigh),out=sigp)
+    np.power(eavg,0.85,out=sigh)
+    np.multiply(0.45,sigh,out=sigh)
+    np.multiply(sigh,sigp,out=sigh)
     return sigp,sigh
 
+@timed('brekke_moen_solar_conductance')
 def brekke_moen_solar_conductance(dt,glats,glons,f107):
     """
     Estimate the solar conductance using methods from:
@@ -264,28 +487,38 @@ def brekke_moen_solar_conductance(dt,glats,glons,f107):
             F10.7 index (daily) used to calcuate solar conductance
     """
     szas_rad = sun.solar_zenith_angle(special_datetime.datetime2jd(dt), glats, glons)
+    return _brekke_moen_sza_model(szas_rad, glats, f107)
+
+def _brekke_moen_sza_model(szas_rad, glats, f107):
+    """
+    The piecewise solar zenith angle model and magnetic field correction of
+    brekke_moen_solar_conductance. f107 can be a float or an array which
+    broadcasts against szas_rad (e.g. one value per time along the first axis)
+    """
     szas = np.rad2deg(szas_rad)
+    f107 = np.asarray(f107, dtype=float)
 
-    sigp,sigh = np.zeros_like(glats),np.zeros_like(glats)
+    sigp = np.zeros(np.broadcast(szas, glats, f107).shape)
+    sigh = np.zeros_like(sigp)
 
     cos65 = np.cos(65/180.*np.pi)
     sigp65  = .5*(f107*cos65)**(2./3)
     sigh65  = 1.8*np.sqrt(f107)*cos65
     sigp100 = sigp65-0.22*(100.-65.)
 
-    in_band = szas <= 65.
-    #print "%d/%d Zenith Angles < 65" % (np.count_nonzero(in_band),len(in_band))
-    sigp[in_band] = .5*(f107*np.cos(szas_rad[in_band]))**(2./3)
-    sigh[in_band] = 1.8*np.sqrt(f107)*np.cos(szas_rad[in_band])
+    with np.errstate(invalid='ignore'):
+        #cos(sza)**(2/3) is NaN for sza>90, those values are not used
+        in_band = szas <= 65.
+        sigp = np.where(in_band, .5*(f107*np.cos(szas_rad))**(2./3), sigp)
+        sigh = np.where(in_band, 1.8*np.sqrt(f107)*np.cos(szas_rad), sigh)
 
     in_band = np.logical_and(szas >= 65.,szas < 100.)
-    #print "%d/%d Zenith Angles > 65 and < 100" % (np.count_nonzero(in_band),len(in_band))
-    sigp[in_band] = sigp65-.22*(szas[in_band]-65.)
-    sigh[in_band] = sigh65-.27*(szas[in_band]-65.)
+    sigp = np.where(in_band, sigp65-.22*(szas-65.), sigp)
+    sigh = np.where(in_band, sigh65-.27*(szas-65.), sigh)
 
     in_band = szas > 100.
-    sigp[in_band] = sigp100-.13*(szas[in_band]-100.)
-    sigh[in_band] = sigh65-.27*(szas[in_band]-65.)
+    sigp = np.where(in_band, sigp100-.13*(szas-100.), sigp)
+    sigh = np.where(in_band, sigh65-.27*(szas-65.), sigh)
 
     sigp[sigp<.4] = .4
     sigh[sigh<.8] = .8
@@ -299,3 +532,67 @@ def brekke_moen_solar_conductance(dt,glats,glons,f107):
     sigh = sigh*1.285/bbh
 
     return sigp,sigh
+
+def solar_zenith_angles_for_times(jds, glats, glons):
+    """
+    Solar zenith angles (radians) for every combination of time and
+    location, computed the same way as geospacepy.sun.solar_zenith_angle
+    but with the solar position found once per time and broadcast
+    over the locations
+
+    INPUTS
+    ------
+        jds, np.ndarray (ntime,)
+            Julian dates
+
+        glats, glons, np.ndarray (npts,) or (ntime,npts)
+            Geographic latitudes and longitudes, the same for
+            every time or different for each time
+
+    RETURNS
+    -------
+        szas, np.ndarray (ntime,npts)
+    """
+    jds = np.asarray(jds, dtype=float).reshape(-1)
+    sra,sdec = sun.solar_position_almanac(jds)
+    gmst = sun.greenwich_mean_siderial_time(jds)
+    sra,sdec,gmst = sra[:,np.newaxis],sdec[:,np.newaxis],gmst[:,np.newaxis]
+
+    lam = np.radians(glats)
+    phi = np.radians(glons)
+    sha = (gmst+phi) - sra
+    cossza = np.sin(lam)*np.sin(sdec) + np.cos(lam)*np.cos(sdec)*np.cos(sha)
+    return np.arccos(cossza)
+
+@timed('brekke_moen_solar_conductance_for_times')
+def brekke_moen_solar_conductance_for_times(dts,glats,glons,f107s):
+    """
+    Batched version of brekke_moen_solar_conductance for many times.
+    Solar zenith angles for all (time, location) pairs are found with
+    one broadcast operation, and the F10.7 and magnetic field
+    corrections are applied to the whole array.
+
+    INPUTS
+    ------
+        dts, list or np.ndarray of datetime.datetime (ntime,)
+            Universal times
+
+        glats, glons, np.ndarray (npts,) or (ntime,npts)
+            GeoDETIC latitudes and geographic longitudes,
+            the same for every time or different for each time
+
+        f107s, float or np.ndarray (ntime,)
+            F10.7 index for each time (or one value for all of them)
+
+    OUTPUTS
+    -------
+        sigp, sigh, np.ndarray (ntime,npts)
+            Pedersen and Hall conductance
+    """
+    jds = special_datetime.datetimearr2jd(np.asarray(dts).reshape(-1)).reshape(-1)
+    f107s = np.asarray(f107s, dtype=float)
+    if f107s.ndim > 0:
+        f107s = f107s.reshape(-1, 1)
+
+    szas_rad = solar_zenith_angles_for_times(jds, glats, glons)
+    return _brekke_moen_sza_model(szas_rad, glats, f107s)
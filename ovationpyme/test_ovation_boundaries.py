@@ -0,0 +1,52 @@
+import datetime
+
+import numpy as np
+from numpy import testing as nptest
+
+from ovationpyme.ovation_prime import FluxEstimator
+from ovationpyme.ovation_boundaries import flux_boundaries, boundary_timeseries
+"""
+Unit Tests for the auroral oval boundaries
+"""
+
+startdt = datetime.datetime(2015, 3, 17, 10)
+step = datetime.timedelta(minutes=30)
+
+def test_flux_boundaries_interpolated():
+    """Boundaries are interpolated between the bins on either side of
+    the threshold, NaN where the threshold is not reached"""
+    mlats = np.array([60., 62., 64., 66., 68.])
+    mlat_grid = np.tile(mlats[:, np.newaxis], (1, 3))
+    fluxgrid = np.array([[0., 0., 1.],
+                         [1., 0., 1.],
+                         [3., 0., 1.],
+                         [1., 0., 1.],
+                         [0., 0., 1.]])
+    equatorward, poleward = flux_boundaries(mlat_grid, fluxgrid, threshold=2.)
+    nptest.assert_allclose(equatorward, [63., np.nan, np.nan])
+    nptest.assert_allclose(poleward, [65., np.nan, np.nan])
+
+    #Flux above the threshold at the grid edges, southern latitudes
+    equatorward, poleward = flux_boundaries(-mlat_grid, fluxgrid[np.newaxis], threshold=0.5)
+    assert equatorward.shape == (1, 3)
+    nptest.assert_allclose(equatorward[0], [-61., np.nan, -60.])
+    nptest.assert_allclose(poleward[0], [-67., np.nan, -68.])
+
+def test_boundary_timeseries_same_as_per_time(archive):
+    estimator = FluxEstimator('diff', 'energy')
+    enddt = startdt+5*step
+    dts, mlts, boundaries = boundary_timeseries(startdt, enddt, step, hemis=['N', 'S'], chunk_size=2,
+                                                estimator=estimator)
+    assert dts == [startdt+i*step for i in range(5)]
+    assert list(boundaries.keys()) == ['N', 'S']
+    for hemi in ['N', 'S']:
+        equatorward, poleward = boundaries[hemi]
+        assert equatorward.shape == (5, len(mlts))
+        for i_time, dt in enumerate(dts):
+            mlat_grid, mlt_grid, gridflux = estimator.get_flux_for_time(dt, hemi=hemi, dF=archive.dF[i_time])
+            expected = flux_boundaries(mlat_grid, gridflux)
+            nptest.assert_array_equal(mlts, mlt_grid[0, :])
+            nptest.assert_allclose(equatorward[i_time], expected[0])
+            nptest.assert_allclose(poleward[i_time], expected[1])
+        assert np.any(np.isfinite(equatorward))
+        assert np.all((np.abs(equatorward) <= np.abs(poleward)) | np.isnan(equatorward))
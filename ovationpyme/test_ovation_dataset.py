@@ -0,0 +1,58 @@
+import datetime
+import pytest
+
+import numpy as np
+from numpy import testing as nptest
+
+pytest.importorskip('xarray')
+pytest.importorskip('dask')
+
+from ovationpyme import ovation_utilities
+from ovationpyme.ovation_prime import FluxEstimator, AverageEnergyEstimator, ConductanceEstimator
+from ovationpyme.ovation_dataset import model_dataset
+"""
+Unit Tests for the lazily evaluated xarray Dataset output
+"""
+
+startdt = datetime.datetime(2015, 3, 17, 10)
+step = datetime.timedelta(minutes=30)
+
+#F10.7 which changes with time, so the conductance shows which values were used
+varying_f107 = pytest.mark.parametrize('archive', [(np.linspace(1500., 9000., 8), np.linspace(100., 170., 8))],
+                                       indirect=True)
+
+@varying_f107
+def test_dataset_same_as_batched(archive, assert_conductance_close):
+    dts = [startdt+i*step for i in range(5)]
+    ds = model_dataset(startdt, startdt+5*step, step, hemi='S', fluxes=[('diff', 'energy')], eavg=['mono'],
+                       conductance=True, chunk_size=2)
+    assert ds['diff_energy_flux'].dims == ('time', 'mlat', 'mlt')
+    assert ds['diff_energy_flux'].data.chunks[0] == (2, 2, 1)
+    nptest.assert_array_equal(ds['time'].values, np.array(dts, dtype='datetime64[ns]'))
+    nptest.assert_array_equal(ds['dF'].values, archive.dF[:5])
+    nptest.assert_array_equal(ds['f107'].values, archive.f107[:5])
+
+    mlat_grid, mlt_grid, gridfluxes = FluxEstimator('diff', 'energy').get_flux_for_times(dts, hemi='S')
+    nptest.assert_array_equal(ds['mlat'].values, mlat_grid[:, 0])
+    nptest.assert_array_equal(ds['mlt'].values, mlt_grid[0, :])
+    nptest.assert_array_equal(ds['diff_energy_flux'].values, gridfluxes)
+    eavgs = AverageEnergyEstimator('mono').get_eavg_for_times(dts, hemi='S')[2]
+    nptest.assert_array_equal(ds['mono_eavg'].values, eavgs)
+    sigps, sighs = ConductanceEstimator(fluxtypes=['diff']).get_conductance_for_times(dts, hemi='S')[2:]
+    assert_conductance_close(ds['sigp'].values, sigps)
+    assert_conductance_close(ds['sigh'].values, sighs)
+
+@varying_f107
+def test_dataset_is_lazy(archive, monkeypatch):
+    """Only the chunks which are used should be evaluated"""
+    calc_dF = ovation_utilities.calc_dF
+    called = []
+    def counting_calc_dF(dt, **kwargs):
+        called.append(dt)
+        return calc_dF(dt, **kwargs)
+    monkeypatch.setattr(ovation_utilities, 'calc_dF', counting_calc_dF)
+
+    ds = model_dataset(startdt, startdt+8*step, step, chunk_size=3)
+    assert called == []
+    ds['diff_energy_flux'].isel(time=slice(0, 2)).mean('time').compute()
+    assert called == [startdt+i*step for i in range(3)]
@@ -0,0 +1,56 @@
+import datetime
+import pytest
+
+import numpy as np
+from numpy import testing as nptest
+
+import aacgmv2
+from ovationpyme.ovation_prime import FluxEstimator, _geo_to_aacgm
+from ovationpyme.ovation_geographic import GeographicRemapper
+"""
+Unit Tests for the geographic grid output
+"""
+
+@pytest.fixture(scope='module')
+def remapper(request):
+    return GeographicRemapper(glats=np.arange(-88., 90., 4.), glons=np.arange(-180., 180., 5.))
+
+@pytest.fixture(scope='module')
+def model_grid(request):
+    return np.meshgrid(np.linspace(50., 90., 80), np.linspace(0., 24., 96), indexing='ij')
+
+def test_remap_gives_aacgm_coordinates(remapper, model_grid):
+    """
+    Bilinear interpolation of grids of the magnetic latitude and local
+    time should give the AACGM coordinates of the geographic points
+    """
+    dt = datetime.datetime(2015, 3, 17, 12, 30)
+    mlat_grid, mlt_grid = model_grid
+    remapped_mlats = remapper.remap(dt, mlat_grid, mlt_grid, mlat_grid)
+    remapped_mlats = remapper.remap(dt, -1.*mlat_grid, mlt_grid, -1.*mlat_grid, out=remapped_mlats)
+    remapped_mlts = remapper.remap(dt, mlat_grid, mlt_grid, mlt_grid)
+
+    mlats, mlons = _geo_to_aacgm(remapper.glats.flatten(), remapper.glons.flatten(),
+                                 datetime.datetime(2015, 3, 17))
+    on_grid = np.isfinite(remapped_mlats.flatten())
+    assert np.count_nonzero(on_grid) > 0
+    nptest.assert_allclose(remapped_mlats.flatten()[on_grid], mlats[on_grid], atol=1e-9)
+    assert np.all(np.abs(mlats[~on_grid & np.isfinite(mlats)]) < 50.)
+
+    on_grid = np.isfinite(remapped_mlts.flatten())
+    mlt_diff = np.abs(remapped_mlts.flatten()[on_grid]-aacgmv2.convert_mlt(mlons[on_grid], dt))
+    assert np.all(np.minimum(mlt_diff, 24.-mlt_diff) < 1e-9)
+
+def test_operator_cached_per_ut_bin(remapper):
+    dt = datetime.datetime(2015, 3, 17, 12, 30)
+    matrix, inds = remapper.operator(dt, 'N')
+    assert remapper.operator(dt+datetime.timedelta(seconds=30), 'N')[0] is matrix
+    assert remapper.operator(dt+datetime.timedelta(minutes=1), 'N')[0] is not matrix
+
+def test_flux_for_time(remapper):
+    dt = datetime.datetime(2015, 3, 17, 12, 30)
+    estimator = FluxEstimator('diff', 'energy')
+    glats, glons, gridflux = remapper.flux_for_time(estimator, dt, dF=3000.)
+    assert gridflux.shape == glats.shape == glons.shape
+    assert np.all(gridflux[np.isfinite(gridflux)] >= 0.)
+    assert np.any(np.isfinite(gridflux[glats > 0.])) and np.any(np.isfinite(gridflux[glats < 0.]))
@@ -0,0 +1,32 @@
+import pytest
+
+from ovationpyme import ovation_kernels
+from ovationpyme import ovation_golden
+"""
+Unit Tests checking every backend and the batched methods against the
+stored full grid reference outputs (see ovation_golden)
+"""
+
+@pytest.fixture(scope='module')
+def seasonal_estimators(request):
+    return ovation_golden.load_seasonal_estimators()
+
+@pytest.mark.parametrize('backend', ovation_kernels.available_backends())
+@pytest.mark.parametrize('batched', [False, True])
+def test_outputs_same_as_reference(seasonal_estimators, backend, batched):
+    results = ovation_golden.check_against_reference(backend=backend, batched=batched,
+                                                     seasonal_estimators=seasonal_estimators)
+    assert len(results) == 4*2+4+2
+
+def test_changed_output_is_detected(seasonal_estimators):
+    reference = ovation_golden.load_reference()
+    outputs = dict(reference)
+    outputs['flux/winter/diff/energy'] = reference['flux/winter/diff/energy']*(1.+1e-5)
+    results = ovation_golden.compare_outputs(outputs, reference)
+    assert [name for name, result in results.items() if not result[2]] == ['flux/winter/diff/energy']
+    #Looser explicit tolerances accept it
+    results = ovation_golden.compare_outputs(outputs, reference, tolerances={'flux': (1e-4, 0.)})
+    assert all(result[2] for result in results.values())
+    del outputs['eavg/mono']
+    with pytest.raises(AssertionError):
+        ovation_golden.check_against_reference(outputs)
@@ -0,0 +1,113 @@
+import datetime
+import pytest
+
+import numpy as np
+from numpy import testing as nptest
+
+from ovationpyme import ovation_utilities
+from ovationpyme import ovation_indices
+from ovationpyme.ovation_indices import IndexArchive, newell_coupling_for_times
+"""
+Unit Tests for the precomputed dF and F10.7 archive
+"""
+
+@pytest.fixture()
+def archive(request):
+    """
+    Two days of hourly drivers, set as the index archive for the test
+    """
+    startdt = datetime.datetime(2015, 3, 17)
+    dF = np.linspace(1000., 8000., 48)
+    f107 = np.repeat([110., 115.], 24)
+    archive = IndexArchive(startdt, datetime.timedelta(hours=1), dF, f107)
+    ovation_utilities.set_index_archive(archive)
+    def fin():
+        ovation_utilities.set_index_archive(None)
+    request.addfinalizer(fin)
+    return archive
+
+def test_newell_coupling_same_as_hourly_average():
+    """
+    The vectorized coupling should match averaging each hour before
+    the target time and weighting the hours as calc_avg_solarwind does
+    """
+    jd = 2457000.5+np.arange(24*60)/1440.
+    Ec = 5000.+3000.*np.sin(np.arange(jd.size)/90.)
+    Ec[200:260] = np.nan
+    target_jds = jd[300::97]
+    weights = np.array([.65**3, .65**2, .65, 1.])
+    expected = []
+    for target_jd in target_jds:
+        hours_before_target = -1*(jd-target_jd)*24.
+        hourly = [np.nanmean(Ec[np.logical_and(hours_before_target>=hour, hours_before_target<hour+1)])
+                  for hour in [3, 2, 1, 0]]
+        expected.append(np.nansum(np.array(hourly)*weights)/np.sum(weights))
+    nptest.assert_allclose(newell_coupling_for_times(target_jds, jd, Ec), expected, rtol=1e-12)
+
+def test_archive_save_load(archive, tmp_path):
+    filename = str(tmp_path / 'indices.npz')
+    archive.save(filename)
+    loaded = IndexArchive.load(filename)
+    assert loaded.startdt == archive.startdt
+    assert loaded.step == archive.step
+    nptest.assert_array_equal(loaded.dF, archive.dF)
+    nptest.assert_array_equal(loaded.f107, archive.f107)
+    assert loaded.cadence == '1min'
+    archive.cadence = 'hourly'
+    archive.save(filename)
+    assert IndexArchive.load(filename).cadence == 'hourly'
+
+def test_archive_used_by_utilities(archive, monkeypatch):
+    dt = datetime.datetime(2015, 3, 18, 2, 10)
+    assert archive.covers(dt)
+    assert not archive.covers(datetime.datetime(2015, 3, 20))
+    assert ovation_utilities.calc_dF(dt) == archive.dF[26]
+    assert ovation_utilities.get_daily_f107(dt) == 115.
+    #Not used for dF from solar wind data of another cadence
+    read_cadences = []
+    def calc_avg_solarwind(dt, cadence=None):
+        read_cadences.append(cadence)
+        return {'Ec': -1.}
+    monkeypatch.setattr(ovation_utilities, 'calc_avg_solarwind', calc_avg_solarwind)
+    assert ovation_utilities.calc_dF(dt, cadence='hourly') == -1.
+    assert read_cadences == ['hourly']
+
+class FakeOmniInterval(dict):
+    """
+    Stand-in for omni_interval with smoothly varying solar wind and
+    F10.7, and fill (NaN) after data_enddt as for data not yet released
+    """
+    data_enddt = None
+
+    def __init__(self, startdt, enddt, cadence, silent=False):
+        step = {'1min': 1, '5min': 5, 'hourly': 60}[cadence]
+        epoch = np.arange(startdt.replace(minute=0, second=0), enddt, datetime.timedelta(minutes=step)).astype(object)
+        minutes = np.array([(dt-datetime.datetime(2015, 1, 1)).total_seconds()/60. for dt in epoch])
+        has_data = np.array([dt <= self.data_enddt for dt in epoch])
+        with_fill = lambda values: np.where(has_data, values, np.nan)
+        dict.__init__(self, Epoch=epoch, BX_GSE=with_fill(2.+np.cos(minutes/50.)),
+                      BY_GSM=with_fill(3.*np.sin(minutes/70.)), BZ_GSM=with_fill(-4.*np.cos(minutes/110.)),
+                      flow_speed=with_fill(450.+50.*np.sin(minutes/300.)),
+                      V=with_fill(450.+50.*np.sin(minutes/300.)),
+                      F10_INDEX=with_fill(110.+np.floor(minutes/1440.)))
+
+def test_extended_archive_same_as_single_pass(monkeypatch):
+    """
+    An archive built before all of the OMNI data was available and
+    extended later should be the same as one built in one pass
+    """
+    monkeypatch.setattr(ovation_indices, 'omni_interval', FakeOmniInterval)
+    startdt, step = datetime.datetime(2015, 3, 16), datetime.timedelta(minutes=30)
+
+    FakeOmniInterval.data_enddt = datetime.datetime(2015, 3, 17, 20, 10)
+    archive = IndexArchive.build(startdt, datetime.datetime(2015, 3, 18), step=step, block_days=1)
+    #Stops at the last time with data instead of averaging partial data
+    assert archive.enddt == datetime.datetime(2015, 3, 17, 20)
+    assert np.all(np.isfinite(archive.dF)) and np.all(np.isfinite(archive.f107))
+
+    FakeOmniInterval.data_enddt = datetime.datetime(2015, 3, 20)
+    archive.extend(datetime.datetime(2015, 3, 18, 12), block_days=1)
+    single_pass = IndexArchive.build(startdt, datetime.datetime(2015, 3, 18, 12), step=step)
+    assert archive.enddt == single_pass.enddt
+    nptest.assert_array_equal(archive.dF, single_pass.dF)
+    nptest.assert_array_equal(archive.f107, single_pass.f107)
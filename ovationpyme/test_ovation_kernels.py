@@ -0,0 +1,75 @@
+import datetime
+import pytest
+
+import numpy as np
+from numpy import testing as nptest
+
+from ovationpyme import ovation_kernels
+from ovationpyme.ovation_prime import SeasonalFluxEstimator, FluxEstimator
+"""
+Unit Tests for the grid evaluation backends, which are checked against
+the per-bin reference implementation ('python' backend)
+"""
+
+fast_backends = [backend for backend in ovation_kernels.available_backends() if backend != 'python']
+
+@pytest.fixture(scope='module', params=[('winter', 'diff', 'energy'),
+                                        ('summer', 'mono', 'number'),
+                                        ('fall', 'ions', 'energy')])
+def seasonal_flux_estimator(request):
+    return SeasonalFluxEstimator(*request.param)
+
+@pytest.mark.parametrize('backend', fast_backends)
+@pytest.mark.parametrize('dF', [0., 1200., 3134.17, 9000.])
+def test_gridded_flux_same_as_reference(seasonal_flux_estimator, backend, dF):
+    reference = seasonal_flux_estimator.get_gridded_flux(dF, backend='python', return_inwedge=True)
+    outs = seasonal_flux_estimator.get_gridded_flux(dF, backend=backend, return_inwedge=True)
+    for out, ref in zip(outs, reference):
+        nptest.assert_array_equal(out, ref)
+
+@pytest.mark.parametrize('backend', fast_backends)
+def test_flux_for_time_same_as_reference(backend):
+    dt = datetime.datetime(2011, 4, 13, 1)
+    reference = FluxEstimator('wave', 'energy', backend='python').get_flux_for_time(dt, dF=2500.)
+    outs = FluxEstimator('wave', 'energy', backend=backend).get_flux_for_time(dt, dF=2500.)
+    for out, ref in zip(outs, reference):
+        nptest.assert_array_equal(out, ref)
+
+def test_numba_falls_back_to_numpy():
+    if ovation_kernels.numba is not None:
+        pytest.skip('numba is installed')
+    assert ovation_kernels.resolve_backend('numba') == 'numpy'
+
+@pytest.mark.parametrize('backend', fast_backends)
+def test_inactive_bins_never_have_flux(seasonal_flux_estimator, backend):
+    estimator = seasonal_flux_estimator
+    dFs = np.concatenate([np.linspace(0., 30000., 121), [3134.17, 1.0e6]])
+    args = (estimator.b1a, estimator.b2a, estimator.b1p, estimator.b2p, estimator.prob,
+            estimator.atype != 'ions',
+            ovation_kernels.correction_limits(estimator.atype, estimator.energy_or_number))
+    active = ovation_kernels.ActiveBins.pack(*args[:-1])
+    dense = ovation_kernels.regression_flux_for_dFs(backend, dFs, *args)
+    sparse = ovation_kernels.regression_flux_for_dFs(backend, dFs, *args, active=active)
+    for grids, sparse_grids in zip(dense, sparse):
+        nptest.assert_array_equal(sparse_grids, grids)
+    #Only the active bins are evaluated, and scattered into the grids
+    flux = ovation_kernels.active_regression_flux(backend, dFs, active, args[-1])
+    assert flux.shape == (dFs.size, active.n_active) and active.n_active < estimator.b1a.size
+    for grids, scattered in zip(dense, active.scatter(flux)):
+        nptest.assert_array_equal(scattered, grids)
+
+def test_tables_packed_only_when_it_pays_off():
+    #8% of the diffuse bins are inactive, 40% of the wave bins
+    assert SeasonalFluxEstimator('winter', 'diff', 'energy').active_bins is None
+    assert SeasonalFluxEstimator('winter', 'wave', 'energy').active_bins is not None
+    assert SeasonalFluxEstimator('winter', 'diff', 'energy', active_bins=True).active_bins is not None
+    assert SeasonalFluxEstimator('winter', 'wave', 'energy', active_bins=False).active_bins is None
+
+@pytest.mark.parametrize('backend', fast_backends)
+@pytest.mark.parametrize('dF', [-100., np.inf])
+def test_active_bins_not_used_outside_valid_dF(backend, dF):
+    """Inactive bins are only zero for finite dF >= 0, other values use the dense tables"""
+    dense = SeasonalFluxEstimator('winter', 'wave', 'energy', active_bins=False)
+    packed = SeasonalFluxEstimator('winter', 'wave', 'energy', active_bins=True)
+    for out, ref in zip(packed.get_gridded_flux(dF, backend=backend), dense.get_gridded_flux(dF, backend=backend)):
+        nptest.assert_array_equal(out, ref)
@@ -0,0 +1,55 @@
+import os
+import pytest
+
+import numpy as np
+from numpy import testing as nptest
+
+import matplotlib
+matplotlib.use('Agg')
+from ovationpyme import ovation_plotting
+"""
+Unit Tests for the dial plot renderer
+"""
+
+@pytest.fixture()
+def grids(request):
+    mlt_grid, mlat_grid = np.meshgrid(np.linspace(0., 24., 96), np.linspace(50., 90., 80))
+    fluxgrids = np.random.RandomState(0).rand(3, 80, 96)
+    return mlat_grid, mlt_grid, fluxgrids
+
+def test_render_same_as_full_draw(grids):
+    """
+    A frame drawn over the cached background should look like drawing
+    the whole figure (up to antialiasing where lines overlap the edge of
+    the mesh)
+    """
+    mlat_grid, mlt_grid, fluxgrids = grids
+    renderer = ovation_plotting.DialRenderer(mlat_grid, mlt_grid, 0., 1.)
+    for fluxgrid in fluxgrids:
+        image = renderer.render(fluxgrid, title='frame')
+    for artist in [renderer.mesh, renderer.title]+list(renderer.ax.spines.values()):
+        artist.set_animated(False)
+    renderer.canvas.draw()
+    full_image = np.asarray(renderer.canvas.buffer_rgba())
+    assert image.shape == full_image.shape
+    differs = np.abs(image.astype(int)-full_image.astype(int)).max(axis=2) > 8
+    assert differs.mean() < 1e-3
+
+def test_render_frames(grids, tmpdir):
+    mlat_grid, mlt_grid, fluxgrids = grids
+    vmin, vmax = ovation_plotting.color_limits(fluxgrids)
+    nptest.assert_allclose([vmin, vmax], np.percentile(fluxgrids, [5., 95.]))
+    filename_format = os.path.join(str(tmpdir), 'flux_{0:03d}.png')
+    filenames = ovation_plotting.render_frames(iter(fluxgrids), filename_format, mlat_grid, mlt_grid,
+                                               vmin, vmax, titles=['a', 'b', 'c'], processes=1)
+    assert filenames == [filename_format.format(i) for i in range(3)]
+    renderer = ovation_plotting.DialRenderer(mlat_grid, mlt_grid, vmin, vmax)
+    image = matplotlib.image.imread(filenames[1])
+    nptest.assert_allclose(image, renderer.render(fluxgrids[1], title='b')/255., atol=1e-6)
+
+def test_save_animation_gif(grids, tmpdir):
+    from PIL import Image
+    mlat_grid, mlt_grid, fluxgrids = grids
+    filename = os.path.join(str(tmpdir), 'flux.gif')
+    ovation_plotting.save_animation(fluxgrids, filename, mlat_grid, mlt_grid, 0., 1., processes=2)
+    assert Image.open(filename).n_frames == 3
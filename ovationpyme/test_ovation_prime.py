@@ -1,3 +1,4 @@
+import datetime
 import pytest
 
 import numpy as np
@@ -91,3 +92,234 @@ def test_flux_same_as_idl(seasonal_flux_estimator, idl_call_results):
     py_flux = seasonal_flux_estimator.estimate_auroral_flux(idl_dF, i_mlt, j_mlat)
     idl_flux = idl_call_results['je']
     assert py_flux == idl_flux
+
+def test_coefficients_are_read_only(seasonal_flux_estimator):
+    """
+    Coefficients are shared between threads, so they must not be
+    modifiable after loading
+    """
+    with pytest.raises(ValueError):
+        seasonal_flux_estimator.b1a[0, 0] = 1.
+
+def test_shared_flux_estimator_threadsafe(flux_estimator):
+    """
+    Check that one FluxEstimator called from many threads gives the
+    same result as calling it serially
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    dt = datetime.datetime(2011, 4, 13, 1)
+    dFs = [1000., 2000., 3134.17, 4000.]*3
+    serial = [flux_estimator.get_flux_for_time(dt, dF=dF)[2] for dF in dFs]
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        threaded = list(pool.map(lambda dF: flux_estimator.get_flux_for_time(dt, dF=dF)[2], dFs))
+    for fluxgrid_serial, fluxgrid_threaded in zip(serial, threaded):
+        nptest.assert_array_equal(fluxgrid_serial, fluxgrid_threaded)
+
+def test_shared_conductance_estimator_threadsafe():
+    """
+    Check that one ConductanceEstimator called from many threads at
+    different dates (AACGM coefficients are global state) gives the
+    same result as calling it serially
+    """
+    import sys
+    from concurrent.futures import ThreadPoolExecutor
+    estimator = ovationpyme.ovation_prime.ConductanceEstimator(fluxtypes=['diff'])
+    dts = [datetime.datetime(1990+5*i, 1+2*i, 13, 1) for i in range(5)]*4
+    get_conductance = lambda dt: estimator.get_conductance(dt, dF=3134.17, f107=120.)[2:4]
+    serial = [get_conductance(dt) for dt in dts]
+    #Switch threads often, so unlocked AACGM calls would interleave
+    switch_interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            threaded = list(pool.map(get_conductance, dts))
+    finally:
+        sys.setswitchinterval(switch_interval)
+    for (sigp_serial, sigh_serial), (sigp_threaded, sigh_threaded) in zip(serial, threaded):
+        nptest.assert_array_equal(sigp_serial, sigp_threaded)
+        nptest.assert_array_equal(sigh_serial, sigh_threaded)
+
+def test_solar_conductance_for_times_same_as_per_time():
+    """
+    The batched solar conductance should match calling
+    solar_conductance for each time (to within the small difference
+    from using one AACGM epoch per day)
+    """
+    estimator = ovationpyme.ovation_prime.ConductanceEstimator(fluxtypes=['diff'])
+    mlats, mlts = np.meshgrid(np.linspace(50., 90., 80), np.linspace(0., 24., 96), indexing='ij')
+    dts = [datetime.datetime(2011, 4, 13, 22)+datetime.timedelta(minutes=40*i) for i in range(4)]
+    f107s = np.array([120., 125., 130., 135.])
+    sigps, sighs = estimator.solar_conductance_for_times(dts, mlats, mlts, f107s=f107s)
+    assert sigps.shape == (len(dts),)+mlats.shape
+    for dt, f107, sigp_batch, sigh_batch in zip(dts, f107s, sigps, sighs):
+        sigp, sigh = estimator.solar_conductance(dt, mlats, mlts, f107=f107)
+        nptest.assert_allclose(sigp_batch, sigp, atol=1e-3)
+        nptest.assert_allclose(sigh_batch, sigh, atol=1e-3)
+
+def test_flux_for_times_same_as_per_time(flux_estimator):
+    """
+    The batched flux should be identical to calling get_flux_for_time
+    for each time
+    """
+    dts = [datetime.datetime(2011, 3, 19, 22), datetime.datetime(2011, 6, 1, 3),
+           datetime.datetime(2011, 11, 5, 12)]
+    dFs = np.array([800., 3134.17, 9000.])
+    for hemi in ['N', 'S']:
+        grid_mlats, grid_mlts, gridfluxes = flux_estimator.get_flux_for_times(dts, hemi=hemi, dFs=dFs)
+        assert gridfluxes.shape == (len(dts),)+grid_mlats.shape
+        for dt, dF, gridflux in zip(dts, dFs, gridfluxes):
+            nptest.assert_array_equal(flux_estimator.get_flux_for_time(dt, hemi=hemi, dF=dF)[2], gridflux)
+
+def test_conductance_for_times_same_as_per_time():
+    """
+    The batched conductance should match calling get_conductance for
+    each time (to within the solar conductance's AACGM epoch difference)
+    """
+    estimator = ovationpyme.ovation_prime.ConductanceEstimator(fluxtypes=['diff'])
+    dts = [datetime.datetime(2011, 4, 13, 1)+datetime.timedelta(minutes=5*i) for i in range(3)]
+    dFs = np.array([1500., 3134.17, 6000.])
+    f107s = np.array([110., 120., 130.])
+    mlat_grid, mlt_grid, sigps, sighs = estimator.get_conductance_for_times(dts, dFs=dFs, f107s=f107s)
+    assert sigps.shape == (len(dts),)+mlat_grid.shape
+    for dt, dF, f107, sigp_batch, sigh_batch in zip(dts, dFs, f107s, sigps, sighs):
+        outs = estimator.get_conductance(dt, dF=dF, f107=f107)
+        nptest.assert_array_equal(outs[0], mlat_grid)
+        nptest.assert_allclose(sigp_batch, outs[2], atol=1e-3)
+        nptest.assert_allclose(sigh_batch, outs[3], atol=1e-3)
+
+def test_seasons_loaded_on_first_use():
+    """
+    Only the seasons with nonzero weight for the days used should
+    have their coefficients loaded
+    """
+    estimator = ovationpyme.ovation_prime.FluxEstimator('diff', 'energy')
+    assert len(estimator._seasonal_flux_estimators) == 0
+    dt = datetime.datetime(2011, 4, 13, 1) #between spring equinox and summer solstice
+    estimator.get_flux_for_time(dt, dF=3134.17)
+    assert set(estimator._seasonal_flux_estimators.keys()) == set(['spring', 'summer'])
+    assert set(estimator.seasonal_flux_estimators.keys()) == set(['spring', 'summer', 'fall', 'winter'])
+
+def test_no_seasons_loaded_for_no_times():
+    """
+    The grids for no times should not need any coefficients
+    """
+    estimator = ovationpyme.ovation_prime.FluxEstimator('diff', 'energy')
+    grid_mlats, grid_mlts, fluxes = estimator.get_flux_for_times([])
+    assert len(estimator._seasonal_flux_estimators) == 0
+    assert fluxes.shape == (0,)+grid_mlats.shape
+    assert grid_mlats.shape == estimator.grid_shape()
+
+def test_both_hemispheres_same_as_separate(flux_estimator):
+    """
+    hemi='both' should give the same grids as separate calls for
+    each hemisphere
+    """
+    dt = datetime.datetime(2011, 4, 13, 1)
+    both = flux_estimator.get_flux_for_time(dt, hemi='both', dF=3134.17)
+    north = flux_estimator.get_flux_for_time(dt, hemi='N', dF=3134.17)
+    south = flux_estimator.get_flux_for_time(dt, hemi='S', dF=3134.17)
+    assert len(both) == 6
+    for both_out, separate_out in zip(both, north+south):
+        nptest.assert_array_equal(both_out, separate_out)
+
+@pytest.mark.parametrize('atype', ['diff', 'wave'])
+def test_coarse_grid_same_as_averaged_native(atype):
+    """
+    The coarse grid flux should match the native flux averaged onto the
+    coarse grid (exactly where the native grid is computed, closely where
+    the load time tables are interpolated)
+    """
+    coarsen = (2, 4)
+    native = ovationpyme.ovation_prime.SeasonalFluxEstimator('winter', atype, 'energy')
+    coarse = ovationpyme.ovation_prime.SeasonalFluxEstimator('winter', atype, 'energy', coarsen=coarsen)
+    row_mlats = native.mlats[native.n_mlat_bins//2:]
+    for dF in [800., 3134.17, 9000., 40000.]:
+        native_outs = native.get_gridded_flux(dF, interp_N=False)
+        coarse_outs = coarse.get_gridded_flux(dF, interp_N=False)
+        assert coarse_outs[2].shape == (40, 24)
+        nptest.assert_allclose(coarse_outs[2], ovationpyme.ovation_prime.coarsen_grid(native_outs[2], row_mlats,
+                                                                                      coarsen))
+        nptest.assert_allclose(coarse_outs[0], ovationpyme.ovation_prime.coarsen_grid(native_outs[0], row_mlats,
+                                                                                      coarsen))
+
+        native_fluxN = ovationpyme.ovation_prime.coarsen_grid(native.get_gridded_flux(dF)[2], row_mlats, coarsen)
+        coarse_fluxN = coarse.get_gridded_flux(dF)[2]
+        area = np.cos(np.radians(coarse_outs[0]))
+        nptest.assert_allclose(np.sum(coarse_fluxN*area), np.sum(native_fluxN*area), rtol=.02)
+
+def test_flux_ensemble_same_as_members(flux_estimator):
+    """
+    The ensemble statistics should match the flux of each member
+    computed separately
+    """
+    dt = datetime.datetime(2011, 4, 13, 1)
+    dFs = np.array([800., 1500., 2500., 3134.17, 4000., 6000., 9000.])
+    grid_mlats, grid_mlts, ensemble = flux_estimator.get_flux_ensemble(dt, dFs=dFs, percentiles=[10., 50., 90.],
+                                                                       return_members=True)
+    members = np.array([flux_estimator.get_flux_for_time(dt, dF=dF)[2] for dF in dFs])
+    nptest.assert_array_equal(ensemble['members'], members)
+    nptest.assert_allclose(ensemble['mean'], members.mean(axis=0))
+    nptest.assert_allclose(ensemble['std'], members.std(axis=0))
+    assert list(ensemble['percentiles'].keys()) == [10., 50., 90.]
+    for q, gridflux in ensemble['percentiles'].items():
+        nptest.assert_allclose(gridflux, np.percentile(members, q, axis=0))
+
+def test_flux_ensemble_from_distribution(flux_estimator):
+    stats = pytest.importorskip('scipy.stats')
+    dt = datetime.datetime(2011, 4, 13, 1)
+    distribution = stats.lognorm(.3, scale=3134.17)
+    outs = flux_estimator.get_flux_ensemble(dt, dF_distribution=distribution, n_members=20,
+                                            hemi='both', random_state=0)
+    assert len(outs) == 6
+    nptest.assert_array_equal(outs[2]['dF'], distribution.rvs(size=20, random_state=0))
+    with pytest.raises(ValueError):
+        flux_estimator.get_flux_ensemble(dt)
+
+def test_out_arrays_same_as_new_arrays():
+    """
+    Passing out arrays should give the same results as new arrays,
+    written into (and returned as) the arrays passed
+    """
+    dt = datetime.datetime(2011, 4, 13, 1)
+    estimator = ovationpyme.ovation_prime.ConductanceEstimator(fluxtypes=['diff'])
+    eavg_estimator = estimator.eavg_estimator['diff']
+    flux_estimator = estimator.numflux_estimator['diff']
+    #method, keyword arguments and the indices of the outputs written to out
+    calls = [(flux_estimator.get_flux_for_time, {'hemi': 'both'}, [2, 5]),
+             (eavg_estimator.get_eavg_for_time, {'hemi': 'S'}, [2]),
+             (estimator.get_conductance, {'f107': 120.}, [2, 3])]
+    for method, kwargs, i_outs in calls:
+        expected = method(dt, dF=3134.17, **kwargs)
+        out = tuple(np.empty(expected[i_out].shape) for i_out in i_outs)
+        outs = method(dt, dF=3134.17, out=out if len(out) > 1 else out[0], **kwargs)
+        for result, expected_result in zip(outs, expected):
+            nptest.assert_array_equal(result, expected_result)
+        for i_out, out_array in zip(i_outs, out):
+            assert outs[i_out] is out_array
+
+    #The grid coordinates are made once and can not be modified
+    grid_mlats = flux_estimator.get_flux_for_time(dt, hemi='S', dF=1000.)[0]
+    assert grid_mlats is flux_estimator.get_flux_for_time(dt, hemi='S', dF=2000.)[0]
+    with pytest.raises(ValueError):
+        grid_mlats[0, 0] = 0.
+
+def test_no_grid_allocations_with_out(flux_estimator):
+    """
+    A loop which passes out arrays should not allocate any grids
+    after the first call
+    """
+    import tracemalloc
+    pytest.importorskip('numba')
+    dt = datetime.datetime(2011, 4, 13, 1)
+    eavg_estimator = ovationpyme.ovation_prime.AverageEnergyEstimator('diff', energyflux_estimator=flux_estimator)
+    out = np.empty(flux_estimator.grid_shape())
+    for method in [flux_estimator.get_flux_for_time, eavg_estimator.get_eavg_for_time]:
+        method(dt, dF=3134.17, out=out)
+        tracemalloc.start()
+        try:
+            for dF in [1000., 2000., 4000.]:
+                method(dt, dF=dF, out=out)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        assert peak < out.nbytes
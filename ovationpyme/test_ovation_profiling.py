@@ -0,0 +1,50 @@
+import pytest
+
+from ovationpyme import ovation_profiling
+from ovationpyme.ovation_prime import SeasonalFluxEstimator, FluxEstimator, ConductanceEstimator, BinCorrector
+"""
+Unit Tests for the stage timing instrumentation
+"""
+
+@pytest.fixture()
+def seasonal_flux_estimator(request):
+    return SeasonalFluxEstimator('winter', 'diff', 'energy')
+
+def test_profiling_records_stages(seasonal_flux_estimator):
+    with ovation_profiling.profiling() as stats:
+        mlatgridN, mltgridN, fluxgridN = seasonal_flux_estimator.get_gridded_flux(3000.)[:3]
+        BinCorrector(mlatgridN, mltgridN).fix(fluxgridN)
+    assert stats['get_gridded_flux']['calls'] == 1
+    assert stats['interp_wedge']['calls'] == 1
+    assert stats['BinCorrector.fix']['calls'] == 1
+    assert stats['get_gridded_flux']['total_s'] >= stats['interp_wedge']['total_s']
+    assert not ovation_profiling.is_enabled()
+
+def test_nothing_recorded_when_disabled(seasonal_flux_estimator):
+    ovation_profiling.disable()
+    ovation_profiling.reset()
+    seasonal_flux_estimator.get_gridded_flux(3000.)
+    assert len(ovation_profiling.report()) == 0
+
+def test_table_memory_counts_shared_tables_once():
+    flux_estimator = FluxEstimator('diff', 'number')
+    flux_estimator.preload(['winter'])
+    memory = ovation_profiling.table_memory(flux_estimator)
+    seasonal = flux_estimator.get_seasonal_estimator('winter')
+    assert list(memory.keys()) == [('winter', name) for name in seasonal.coefficient_tables()]
+    assert memory[('winter', 'prob')] == seasonal.prob.nbytes
+
+    #The AverageEnergyEstimator of the conductance shares its number flux estimator
+    estimator = ConductanceEstimator(fluxtypes=['diff'], numflux_estimators={'diff': flux_estimator})
+    estimator.eavg_estimator['diff'].energyflux_estimator.preload(['winter'])
+    memory = ovation_profiling.table_memory(estimator)
+    assert len(memory) == 2*len(seasonal.coefficient_tables())
+    assert sum(memory.values()) == 2*sum(ovation_profiling.table_memory(seasonal).values())
+
+def test_memory_profiling_reports_tables():
+    with ovation_profiling.memory_profiling() as memory:
+        estimator = SeasonalFluxEstimator('summer', 'wave', 'energy')
+    table_bytes = sum(ovation_profiling.table_memory(estimator).values())
+    assert memory['current_bytes'] >= table_bytes
+    assert memory['peak_bytes'] >= memory['current_bytes']
+    assert ovation_profiling.peak_rss_bytes() > table_bytes
@@ -0,0 +1,74 @@
+import os
+import datetime
+import multiprocessing
+import pytest
+
+import numpy as np
+from numpy import testing as nptest
+
+from ovationpyme import ovation_reanalysis
+from ovationpyme.ovation_prime import FluxEstimator, ConductanceEstimator
+"""
+Unit Tests for the file based reanalysis work queue
+"""
+
+startdt = datetime.datetime(2015, 3, 17, 10)
+step = datetime.timedelta(minutes=30)
+
+@pytest.fixture()
+def archive_file(archive, tmpdir):
+    #The workers load the drivers from the file
+    filename = os.path.join(str(tmpdir), 'drivers.npz')
+    archive.save(filename)
+    return filename
+
+def test_claims_are_exclusive(tmpdir):
+    queue = ovation_reanalysis.WorkQueue.create(str(tmpdir), 3)
+    claims = [queue.claim('a'), queue.claim('b'), queue.claim('a'), queue.claim('b')]
+    assert claims == [0, 1, 2, None]
+    queue.complete(1, 'b')
+    assert queue.status() == {'pending': 0, 'claimed': 2, 'done': 1, 'total': 3}
+    #Claims which are not refreshed are given to other workers
+    assert queue.requeue_stale(-1.) == [0, 2]
+    assert queue.claim('c') == 0
+
+@pytest.mark.parametrize('archive', [(np.linspace(1500., 9000., 8), np.linspace(100., 170., 8))], indirect=True)
+def test_workers_same_as_batched(tmpdir, archive_file, assert_conductance_close):
+    """
+    Several worker processes sharing a queue should produce the same
+    grids as evaluating all of the times at once
+    """
+    directory = os.path.join(str(tmpdir), 'run')
+    dts = [startdt+i*step for i in range(7)]
+    ovation_reanalysis.create(directory, startdt, startdt+7*step, step, unit_size=2,
+                              fluxes=[('diff', 'energy')], conductance=True, index_archive=archive_file)
+    processes = [multiprocessing.Process(target=ovation_reanalysis.run_worker, args=(directory,),
+                                         kwargs={'worker_id': 'worker{0}'.format(i)}) for i in range(3)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+        assert process.exitcode == 0
+    assert ovation_reanalysis.WorkQueue(directory).status()['done'] == 4
+    #Nothing is left to run
+    assert ovation_reanalysis.run_worker(directory) == []
+
+    output = os.path.join(str(tmpdir), 'output')
+    names = ovation_reanalysis.consolidate(directory, output)
+    assert set(names) == set(['time', 'dF', 'f107', 'mlat_N', 'mlat_S', 'mlt', 'diff_energy_flux_N',
+                              'diff_energy_flux_S', 'sigp_N', 'sigh_N', 'sigp_S', 'sigh_S'])
+    load = lambda name: np.load(os.path.join(output, name+'.npy'), mmap_mode='r')
+    nptest.assert_array_equal(load('time'), np.array(dts, dtype='datetime64[s]'))
+    nptest.assert_array_equal(load('dF'), np.linspace(1500., 9000., 8)[:7])
+    outs = FluxEstimator('diff', 'energy').get_flux_for_times(dts, hemi='both')
+    nptest.assert_array_equal(load('mlat_S'), outs[3][:, 0])
+    nptest.assert_array_equal(load('diff_energy_flux_N'), outs[2])
+    nptest.assert_array_equal(load('diff_energy_flux_S'), outs[5])
+    sigps = ConductanceEstimator(fluxtypes=['diff']).get_conductance_for_times(dts, hemi='S')[2]
+    assert_conductance_close(load('sigp_S'), sigps)
+
+def test_consolidate_needs_all_units(tmpdir):
+    directory = str(tmpdir)
+    ovation_reanalysis.create(directory, startdt, startdt+3*step, step, unit_size=2)
+    with pytest.raises(RuntimeError):
+        ovation_reanalysis.consolidate(directory, os.path.join(directory, 'output'))
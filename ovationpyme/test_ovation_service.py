@@ -0,0 +1,96 @@
+import io
+import json
+import asyncio
+import datetime
+import threading
+import pytest
+import numpy as np
+from numpy import testing as nptest
+
+from ovationpyme.ovation_service import NowcastService
+"""
+Unit Tests for the nowcast HTTP service, using a fixed solar wind
+stand-in so no OMNI data is needed
+"""
+
+class CountingProvider(object):
+    """Offline stand-in for calc_dF/get_daily_f107"""
+    def __init__(self, value):
+        self.value = value
+        self.n_calls = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, dt):
+        with self._lock:
+            self.n_calls += 1
+        return self.value
+
+@pytest.fixture(scope='module')
+def service(request):
+    service = NowcastService(atypes=['diff'], conductance_fluxtypes=['diff'],
+                             dF_provider=CountingProvider(3000.),
+                             f107_provider=CountingProvider(120.),
+                             cache_size=2)
+    request.addfinalizer(service.close)
+    return service
+
+async def _http_get(port, target):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    writer.write('GET {0} HTTP/1.1\r\nHost: localhost\r\n\r\n'.format(target).encode())
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    header, body = response.split(b'\r\n\r\n', 1)
+    return int(header.split()[1]), body
+
+def _run_requests(service, targets):
+    async def run():
+        server = await service.start(port=0)
+        port = server.sockets[0].getsockname()[1]
+        async with server:
+            return await asyncio.gather(*[_http_get(port, target) for target in targets])
+    return asyncio.run(run())
+
+def test_concurrent_requests_are_coalesced(service):
+    target = '/grid?product=flux&atype=diff&fluxtype=energy&time=2011-04-13T01:00&hemi=N'
+    n_before = service.n_computed
+    responses = _run_requests(service, [target]*5)
+    assert service.n_computed == n_before+1
+    for status, body in responses:
+        assert status == 200
+        result = json.loads(body.decode())
+        assert result['dF'] == 3000.
+        assert np.array(result['flux'], dtype=float).shape == (80, 96)
+
+def test_grid_matches_estimator(service):
+    dt = datetime.datetime(2011, 4, 13, 2)
+    target = '/grid?product=eavg&atype=diff&time=2011-04-13T02:00&hemi=S&format=npz'
+    (status, body), = _run_requests(service, [target])
+    assert status == 200
+    arrays = np.load(io.BytesIO(body))
+    mlats, mlts, eavg = service.eavg_estimators['diff'].get_eavg_for_time(dt, hemi='S', dF=3000.)
+    nptest.assert_array_equal(arrays['mlat'], mlats)
+    nptest.assert_array_equal(arrays['eavg'], eavg)
+
+def test_cache_is_bounded(service):
+    targets = ['/grid?product=flux&atype=diff&fluxtype=number&time=2011-04-13T0{0}:00'.format(hour)
+               for hour in range(3, 7)]
+    _run_requests(service, targets)
+    assert len(service._cache) <= service.cache_size
+
+def test_bad_requests(service):
+    targets = ['/grid?product=flux&atype=mono&fluxtype=energy',
+               '/point?product=conductance&time=2011-04-13T01:00&mlat=65&mlt=1,2',
+               '/nothing']
+    statuses = [status for status, body in _run_requests(service, targets)]
+    assert statuses == [400, 400, 404]
+
+def test_bad_requests_are_not_computed(service):
+    targets = ['/point?product=flux&time=2011-04-13T09:00&mlat=65&mlt=1,2',
+               '/point?product=flux&time=2011-04-13T09:00&mlat=65&mlt=1&method=spline',
+               '/grid?product=flux&time=2011-04-13T09:00&format=csv']
+    n_before, n_cached = service.n_computed, len(service._cache)
+    statuses = [status for status, body in _run_requests(service, targets)]
+    assert statuses == [400, 400, 400]
+    assert service.n_computed == n_before
+    assert len(service._cache) == n_cached
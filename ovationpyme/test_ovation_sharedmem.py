@@ -0,0 +1,56 @@
+import datetime
+import pickle
+import multiprocessing
+import pytest
+
+from numpy import testing as nptest
+
+from ovationpyme.ovation_prime import FluxEstimator
+from ovationpyme.ovation_sharedmem import SharedCoefficientTables, SharedArray
+"""
+Unit Tests for the coefficient tables and results shared between processes
+"""
+
+dt = datetime.datetime(2011, 4, 13, 1)
+dFs = [1000., 3134.17, 6000., 9000.]
+
+def flux_into_shared_results(args):
+    tables, results, i_dF = args
+    estimator = tables.flux_estimator('diff', 'energy')
+    results.array[i_dF] = estimator.get_flux_for_time(dt, dF=dFs[i_dF])[2]
+    seasonal = estimator.get_seasonal_estimator('spring')
+    return [table.flags.owndata for table in seasonal.coefficient_tables().values()]
+
+@pytest.fixture(params=['shm', 'memmap'])
+def shared_tables(request, tmp_path):
+    filename = None if request.param == 'shm' else str(tmp_path / 'coefficients.bin')
+    tables = SharedCoefficientTables.create(atypes=['diff', 'wave'], energy_or_numbers=['energy'],
+                                            filename=filename)
+    yield tables
+    tables.unlink()
+
+def test_shared_tables_pickle_small(shared_tables):
+    assert len(pickle.dumps(shared_tables)) < shared_tables.nbytes//100
+
+def test_pool_workers_use_shared_tables(shared_tables):
+    """
+    Workers using the shared tables and writing into a shared result
+    array should give the same flux as an estimator reading the files
+    """
+    expected = [FluxEstimator('diff', 'energy').get_flux_for_time(dt, dF=dF)[2] for dF in dFs]
+    with SharedArray.create((len(dFs),)+expected[0].shape) as results:
+        with multiprocessing.get_context('fork').Pool(2) as pool:
+            owndata = pool.map(flux_into_shared_results,
+                               [(shared_tables, results, i_dF) for i_dF in range(len(dFs))])
+        fluxes = results.array.copy()
+    assert not any(any(task_owndata) for task_owndata in owndata)
+    for flux, expected_flux in zip(fluxes, expected):
+        nptest.assert_array_equal(flux, expected_flux)
+
+def test_shared_tables_include_active_bins(shared_tables):
+    estimator = shared_tables.flux_estimator('wave', 'energy').get_seasonal_estimator('winter')
+    assert estimator.active_bins is not None
+    assert not estimator.active_bins.grid_index.flags.owndata
+    expected = FluxEstimator('wave', 'energy').get_flux_for_time(dt, dF=dFs[1])[2]
+    nptest.assert_array_equal(shared_tables.flux_estimator('wave', 'energy').get_flux_for_time(dt, dF=dFs[1])[2],
+                              expected)
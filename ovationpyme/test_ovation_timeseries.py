@@ -0,0 +1,114 @@
+import datetime
+import pytest
+
+from numpy import testing as nptest
+
+from ovationpyme.ovation_prime import FluxEstimator, ConductanceEstimator
+from ovationpyme.ovation_timeseries import (time_range, iter_flux, iter_conductance, interpolation_knots,
+                                           interpolation_error)
+"""
+Unit Tests for the streaming time series generators
+"""
+
+startdt = datetime.datetime(2015, 3, 17, 10)
+step = datetime.timedelta(minutes=30)
+
+def test_time_range():
+    dts = list(time_range(startdt, startdt+datetime.timedelta(hours=2), step))
+    assert dts == [startdt+i*step for i in range(4)]
+
+@pytest.mark.parametrize('readahead', [True, False])
+def test_iter_flux_same_as_per_time(archive, readahead):
+    estimator = FluxEstimator('diff', 'energy')
+    enddt = startdt+4*step
+    n_times = 0
+    for i_time, (dt, grids) in enumerate(iter_flux(startdt, enddt, step, hemis=['N', 'S'], chunk_size=3,
+                                                   readahead=readahead,
+                                                   estimators={('diff', 'energy'): estimator})):
+        assert dt == startdt+i_time*step
+        assert list(grids.keys()) == [('diff', 'energy', 'N'), ('diff', 'energy', 'S')]
+        for hemi in ['N', 'S']:
+            mlat_grid, mlt_grid, gridflux = estimator.get_flux_for_time(dt, hemi=hemi, dF=archive.dF[i_time])
+            nptest.assert_array_equal(grids[('diff', 'energy', hemi)][0], mlat_grid)
+            nptest.assert_array_equal(grids[('diff', 'energy', hemi)][2], gridflux)
+        n_times += 1
+    assert n_times == 4
+
+def test_iter_conductance_same_as_batched(archive, assert_conductance_close):
+    estimator = ConductanceEstimator(fluxtypes=['diff'])
+    dts = [startdt+i*step for i in range(3)]
+    mlat_grid, mlt_grid, sigps, sighs = estimator.get_conductance_for_times(dts, hemi='N', dFs=archive.dF[:3],
+                                                                            f107s=archive.f107[:3])
+    for i_time, (dt, grids) in enumerate(iter_conductance(startdt, startdt+3*step, step, chunk_size=2,
+                                                          estimator=estimator)):
+        assert_conductance_close(grids['N'][2], sigps[i_time])
+        assert_conductance_close(grids['N'][3], sighs[i_time])
+
+def test_iter_flux_interpolated(archive):
+    """Exact at the exact_step times, linear in time between them"""
+    estimator = FluxEstimator('diff', 'energy')
+    enddt = startdt+7*step
+    exact = list(iter_flux(startdt, enddt, step, hemis=['N', 'S'], estimators={('diff', 'energy'): estimator}))
+    interpolated = list(iter_flux(startdt, enddt, step, hemis=['N', 'S'], chunk_size=2,
+                                  estimators={('diff', 'energy'): estimator}, exact_step=3*step))
+    assert [dt for dt, grids in interpolated] == [dt for dt, grids in exact]
+    for key in [('diff', 'energy', 'N'), ('diff', 'energy', 'S')]:
+        fluxes = [grids[key][2] for dt, grids in exact]
+        interpolated_fluxes = [grids[key][2] for dt, grids in interpolated]
+        for i_time in [0, 3, 6]:
+            nptest.assert_array_equal(interpolated_fluxes[i_time], fluxes[i_time])
+        nptest.assert_allclose(interpolated_fluxes[1], fluxes[0]+(fluxes[3]-fluxes[0])/3.)
+        nptest.assert_allclose(interpolated_fluxes[5], fluxes[3]+(fluxes[6]-fluxes[3])*2./3.)
+
+@pytest.mark.parametrize('readahead', [True, False])
+def test_iter_flux_interpolated_refined_by_chunk(archive, readahead, monkeypatch):
+    """
+    With dF_tolerance the model is exact at the same times as
+    interpolation_knots finds for the whole range, and with readahead
+    the coupling of the exact_step times is computed in the background
+    """
+    import threading
+    from ovationpyme import ovation_utilities
+    estimator = FluxEstimator('diff', 'energy')
+    enddt = startdt+7*step
+    dts = list(time_range(startdt, enddt+step, step))
+    knots, _ = interpolation_knots(dts, 4*step, dF_tolerance=2500.)
+    assert knots == [0, 2, 4, 5, 7]
+    exact = list(iter_flux(startdt, enddt+step, step, estimators={('diff', 'energy'): estimator}))
+
+    calc_dF = ovation_utilities.calc_dF
+    threads = []
+    def recording_calc_dF(dt, **kwargs):
+        threads.append(threading.current_thread())
+        return calc_dF(dt, **kwargs)
+    monkeypatch.setattr(ovation_utilities, 'calc_dF', recording_calc_dF)
+    interpolated = list(iter_flux(startdt, enddt+step, step, chunk_size=2, readahead=readahead,
+                                  estimators={('diff', 'energy'): estimator}, exact_step=4*step,
+                                  dF_tolerance=2500.))
+    assert [dt for dt, grids in interpolated] == dts
+    for i_time in knots:
+        nptest.assert_array_equal(interpolated[i_time][1][('diff', 'energy', 'N')][2],
+                                  exact[i_time][1][('diff', 'energy', 'N')][2])
+    assert len(threads) == len(knots)
+    in_background = [thread is not threading.current_thread() for thread in threads]
+    assert any(in_background) == readahead
+
+def test_interpolation_knots_refined(archive):
+    """Times between exact times are added where dF changes by more
+    than the tolerance"""
+    dts = list(time_range(startdt, startdt+8*step, step))
+    knots, dFs = interpolation_knots(dts, 4*step)
+    assert knots == [0, 4, 7]
+    nptest.assert_array_equal(dFs, archive.dF[knots])
+    #The archive dF increases by ~1071 each step
+    knots, dFs = interpolation_knots(dts, 4*step, dF_tolerance=2500.)
+    assert knots == [0, 2, 4, 5, 7]
+    with pytest.raises(ValueError):
+        interpolation_knots(dts, step*1.5)
+
+def test_interpolation_error(archive):
+    errors = interpolation_error(startdt, startdt+7*step, step, 3*step, hemis=['N'])
+    error = errors[('diff', 'energy', 'N')]
+    assert error['n_times'] == 7 and error['n_exact'] == 3
+    assert 0. < error['max_abs_error'] and 0. < error['rms_error'] <= error['max_abs_error']
+    assert interpolation_error(startdt, startdt+7*step, step, step)[('diff', 'energy', 'N')]['max_abs_error'] == 0.
@@ -2,6 +2,7 @@ import datetime
 import pytest
 import numpy as np
 from numpy import testing as nptest
+from ovationpyme import ovation_utilities
 from ovationpyme.ovation_utilities import read_solarwind 
 """
 Unit Tests for Ovation Prime Utilities
@@ -13,3 +14,134 @@ def test_read_solarwind():
     sw = read_solarwind(dt)
     assert 'Ec' in sw
 
+def test_sample_center_jds():
+    """1 minute samples are used as is, coarser samples are binned by
+    the centers of the minutes they average"""
+    jd = 2457000.5+np.arange(3)/24.
+    nptest.assert_array_equal(ovation_utilities.sample_center_jds(jd,'1min'),jd)
+    nptest.assert_allclose(ovation_utilities.sample_center_jds(jd,'5min')-jd,2./1440.,rtol=1e-6)
+    nptest.assert_allclose(ovation_utilities.sample_center_jds(jd,'hourly')-jd,29.5/1440.,rtol=1e-6)
+    with pytest.raises(ValueError):
+        ovation_utilities.sample_center_jds(jd,'2min')
+
+@pytest.mark.parametrize('cadence',ovation_utilities.solarwind_cadences)
+def test_calc_dF_cadence(cadence):
+    dt = datetime.datetime(2000,1,1,12,34,51)
+    dF = ovation_utilities.calc_dF(dt,cadence=cadence)
+    assert np.isfinite(dF)
+
+class StandInInterval(object):
+    """Synthetic OMNI data (a function of time only, so any interval
+    has the same values at the same times)"""
+    def __init__(self,startdt,enddt,cadence):
+        step = {'1min':60,'5min':300,'hourly':3600}[cadence]
+        self.startdt,self.enddt,self.cadence = startdt,enddt,cadence
+        n_samples = int((enddt-startdt).total_seconds()//step)
+        self.data = {'Epoch':np.array([startdt+datetime.timedelta(seconds=step*i) for i in range(n_samples)])}
+        t = np.array([(dt-datetime.datetime(2000,1,1)).total_seconds()/3600. for dt in self.data['Epoch']])
+        self.data.update(BX_GSE=np.sin(t),BY_GSM=3*np.cos(t/3.),BZ_GSM=-4*np.sin(t/5.),
+                         flow_speed=400+50*np.sin(t/7.),proton_density=5+np.cos(t),F10_INDEX=100+t/24.)
+        self.data.update(V=self.data['flow_speed'],N=self.data['proton_density'])
+
+    def __getitem__(self,varname):
+        return self.data[varname]
+
+class DelayedProvider(object):
+    """Stand-in for reading OMNI data, which takes delay seconds and
+    records the thread each interval is loaded in"""
+    def __init__(self,delay):
+        self.delay = delay
+        self.threads = []
+
+    def __call__(self,startdt,enddt,cadence):
+        import time
+        import threading
+        time.sleep(self.delay)
+        self.threads.append(threading.current_thread())
+        return StandInInterval(startdt,enddt,cadence)
+
+@pytest.fixture
+def empty_omni_cache():
+    ovation_utilities._omni_interval_cache.clear()
+    yield
+    ovation_utilities.set_omni_prefetch(None)
+    ovation_utilities._omni_interval_cache.clear()
+
+def test_omni_prefetch_loads_next_window_in_background(empty_omni_cache):
+    """Sequential times only load the first interval in the calling
+    thread, the following ones are prefetched, and give the same dF"""
+    import threading
+    dts = [datetime.datetime(2000,1,1)+datetime.timedelta(hours=3*i) for i in range(64)]
+    #An interval around each time, as without prefetching
+    ovation_utilities.set_omni_prefetch(ovation_utilities.OmniPrefetcher(provider=StandInInterval,lead_hours=0.))
+    expected = []
+    for dt in dts:
+        ovation_utilities._omni_interval_cache.clear()
+        expected.append(ovation_utilities.calc_dF(dt))
+    ovation_utilities._omni_interval_cache.clear()
+
+    provider = DelayedProvider(0.05)
+    prefetcher = ovation_utilities.OmniPrefetcher(provider=provider)
+    ovation_utilities.set_omni_prefetch(prefetcher)
+    try:
+        dFs = [ovation_utilities.calc_dF(dt) for dt in dts]
+    finally:
+        prefetcher.close()
+    nptest.assert_array_equal(dFs,expected)
+    assert prefetcher.n_loaded == 1
+    assert prefetcher.n_used >= 2
+    assert provider.threads[0] is threading.current_thread()
+    assert all(thread is not threading.current_thread() for thread in provider.threads[1:])
+
+def test_omni_prefetch_not_used_for_other_times(empty_omni_cache):
+    """A time moving backwards does not prefetch, and a jump away from
+    the prefetched interval loads the interval it needs"""
+    prefetcher = ovation_utilities.OmniPrefetcher(provider=DelayedProvider(0.),lead_hours=12.)
+    ovation_utilities.set_omni_prefetch(prefetcher)
+    try:
+        dt = datetime.datetime(2000,1,1)
+        ovation_utilities.calc_dF(dt)
+        ovation_utilities.calc_dF(dt-datetime.timedelta(hours=1))
+        assert prefetcher.n_prefetched == 0
+        ovation_utilities.calc_dF(dt+datetime.timedelta(hours=30))
+        assert prefetcher.n_prefetched == 1
+        ovation_utilities.calc_dF(dt+datetime.timedelta(days=10))
+        assert prefetcher.n_loaded == 2
+        assert prefetcher.n_used == 0
+    finally:
+        prefetcher.close()
+
+def test_waiting_for_prefetch_does_not_block_cache(empty_omni_cache):
+    """A thread waiting for a prefetched interval does not stop other
+    threads using intervals which are already cached"""
+    import threading
+    loaded = threading.Event()
+    main_thread = threading.current_thread()
+    def gated_provider(startdt,enddt,cadence):
+        #Intervals prefetched in the background load only when allowed
+        if threading.current_thread() is not main_thread:
+            loaded.wait(10.)
+        return StandInInterval(startdt,enddt,cadence)
+    prefetcher = ovation_utilities.OmniPrefetcher(provider=gated_provider,lead_hours=12.)
+    ovation_utilities.set_omni_prefetch(prefetcher)
+    dt = datetime.datetime(2000,1,1)
+    try:
+        hourly_dF = ovation_utilities.calc_dF(dt,cadence='hourly')
+        ovation_utilities.calc_dF(dt)
+        ovation_utilities.calc_dF(dt+datetime.timedelta(hours=30))
+        assert prefetcher.n_prefetched == 1
+        waiting = threading.Thread(target=ovation_utilities.calc_dF,args=(dt+datetime.timedelta(hours=36),))
+        waiting.start()
+        other = threading.Thread(target=ovation_utilities.calc_dF,args=(dt,'hourly'))
+        other.start()
+        other.join(5.)
+        assert not other.is_alive()
+        assert waiting.is_alive()
+        loaded.set()
+        waiting.join(5.)
+        assert not waiting.is_alive()
+        assert prefetcher.n_used == 1
+        assert ovation_utilities.calc_dF(dt,cadence='hourly') == hourly_dF
+    finally:
+        loaded.set()
+        prefetcher.close()
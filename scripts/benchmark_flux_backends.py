@@ -0,0 +1,49 @@
+"""
+Time SeasonalFluxEstimator.get_gridded_flux and FluxEstimator.get_flux_for_time
+with each of the available backends, and check them against the per-bin
+'python' reference implementation.
+
+python scripts/benchmark_flux_backends.py [n_repeats]
+"""
+import sys
+import time
+import datetime
+
+import numpy as np
+
+from ovationpyme import ovation_kernels
+from ovationpyme.ovation_prime import SeasonalFluxEstimator, FluxEstimator
+
+def best_time(func, n_repeats):
+    func() #warm up (compiles the numba kernels)
+    times = []
+    for i in range(n_repeats):
+        t0 = time.perf_counter()
+        func()
+        times.append(time.perf_counter()-t0)
+    return min(times)
+
+if __name__ == '__main__':
+    n_repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    dF = 3134.17
+    dt = datetime.datetime(2011, 4, 13, 1)
+
+    seasonal_estimator = SeasonalFluxEstimator('winter', 'diff', 'energy')
+    estimator = FluxEstimator('diff', 'energy')
+    reference = seasonal_estimator.get_gridded_flux(dF, backend='python')
+
+    print('{0:<8s}{1:>24s}{2:>24s}{3:>12s}{4:>16s}'.format('backend', 'get_gridded_flux [ms]',
+                                                           'get_flux_for_time [ms]', 'speedup',
+                                                           'max abs diff'))
+    python_time = None
+    for backend in ovation_kernels.available_backends():
+        grid_time = best_time(lambda: seasonal_estimator.get_gridded_flux(dF, backend=backend), n_repeats)
+        estimator.backend = backend
+        time_time = best_time(lambda: estimator.get_flux_for_time(dt, dF=dF), n_repeats)
+        if python_time is None:
+            python_time = grid_time
+        outs = seasonal_estimator.get_gridded_flux(dF, backend=backend)
+        max_diff = max([np.nanmax(np.abs(out-ref)) for out, ref in zip(outs[2::3], reference[2::3])])
+        print('{0:<8s}{1:>24.3f}{2:>24.3f}{3:>12.1f}{4:>16.3g}'.format(backend, grid_time*1000.,
+                                                                      time_time*1000.,
+                                                                      python_time/grid_time, max_diff))
@@ -0,0 +1,97 @@
+"""
+Memory needed by each estimator type: the tables it holds, the steady
+state and peak allocation while building it and while running time
+steps, and the peak resident set size. Each configuration is measured in
+a new process, since the peak RSS of a process never decreases (it
+includes a throwaway warm-up build).
+
+python scripts/benchmark_memory.py [n_steps] [--batched]
+"""
+import gc
+import sys
+import json
+import datetime
+import subprocess
+
+import numpy as np
+
+from ovationpyme import ovation_profiling
+from ovationpyme.ovation_prime import FluxEstimator, AverageEnergyEstimator, ConductanceEstimator
+
+configurations = ['flux', 'eavg', 'conductance_diff', 'conductance_diff_mono_wave', 'flux_coarse']
+
+def build(configuration):
+    if configuration == 'flux':
+        return FluxEstimator('diff', 'energy').preload()
+    elif configuration == 'flux_coarse':
+        return FluxEstimator('diff', 'energy', coarsen=(2, 4)).preload()
+    elif configuration == 'eavg':
+        estimator = AverageEnergyEstimator('diff')
+        estimator.numflux_estimator.preload()
+        estimator.energyflux_estimator.preload()
+        return estimator
+    fluxtypes = configuration.split('_')[1:]
+    estimator = ConductanceEstimator(fluxtypes=fluxtypes)
+    for fluxtype in fluxtypes:
+        estimator.numflux_estimator[fluxtype].preload()
+        estimator.eavg_estimator[fluxtype].energyflux_estimator.preload()
+    return estimator
+
+def run(configuration, estimator, dts, dFs, f107s, batched):
+    """Time steps with the drivers passed, so no solar wind data is read"""
+    if configuration.startswith('conductance'):
+        fluxtypes = configuration.split('_')[1:]
+        if batched:
+            estimator.get_conductance_for_times(dts, conductance_fluxtypes=fluxtypes, dFs=dFs, f107s=f107s)
+        else:
+            for dt, dF, f107 in zip(dts, dFs, f107s):
+                estimator.get_conductance(dt, conductance_fluxtypes=fluxtypes, dF=dF, f107=f107)
+    elif configuration == 'eavg':
+        if batched:
+            estimator.get_eavg_for_times(dts, dFs=dFs)
+        else:
+            for dt, dF in zip(dts, dFs):
+                estimator.get_eavg_for_time(dt, dF=dF)
+    else:
+        if batched:
+            estimator.get_flux_for_times(dts, dFs=dFs)
+        else:
+            for dt, dF in zip(dts, dFs):
+                estimator.get_flux_for_time(dt, dF=dF)
+
+def measure(configuration, n_steps, batched):
+    dts = [datetime.datetime(2011, 4, 13)+datetime.timedelta(minutes=10*i) for i in range(n_steps)]
+    dFs = np.linspace(1000., 8000., n_steps)
+    f107s = np.full(n_steps, 120.)
+    #A throwaway build and step first, so the one time allocations (numba
+    #compilation, imports) are not counted as the estimator's
+    run(configuration, build(configuration), dts[:1], dFs[:1], f107s[:1], batched)
+    gc.collect()
+    with ovation_profiling.memory_profiling() as build_memory:
+        estimator = build(configuration)
+    with ovation_profiling.memory_profiling() as run_memory:
+        run(configuration, estimator, dts, dFs, f107s, batched)
+    return {'tables': sum(ovation_profiling.table_memory(estimator).values()),
+            'build_current': build_memory['current_bytes'], 'build_peak': build_memory['peak_bytes'],
+            'run_current': run_memory['current_bytes'], 'run_peak': run_memory['peak_bytes'],
+            'peak_rss': ovation_profiling.peak_rss_bytes()}
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == '--measure':
+        print(json.dumps(measure(sys.argv[2], int(sys.argv[3]), sys.argv[4] == 'batched')))
+        sys.exit(0)
+
+    n_steps = int(sys.argv[1]) if len(sys.argv) > 1 and not sys.argv[1].startswith('--') else 24
+    batched = '--batched' in sys.argv
+    MB = 1.0e6
+    print('{0} time steps ({1}), memory in MB'.format(n_steps, 'batched' if batched else 'one at a time'))
+    print('{0:<28s}{1:>8s}{2:>14s}{3:>12s}{4:>12s}{5:>10s}{6:>10s}'.format('configuration', 'tables',
+                                                                         'build steady', 'build peak',
+                                                                         'run held', 'run peak', 'peak RSS'))
+    for configuration in configurations:
+        output = subprocess.check_output([sys.executable, __file__, '--measure', configuration, str(n_steps),
+                                          'batched' if batched else 'single'])
+        result = json.loads(output.decode('utf-8').strip().splitlines()[-1])
+        print('{0:<28s}{1:>8.1f}{2:>14.1f}{3:>12.1f}{4:>12.1f}{5:>10.1f}{6:>10.1f}'.format(
+            configuration, result['tables']/MB, result['build_current']/MB, result['build_peak']/MB,
+            result['run_current']/MB, result['run_peak']/MB, result['peak_rss']/MB))
@@ -0,0 +1,42 @@
+"""
+Build (or extend) an archive of precomputed Newell coupling and F10.7
+for the model (see ovationpyme.ovation_indices)
+
+python scripts/build_index_archive.py drivers.npz 2015-01-01 2016-01-01 [step_minutes] [--cadence hourly]
+python scripts/build_index_archive.py drivers.npz --extend 2016-02-01
+"""
+import os
+import argparse
+import datetime
+
+from ovationpyme.ovation_indices import IndexArchive
+
+def parse_date(datestr):
+    return datetime.datetime.strptime(datestr, '%Y-%m-%d')
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Precompute Ovation Prime dF and F10.7')
+    parser.add_argument('filename')
+    parser.add_argument('startdate', nargs='?', type=parse_date)
+    parser.add_argument('enddate', nargs='?', type=parse_date)
+    parser.add_argument('step_minutes', nargs='?', type=float, default=60.)
+    parser.add_argument('--extend', type=parse_date, help='Extend an existing archive to this date')
+    parser.add_argument('--cadence', default='1min', choices=['1min', '5min', 'hourly'],
+                        help='Cadence of the OMNI data used for the Newell coupling')
+    args = parser.parse_args()
+
+    if args.extend is not None:
+        archive = IndexArchive.load(args.filename)
+        archive.extend(args.extend)
+    elif args.startdate is not None and args.enddate is not None:
+        if os.path.exists(args.filename):
+            parser.error('{0} exists, use --extend to add to it'.format(args.filename))
+        archive = IndexArchive.build(args.startdate, args.enddate,
+                                     step=datetime.timedelta(minutes=args.step_minutes),
+                                     cadence=args.cadence)
+    else:
+        parser.error('Give a start and end date, or --extend')
+
+    archive.save(args.filename)
+    print('{0}: {1} values from {2} to {3} every {4}'.format(args.filename, len(archive), archive.startdt,
+                                                             archive.enddt, archive.step))
@@ -0,0 +1,56 @@
+"""
+Compare the Newell coupling (dF) computed from 1 minute, 5 minute and
+hourly OMNI solar wind data, and the time taken to read and average it
+
+python scripts/compare_solarwind_cadence.py [startdate] [ndays] [--markdown]
+
+--markdown prints the results as a table for the readme
+"""
+import time
+import argparse
+import datetime
+
+import numpy as np
+
+from ovationpyme.ovation_indices import compute_indices
+
+def parse_date(datestr):
+    return datetime.datetime.strptime(datestr, '%Y-%m-%d')
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare dF from 1 minute, 5 minute and hourly OMNI data')
+    parser.add_argument('startdate', nargs='?', type=parse_date, default=datetime.datetime(2015, 3, 10))
+    parser.add_argument('ndays', nargs='?', type=int, default=14)
+    parser.add_argument('--markdown', action='store_true', help='Print a markdown table')
+    args = parser.parse_args()
+
+    dts = [args.startdate+datetime.timedelta(hours=i) for i in range(24*args.ndays)]
+
+    dFs, read_times = {}, {}
+    for cadence in ['1min', '5min', 'hourly']:
+        t0 = time.time()
+        dFs[cadence], _ = compute_indices(dts, cadence=cadence)
+        read_times[cadence] = time.time()-t0
+
+    reference = dFs['1min']
+    rows = [('1min', np.nan, np.nan, np.nan, np.nan, read_times['1min'])]
+    for cadence in ['5min', 'hourly']:
+        diff = dFs[cadence]-reference
+        ok = np.logical_and(np.isfinite(diff), reference > 0)
+        percent = 100.*np.abs(diff[ok])/reference[ok]
+        rows.append((cadence, np.mean(diff[ok]), np.mean(np.abs(diff[ok])), np.max(np.abs(diff[ok])),
+                     np.median(percent), read_times[cadence]))
+
+    print('dF differences from 1 minute data, {0} to {1} ({2} hourly values)'.format(dts[0], dts[-1], len(dts)))
+    if args.markdown:
+        print('| cadence | mean | mean abs | max abs | median % | read time (s) |')
+        print('|---|---|---|---|---|---|')
+        for row in rows:
+            values = ['-' if not np.isfinite(value) else '{0:.1f}'.format(value) for value in row[1:4]]
+            values.append('-' if not np.isfinite(row[4]) else '{0:.2f}'.format(row[4]))
+            print('| {0} | {1} | {2:.2f} |'.format(row[0], ' | '.join(values), row[5]))
+    else:
+        print('{0:>6} {1:>12} {2:>12} {3:>12} {4:>10} {5:>10}'.format('', 'mean', 'mean abs', 'max abs',
+                                                                    'median %', 'read (s)'))
+        for row in rows:
+            print('{0:>6} {1:12.1f} {2:12.1f} {3:12.1f} {4:10.2f} {5:10.2f}'.format(*row))
@@ -44,9 +44,10 @@ if __name__ == '__main__':
             csv_row_data = []
             csv_row_data.append(dtstr)
             for atype in atypes:
-                for hemi in ['N','S']:
-                    outs = estimators[atype].get_flux_for_time(dt,hemi=hemi)
-                    grid_mlats,grid_mlts,energy_flux = outs
+                #Both hemispheres from one evaluation of the seasonal grids
+                outs = estimators[atype].get_flux_for_time(dt,hemi='both')
+                for i_hemi,hemi in enumerate(hemis):
+                    grid_mlats,grid_mlts,energy_flux = outs[3*i_hemi:3*i_hemi+3]
                     #Integrate flux over bins
                     intflux = grid_surface_integral(grid_mlats,grid_mlts,energy_flux,
                                                     Re,'hour')
@@ -0,0 +1,52 @@
+"""
+Render a movie of the auroral energy flux for a period (e.g. a storm)
+
+python scripts/render_flux_movie.py startdatetime enddatetime output [step_minutes] [atype] [hemi]
+
+The times are given as YYYY-mm-ddTHH:MM. If output ends with .gif or .mp4
+an animation is written, otherwise output is a directory for PNG frames.
+All of the frames use the 5th to 95th percentile of the flux of the whole
+period as the color limits.
+"""
+import os
+import sys
+import time
+import datetime
+
+import numpy as np
+import matplotlib
+matplotlib.use('Agg')
+
+from ovationpyme import ovation_plotting
+from ovationpyme.ovation_timeseries import iter_flux
+
+if __name__ == '__main__':
+    startdt = datetime.datetime.strptime(sys.argv[1], '%Y-%m-%dT%H:%M')
+    enddt = datetime.datetime.strptime(sys.argv[2], '%Y-%m-%dT%H:%M')
+    output = sys.argv[3]
+    step = datetime.timedelta(minutes=int(sys.argv[4]) if len(sys.argv) > 4 else 10)
+    atype = sys.argv[5] if len(sys.argv) > 5 else 'diff'
+    hemi = sys.argv[6] if len(sys.argv) > 6 else 'N'
+
+    t0 = time.time()
+    key = (atype, 'energy', hemi)
+    titles, fluxgrids = [], []
+    for dt, grids in iter_flux(startdt, enddt, step, atypes=[atype], hemis=[hemi]):
+        mlat_grid, mlt_grid, gridflux = grids[key]
+        titles.append('{0} {1} {2}'.format(atype, hemi, dt.strftime('%Y-%m-%d %H:%M')))
+        fluxgrids.append(gridflux)
+    fluxgrids = np.array(fluxgrids)
+    print('Model: {0:.1f} s for {1} times'.format(time.time()-t0, len(fluxgrids)))
+
+    t0 = time.time()
+    vmin, vmax = ovation_plotting.color_limits(fluxgrids)
+    renderer_kwargs = dict(hemisphere=hemi, colorbar_label='Energy flux [erg/cm^2/s]')
+    if output.lower().endswith('.gif') or output.lower().endswith('.mp4'):
+        ovation_plotting.save_animation(fluxgrids, output, mlat_grid, mlt_grid, vmin, vmax, titles=titles,
+                                        **renderer_kwargs)
+    else:
+        if not os.path.exists(output):
+            os.makedirs(output)
+        ovation_plotting.render_frames(fluxgrids, os.path.join(output, 'flux_{0:05d}.png'), mlat_grid, mlt_grid,
+                                       vmin, vmax, titles=titles, **renderer_kwargs)
+    print('Rendering: {0:.1f} s for {1} frames'.format(time.time()-t0, len(fluxgrids)))
@@ -24,9 +24,11 @@ setup(name='ovationpyme',
       " and packaged on Sourceforge by Redmon (NOAA NCEI), Machol, and Case "+\
       " for more information visit: https://sourceforge.net/projects/ovation-prime/",
       install_requires=['numpy','matplotlib','aacgmv2','geospacepy','logbook','scipy'],
+      extras_require={'numba': ['numba'], 'dataset': ['xarray', 'dask']},
       packages=['ovationpyme'],
       package_dir={'ovationpyme' : 'ovationpyme'},
       package_data={'ovationpyme': ['data/premodel/*.txt']}, #data names must be list
+      entry_points={'console_scripts': ['ovationpyme-nowcast=ovationpyme.ovation_service:main']},
       license='LICENSE.txt',
       zip_safe = False,
       classifiers = [